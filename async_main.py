@@ -0,0 +1,157 @@
+"""
+Asyncio facade over the SQL-backed UserCollection and UserStatusCollection.
+
+Every call runs on a worker thread so the event loop never blocks on SQLite I/O:
+- Reads run on a pool of reader threads. The peewee database keeps one
+  connection per thread, so each reader holds its own connection.
+- Writes, including the CSV loaders, run on a single writer thread, because
+  SQLite allows only one writer at a time.
+
+The synchronous API in main.py is unchanged and can still be used alongside.
+
+Usage:
+    async with AsyncSocialNetwork(max_readers=8, max_pending=100) as network:
+        await network.add_user('dave03', 'dave03@uw.edu', 'Dave', 'Jones')
+        user = await network.search_user('dave03')
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import main
+import users
+from socialnetwork_model import database
+
+
+# Default number of reader threads
+DEFAULT_MAX_READERS = 4
+
+
+def _connect():
+    # Runs once in every worker thread: open that thread's own connection
+    database.connect(reuse_if_open=True)
+
+
+class AsyncSocialNetwork:
+    """
+    Async versions of the main.py user and status operations.
+
+    max_readers sets the number of reader threads. max_pending, if given,
+    caps how many calls may be queued or running at once; further callers
+    wait in the event loop until a slot frees up.
+    """
+
+    def __init__(self, user_collection=None, status_collection=None,
+                 max_readers=DEFAULT_MAX_READERS, max_pending=None):
+        self.user_collection = user_collection or users.UserCollection()
+        self.status_collection = status_collection or users.UserStatusCollection()
+        self._readers = ThreadPoolExecutor(max_workers=max_readers,
+                                           thread_name_prefix='socialnetwork-reader',
+                                           initializer=_connect)
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix='socialnetwork-writer',
+                                          initializer=_connect)
+        self._pending = asyncio.Semaphore(max_pending) if max_pending else None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """
+        Waits for queued calls to finish and stops the worker threads
+        """
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+
+    async def _run(self, executor, func, *args):
+        call = functools.partial(func, *args)
+        loop = asyncio.get_running_loop()
+        if self._pending is None:
+            return await loop.run_in_executor(executor, call)
+        async with self._pending:
+            return await loop.run_in_executor(executor, call)
+
+    async def _read(self, func, *args):
+        return await self._run(self._readers, func, *args)
+
+    async def _write(self, func, *args):
+        return await self._run(self._writer, func, *args)
+
+    async def load_users(self, filename, chunk_size=main.DEFAULT_CHUNK_SIZE):
+        """
+        Async main.bulk_load_users; returns its inserted/skipped/rejected report
+        """
+        return await self._write(main.bulk_load_users, filename, self.user_collection, chunk_size)
+
+    async def load_status_updates(self, filename, chunk_size=main.DEFAULT_CHUNK_SIZE,
+                                  rejects_filename=None):
+        """
+        Async main.bulk_load_status_updates; returns its inserted/skipped/rejected report
+        """
+        return await self._write(main.bulk_load_status_updates, filename,
+                                 self.status_collection, chunk_size, rejects_filename)
+
+    async def add_user(self, user_id, email, user_first_name, user_last_name):
+        """
+        Adds a new user. Returns False if the user_id already exists.
+        """
+        return await self._write(self.user_collection.add_user,
+                                 user_id, user_first_name, user_last_name, email)
+
+    async def delete_user(self, user_id):
+        """
+        Deletes a user and their statuses. Returns False if the user does not exist.
+        """
+        return await self._write(self.user_collection.delete_user, user_id)
+
+    async def search_user(self, user_id):
+        """
+        Returns the user dict, or None if the user does not exist
+        """
+        return await self._read(self.user_collection.search_user, user_id)
+
+    async def search_users(self, user_ids):
+        """
+        Returns {user_id: user dict or None} for every requested user_id
+        """
+        return await self._read(self.user_collection.search_users, user_ids)
+
+    async def add_status(self, user_id, status_text):
+        """
+        Adds a status update. Returns False if the user does not exist.
+        """
+        return await self._write(self.status_collection.add_status_update, user_id, status_text)
+
+    async def delete_status(self, status_id):
+        """
+        Deletes a status update. Returns False if it does not exist.
+        """
+        return await self._write(self.status_collection.delete_status_update, status_id)
+
+    async def search_status(self, status_id):
+        """
+        Returns the status dict, or None if the status does not exist
+        """
+        return await self._read(self.status_collection.search_status_update, status_id)
+
+    async def search_status_updates(self, status_ids):
+        """
+        Returns {status_id: status dict or None} for every requested status_id
+        """
+        return await self._read(self.status_collection.search_status_updates, status_ids)
+
+    async def get_user_timeline(self, user_id, after_status_id=None,
+                                limit=users.DEFAULT_TIMELINE_LIMIT):
+        """
+        Async main.get_user_timeline
+        """
+        return await self._read(self.status_collection.get_user_timeline,
+                                user_id, after_status_id, limit)
+
+    async def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        """
+        Async main.search_status_text
+        """
+        return await self._read(self.status_collection.search_status_text, query, limit)
@@ -0,0 +1,312 @@
+"""
+Benchmark harness for the storage backends and the main.py loaders.
+
+Generates synthetic users and statuses shaped like accounts.csv and
+status_updates.csv (100 statuses per user, like the shipped data), then times
+on every storage backend (see storage.py):
+- load:        CSV rows inserted with add_users/add_status_updates in chunks
+- lookup:      random search_user and search_status_update calls
+- batch:       search_users/search_status_updates with 500 IDs per call
+- timeline:    get_user_timeline of random users
+- search:      search_status_text with FTS5 queries (SQLite backends only)
+- delete:      delete_user with its statuses cascading
+It also times the main.py CSV loaders and, on the loaded data, the
+users.py collections themselves:
+- search_user and search_status_update, with and without the cache and
+  the fast path, over a hot set of IDs looked up repeatedly
+- get_user_timeline and search_status_text
+- delete_user and delete_users
+
+The data is generated from a fixed seed, so runs at the same scale are
+comparable across commits. Results are written as JSON.
+
+Usage (from the repository root):
+    python benchmarks/bench_collections.py --scale 10k --output bench_results.json
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import main
+import socialnetwork_model
+import storage
+import users
+
+
+# Number of statuses per scale; there is one user per 100 statuses
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+STATUSES_PER_USER = 100
+SEED = 20230720
+
+FIRST_NAMES = ('Brittaney', 'Keri', 'Michal', 'Carolina', 'Abbie', 'Ada', 'Dave', 'Ezra')
+LAST_NAMES = ('Gentry', 'Royce', 'Hollyanne', 'Mateusz', 'Kissel', 'Deloris', 'Jones')
+DOMAINS = ('goodmail.com', 'funmail.com', 'testmail.com')
+WORDS = ('happy', 'running', 'park', 'coffee', 'weekend', 'code', 'music', 'rain',
+         'friends', 'dinner', 'travel', 'movie', 'book', 'game', 'sunny', 'tired')
+
+LOAD_CHUNK_SIZE = 10_000
+MAX_LOOKUPS = 10_000
+BATCH_SIZE = 500
+SEARCH_TERMS = ('running', 'coffee AND park', 'mus*', '"sunny weekend"')
+# Options of the collections timed by bench_collection_scenarios
+COLLECTION_OPTIONS = {
+    'plain': {},
+    'cache': {'cache_size': 10_000},
+    'fast_path': {'fast_path': True},
+    'cache_fast_path': {'cache_size': 10_000, 'fast_path': True},
+}
+# Share of the sampled IDs looked up repeatedly by the search scenarios
+HOT_SET_RATIO = 10
+
+
+def generate_data(directory, statuses):
+    """
+    Writes users.csv and statuses.csv for the given number of statuses.
+    Returns (users_filename, statuses_filename, user_ids).
+    """
+    rng = random.Random(SEED)
+    user_count = max(1, statuses // STATUSES_PER_USER)
+    users_filename = os.path.join(directory, 'users.csv')
+    statuses_filename = os.path.join(directory, 'statuses.csv')
+    user_ids = []
+    with open(users_filename, mode='w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['USER_ID', 'NAME', 'LASTNAME', 'EMAIL'])
+        for number in range(user_count):
+            name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            user_id = f'{name}.{last_name}{number}'
+            user_ids.append(user_id)
+            writer.writerow([user_id, name, last_name, f'{user_id}@{rng.choice(DOMAINS)}'])
+    with open(statuses_filename, mode='w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['STATUS_ID', 'USER_ID', 'STATUS_TEXT'])
+        for number in range(statuses):
+            user_id = user_ids[number % user_count]
+            writer.writerow([f'{user_id}_{number:08d}', user_id,
+                             ' '.join(rng.choices(WORDS, k=rng.randint(3, 10)))])
+    return users_filename, statuses_filename, user_ids
+
+
+def read_chunks(filename, columns):
+    """
+    Yields lists of dicts keyed by columns, LOAD_CHUNK_SIZE rows at a time
+    """
+    with open(filename, newline='', encoding='utf-8') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)
+        chunk = []
+        for row in reader:
+            chunk.append(dict(zip(columns, row)))
+            if len(chunk) == LOAD_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def timed(results, name, operations, func):
+    """
+    Runs func(), stores its timing under results[name] and returns its result
+    """
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    results[name] = {'seconds': round(seconds, 6), 'operations': operations,
+                     'per_operation_us': round(seconds / max(operations, 1) * 1e6, 3)}
+    return value
+
+
+def bench_backend(name, directory, users_filename, statuses_filename, user_ids, statuses):
+    """
+    Times every operation on a fresh instance of the named backend
+    """
+    if name == 'peewee':
+        socialnetwork_model.database.init(os.path.join(directory, 'peewee.db'),
+                                          pragmas=socialnetwork_model.profile_pragmas('bulk-load'))
+        backend = storage.get_backend(name)
+    elif name == 'sqlite':
+        backend = storage.get_backend(name, filename=os.path.join(directory, 'sqlite.db'),
+                                      profile='bulk-load')
+    else:
+        backend = storage.get_backend(name)
+    rng = random.Random(SEED)
+    results = {}
+
+    def load():
+        for chunk in read_chunks(users_filename, storage.USER_FIELDS):
+            backend.add_users(chunk)
+        # The CSV status_ids are kept as source_id, like the main.py loaders do
+        for chunk in read_chunks(statuses_filename, ('source_id', 'user_id', 'status_text')):
+            backend.add_status_updates(chunk)
+    timed(results, 'load', len(user_ids) + statuses, load)
+
+    lookups = min(MAX_LOOKUPS, len(user_ids))
+    sample_users = rng.sample(user_ids, lookups)
+    sample_statuses = [rng.randint(1, statuses) for _ in range(lookups)]
+    timed(results, 'lookup_user', lookups,
+          lambda: [backend.search_user(user_id) for user_id in sample_users])
+    timed(results, 'lookup_status', lookups,
+          lambda: [backend.search_status_update(status_id) for status_id in sample_statuses])
+    timed(results, 'batch_users', lookups,
+          lambda: [backend.search_users(sample_users[i:i + BATCH_SIZE])
+                   for i in range(0, lookups, BATCH_SIZE)])
+    timed(results, 'batch_statuses', lookups,
+          lambda: [backend.search_status_updates(sample_statuses[i:i + BATCH_SIZE])
+                   for i in range(0, lookups, BATCH_SIZE)])
+    timed(results, 'timeline', lookups,
+          lambda: [backend.get_user_timeline(user_id) for user_id in sample_users])
+    # The memory backend matches plain words, not the FTS5 query syntax
+    if name != 'memory':
+        timed(results, 'search', len(SEARCH_TERMS) * 10,
+              lambda: [backend.search_status_text(term) for term in SEARCH_TERMS * 10])
+    deletes = sample_users[:max(1, lookups // 100)]
+    timed(results, 'delete_cascade', len(deletes),
+          lambda: [backend.delete_user(user_id) for user_id in deletes])
+    backend.close()
+    return results
+
+
+def bench_loaders(directory, users_filename, statuses_filename, user_ids, statuses):
+    """
+    Times the main.py bulk and parallel CSV loaders on the peewee collections
+    """
+    results = {}
+    for loader in ('bulk', 'parallel'):
+        socialnetwork_model.database.init(os.path.join(directory, f'{loader}.db'),
+                                          pragmas=socialnetwork_model.profile_pragmas('bulk-load'))
+        socialnetwork_model.create_tables()
+        user_collection = users.UserCollection()
+        status_collection = users.UserStatusCollection()
+        rejects = os.path.join(directory, f'{loader}.rejected.csv')
+        if loader == 'bulk':
+            timed(results, 'bulk_load_users', len(user_ids),
+                  lambda: main.bulk_load_users(users_filename, user_collection))
+            timed(results, 'bulk_load_status_updates', statuses,
+                  lambda: main.bulk_load_status_updates(statuses_filename, status_collection,
+                                                        rejects_filename=rejects))
+        else:
+            timed(results, 'parallel_load_users', len(user_ids),
+                  lambda: main.parallel_load_users(users_filename, user_collection))
+            timed(results, 'parallel_load_status_updates', statuses,
+                  lambda: main.parallel_load_status_updates(statuses_filename, status_collection,
+                                                            rejects_filename=rejects))
+        socialnetwork_model.database.close()
+    return results
+
+
+def bench_collection_scenarios(directory, users_filename, statuses_filename, user_ids,
+                               statuses):
+    """
+    Times the users.py collection methods on data loaded by the main.py bulk
+    loaders, once per entry of COLLECTION_OPTIONS, then the deletes
+    """
+    socialnetwork_model.database.init(os.path.join(directory, 'collections.db'),
+                                      pragmas=socialnetwork_model.profile_pragmas('bulk-load'))
+    socialnetwork_model.create_tables()
+    main.bulk_load_users(users_filename, users.UserCollection())
+    main.bulk_load_status_updates(statuses_filename, users.UserStatusCollection(),
+                                  rejects_filename=os.path.join(directory, 'collections.rejected.csv'))
+    rng = random.Random(SEED)
+    lookups = min(MAX_LOOKUPS, len(user_ids))
+    hot_users = rng.sample(user_ids, max(1, lookups // HOT_SET_RATIO))
+    hot_statuses = [rng.randint(1, statuses) for _ in hot_users]
+    sample_users = rng.choices(hot_users, k=lookups)
+    sample_statuses = rng.choices(hot_statuses, k=lookups)
+    results = {}
+    for name, options in COLLECTION_OPTIONS.items():
+        user_collection = users.UserCollection(**options)
+        status_collection = users.UserStatusCollection(**options)
+        scenario = results[name] = {}
+        timed(scenario, 'search_user', lookups,
+              lambda: [user_collection.search_user(user_id) for user_id in sample_users])
+        timed(scenario, 'search_status_update', lookups,
+              lambda: [status_collection.search_status_update(status_id)
+                       for status_id in sample_statuses])
+        for collection in (user_collection, status_collection):
+            if collection.fast_path is not None:
+                collection.fast_path.close()
+    status_collection = users.UserStatusCollection()
+    timed(results, 'get_user_timeline', lookups,
+          lambda: [status_collection.get_user_timeline(user_id) for user_id in sample_users])
+    timed(results, 'search_status_text', len(SEARCH_TERMS) * 10,
+          lambda: [status_collection.search_status_text(term) for term in SEARCH_TERMS * 10])
+    user_collection = users.UserCollection()
+    victims = rng.sample(user_ids, min(len(user_ids), 2 * max(1, lookups // 100)))
+    deletes, bulk_deletes = victims[:len(victims) // 2], victims[len(victims) // 2:]
+    timed(results, 'delete_user', len(deletes),
+          lambda: [user_collection.delete_user(user_id) for user_id in deletes])
+    timed(results, 'delete_users', len(bulk_deletes),
+          lambda: user_collection.delete_users(bulk_deletes))
+    socialnetwork_model.database.close()
+    return results
+
+
+def git_commit():
+    """
+    Returns the current git commit hash, or None outside a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scale, backends):
+    """
+    Runs the whole suite at the given scale and returns the results dict
+    """
+    statuses = SCALES[scale] if scale in SCALES else int(scale)
+    with tempfile.TemporaryDirectory() as directory:
+        users_filename, statuses_filename, user_ids = generate_data(directory, statuses)
+        results = {name: bench_backend(name, directory, users_filename, statuses_filename,
+                                       user_ids, statuses)
+                   for name in backends}
+        results['main_loaders'] = bench_loaders(directory, users_filename, statuses_filename,
+                                                user_ids, statuses)
+        results['collections'] = bench_collection_scenarios(directory, users_filename,
+                                                            statuses_filename, user_ids, statuses)
+    return {
+        'scale': scale,
+        'users': len(user_ids),
+        'statuses': statuses,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'results': results,
+    }
+
+
+def parse_args():
+    """
+    Parses the command line
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 2)[1])
+    parser.add_argument('--scale', default='10k',
+                        help=f"number of statuses: {', '.join(SCALES)} or an integer")
+    parser.add_argument('--backend', action='append', choices=sorted(storage.BACKENDS),
+                        help='backend to benchmark (repeatable, default: all)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON results file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    # Keep per-row INFO log lines out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(arguments.scale, arguments.backend or sorted(storage.BACKENDS))
+    with open(arguments.output, mode='w', encoding='utf-8') as output:
+        json.dump(report, output, indent=2)
+    print(json.dumps(report['results'], indent=2))
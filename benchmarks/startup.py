@@ -0,0 +1,107 @@
+"""
+Startup-time benchmark for the command-line entry points.
+
+Each scenario runs in a fresh interpreter, like a CLI wrapper or cron job
+would. The fastest wall time of several runs (far less sensitive to a busy
+machine than the median) is compared with its budget, counted on top of the
+time to import the third-party and standard modules every entry point needs
+(peewee above all), measured in alternation with it. The budgets thus cover the
+repository's own startup work, which is what changes can make slower:
+- import_main:    import main
+- import_menu:    import menu
+- first_query:    import main and look up a user in a new database file
+                  (includes creating the schema)
+- warm_query:     the same on a database file whose schema is up to date
+                  (the schema version check skips create_tables)
+Exits with status 1 if any scenario is over its budget. The repository is
+byte-compiled first, so stale bytecode is not timed as startup work.
+
+Usage (from the repository root):
+    python benchmarks/startup.py [--runs 15] [--budget-scale 1.0]
+"""
+import argparse
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported by every entry point that the repository does not control
+DEPENDENCIES = 'import csv, logging, sqlite3, peewee, playhouse.sqlite_ext'
+
+# Milliseconds, on top of importing DEPENDENCIES, about twice the fastest of
+# 20 runs measured: the imports of main and menu take about 10 ms, as in the
+# original code base, a query on an up-to-date file about 10 ms more and one
+# that creates the schema about 20 ms more
+BUDGETS_MS = {
+    'import_main': 20,
+    'import_menu': 20,
+    'first_query': 40,
+    'warm_query': 25,
+}
+
+QUERY = ('import main; '
+         'main.init_user_collection().search_user("nobody")')
+
+SCENARIOS = {
+    'import_main': 'import main',
+    'import_menu': 'import menu',
+    'first_query': QUERY,
+    'warm_query': QUERY,
+}
+
+
+def run_once(code, directory):
+    """
+    Returns the wall time, in milliseconds, of running code in a new interpreter
+    """
+    environment = dict(os.environ, PYTHONPATH=REPOSITORY)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=directory, env=environment, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure(name, runs):
+    """
+    Returns the time of a scenario on top of importing DEPENDENCIES: the
+    fastest of runs runs of each, alternated so both see the same machine load
+    """
+    times = []
+    dependencies = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as directory:
+            if name == 'warm_query':
+                run_once(QUERY, directory)
+            dependencies.append(run_once(DEPENDENCIES, directory))
+            times.append(run_once(SCENARIOS[name], directory))
+    return min(times) - min(dependencies)
+
+
+def main(runs, budget_scale):
+    """
+    Prints the time of every scenario and returns the names of the ones
+    over budget
+    """
+    compileall.compile_dir(REPOSITORY, quiet=1)
+    over = []
+    for name, budget in BUDGETS_MS.items():
+        elapsed = measure(name, runs)
+        budget *= budget_scale
+        status = 'ok' if elapsed <= budget else 'OVER BUDGET'
+        print(f'{name:12} {elapsed:8.1f} ms  (budget {budget:.0f} ms)  {status}')
+        if elapsed > budget:
+            over.append(name)
+    return over
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 2)[1])
+    parser.add_argument('--runs', type=int, default=15, help='runs per scenario')
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help='multiplier applied to every budget, for slower machines')
+    arguments = parser.parse_args()
+    if main(arguments.runs, arguments.budget_scale):
+        sys.exit(1)
@@ -0,0 +1,50 @@
+"""
+Compares the memory used by the in-memory status collections in user_status.py:
+the dict of UserStatus objects and the compact __slots__-based backend.
+
+Usage (from the repository root):
+    python benchmarks/status_memory.py [number_of_statuses] [number_of_users]
+"""
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_setup  # pylint: disable=wrong-import-position
+import user_status  # pylint: disable=wrong-import-position
+
+
+def measure(collection_class, statuses, users):
+    """
+    Returns the bytes allocated while loading statuses into a new collection
+    """
+    gc.collect()
+    tracemalloc.start()
+    collection = collection_class()
+    for number in range(statuses):
+        # Build the strings per row, like a CSV reader does
+        user_id = f'user.{number % users:07d}'
+        collection.add_status(f'{user_id}_{number:07d}', user_id, 'Status text')
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def main(statuses=100000, users=1000):
+    """
+    Prints the memory used by each backend for the same statuses
+    """
+    log_setup.set_operation_level('add_status', logging.WARNING)
+    baseline = measure(user_status.UserStatusCollection, statuses, users)
+    compact = measure(user_status.CompactUserStatusCollection, statuses, users)
+    print(f'{statuses} statuses from {users} users')
+    print(f'UserStatusCollection:        {baseline / 2**20:8.1f} MiB')
+    print(f'CompactUserStatusCollection: {compact / 2**20:8.1f} MiB '
+          f'({compact / baseline:.0%} of the dict of objects)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,113 @@
+"""
+Change feed over the change_log table, for downstream consumers (search
+indexes, analytics) that need to follow the Users and Status tables
+incrementally instead of re-reading them.
+
+Triggers append one (seq, entity, operation, entity_id) row for every insert,
+update and delete, whichever code path made it: the collections, the bulk
+loaders, upserts and cascading deletes all show up. entity is 'user' or
+'status', operation is 'insert', 'update' or 'delete', and entity_id is the
+user_id or status_id; consumers read the current row themselves when they
+need its values.
+
+A consumer remembers the last seq it processed and asks for what follows:
+    seq = latest_seq()            # after an initial full read of the tables
+    for change in read_changes(seq):
+        ...
+        seq = change['seq']
+    acknowledge('search-index', seq)
+compact_changes() then drops the entries every consumer has acknowledged.
+
+Only the unsharded database file has a change log: these functions raise
+RuntimeError while the process has a sharded database open (see
+socialnetwork_model.ShardSet), rather than report no changes.
+"""
+import logging
+from peewee import fn
+from socialnetwork_model import ChangeConsumer, ChangeLog, database, sharded
+
+
+# Default number of changes returned by read_changes
+DEFAULT_CHANGE_LIMIT = 1000
+
+# Entries deleted per transaction by compact_changes
+COMPACT_CHUNK_SIZE = 10000
+
+
+def _check_unsharded():
+    if sharded():
+        raise RuntimeError('The change feed is not available for a sharded database')
+
+
+def latest_seq():
+    """
+    Returns the seq of the most recent change, or 0 if there is none
+    """
+    _check_unsharded()
+    return ChangeLog.select(fn.MAX(ChangeLog.seq)).scalar() or 0
+
+
+def read_changes(since_seq=0, limit=DEFAULT_CHANGE_LIMIT):
+    """
+    Returns an iterator over up to limit changes with a seq greater than
+    since_seq, oldest first, as dicts with 'seq', 'entity', 'operation' and
+    'entity_id'. The rows are streamed from the cursor; each page is a range
+    seek on the primary key.
+    """
+    _check_unsharded()
+    query = (ChangeLog
+             .select(ChangeLog.seq, ChangeLog.entity, ChangeLog.operation, ChangeLog.entity_id)
+             .where(ChangeLog.seq > since_seq)
+             .order_by(ChangeLog.seq)
+             .limit(limit)
+             .dicts())
+    return query.iterator()
+
+
+def acknowledge(consumer, seq):
+    """
+    Records that consumer has processed every change up to seq. A consumer's
+    position never moves backwards.
+    """
+    _check_unsharded()
+    (ChangeConsumer
+     .insert(name=consumer, seq=seq)
+     .on_conflict(conflict_target=[ChangeConsumer.name],
+                  update={ChangeConsumer.seq: fn.MAX(ChangeConsumer.seq, seq)})
+     .execute())
+
+
+def forget_consumer(consumer):
+    """
+    Stops holding back compaction for consumer. Returns False if it is unknown.
+    """
+    _check_unsharded()
+    return ChangeConsumer.delete().where(ChangeConsumer.name == consumer).execute() == 1
+
+
+def compact_changes(upto_seq=None):
+    """
+    Deletes the changes with a seq up to upto_seq, by default up to the lowest
+    position acknowledged by the consumers (nothing is deleted while no
+    consumer is registered). Deletes in chunks of COMPACT_CHUNK_SIZE, each in
+    its own transaction. Returns the number of changes deleted.
+    """
+    _check_unsharded()
+    if upto_seq is None:
+        upto_seq = ChangeConsumer.select(fn.MIN(ChangeConsumer.seq)).scalar()
+        if upto_seq is None:
+            return 0
+    deleted = 0
+    while True:
+        with database.atomic():
+            oldest = (ChangeLog
+                      .select(ChangeLog.seq)
+                      .where(ChangeLog.seq <= upto_seq)
+                      .order_by(ChangeLog.seq)
+                      .limit(COMPACT_CHUNK_SIZE))
+            count = ChangeLog.delete().where(ChangeLog.seq.in_(oldest)).execute()
+        deleted += count
+        if count < COMPACT_CHUNK_SIZE:
+            break
+    logging.info("Change log compacted up to seq %s: %s entries deleted.", upto_seq, deleted)
+    return deleted
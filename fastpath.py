@@ -0,0 +1,146 @@
+"""
+Raw sqlite3 data access for the hot single-row operations of the collections.
+
+Skips peewee's query building, SQL compilation and model instantiation: each
+operation runs one fixed SQL string on a plain sqlite3 connection, whose
+statement cache keeps it compiled between calls, and rows come back as
+namedtuples. Each thread gets its own connection.
+
+Enabled per instance with UserCollection(fast_path=True) and
+UserStatusCollection(fast_path=True). storage.SqliteBackend opens its
+connection with connect() and runs the same statements.
+"""
+import sqlite3
+import threading
+from collections import namedtuple
+import metrics
+import socialnetwork_model
+
+
+UserRow = namedtuple('UserRow', ('user_id', 'user_name', 'user_last_name', 'user_email'))
+StatusRow = namedtuple('StatusRow', ('status_id', 'user_id', 'status_text'))
+
+# Compiled statements kept per connection. Above sqlite3's default of 128, as
+# the IN (...) lookups of storage.SqliteBackend compile one statement per
+# distinct chunk length and must not evict the fixed statements below.
+STATEMENT_CACHE_SIZE = 256
+
+SELECT_USER = ('SELECT user_id, user_name, user_last_name, user_email '
+               'FROM users WHERE user_id = ?')
+INSERT_USER = ('INSERT INTO users (user_id, user_name, user_last_name, user_email) '
+               'VALUES (?, ?, ?, ?)')
+DELETE_USER = 'DELETE FROM users WHERE user_id = ?'
+DELETE_USER_STATUSES = 'DELETE FROM status WHERE user_id = ?'
+SELECT_STATUS = 'SELECT status_id, user_id, status_text FROM status WHERE status_id = ?'
+INSERT_STATUS = 'INSERT INTO status (user_id, status_text) VALUES (?, ?)'
+DELETE_STATUS = 'DELETE FROM status WHERE status_id = ?'
+
+
+def connect(filename, profile=None, check_same_thread=True):
+    """
+    Opens a sqlite3 connection on filename with the pragmas of profile (by
+    default the active profile of the shared database), first bringing the
+    schema up to date if the file is new or outdated
+    """
+    connection = sqlite3.connect(filename, cached_statements=STATEMENT_CACHE_SIZE,
+                                 check_same_thread=check_same_thread)
+    if socialnetwork_model.schema_version(connection) < socialnetwork_model.SCHEMA_VERSION:
+        socialnetwork_model.create_tables(filename)
+    for name, value in socialnetwork_model.profile_pragmas(
+            profile or socialnetwork_model.active_profile):
+        connection.execute(f'PRAGMA {name} = {value}')
+    return connection
+
+
+class FastPath:
+    """
+    Prepared-statement access to the Users and Status tables of a database file
+    """
+
+    def __init__(self, filename=None, profile=None):
+        self.filename = filename or socialnetwork_model.database.database
+        # The process-wide profile of the shared database unless one is given
+        self.profile = socialnetwork_model.profile_name(profile or socialnetwork_model.active_profile)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """
+        The calling thread's connection, opened on first use
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = connect(self.filename, self.profile)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """
+        Closes the calling thread's connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _execute(self, connection, sql, params):
+        cursor = connection.execute(sql, params)
+        if metrics.is_enabled():
+            metrics.count_statement(cursor.rowcount)
+        return cursor
+
+    def get_user(self, user_id):
+        """
+        Returns a UserRow, or None if user_id does not exist
+        """
+        row = self._execute(self.connection, SELECT_USER, (user_id,)).fetchone()
+        return UserRow._make(row) if row is not None else None
+
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        """
+        Returns False if user_id already exists
+        """
+        connection = self.connection
+        try:
+            with connection:
+                self._execute(connection, INSERT_USER,
+                              (user_id, user_name, user_last_name, user_email))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def delete_user(self, user_id):
+        """
+        Deletes a user and their statuses in one transaction.
+        Returns False if user_id does not exist.
+        """
+        connection = self.connection
+        with connection:
+            self._execute(connection, DELETE_USER_STATUSES, (user_id,))
+            return self._execute(connection, DELETE_USER, (user_id,)).rowcount == 1
+
+    def get_status(self, status_id):
+        """
+        Returns a StatusRow, or None if status_id does not exist
+        """
+        row = self._execute(self.connection, SELECT_STATUS, (status_id,)).fetchone()
+        return StatusRow._make(row) if row is not None else None
+
+    def add_status(self, user_id, status_text):
+        """
+        Returns the new status_id, or None if user_id does not exist
+        """
+        connection = self.connection
+        try:
+            with connection:
+                return self._execute(connection, INSERT_STATUS, (user_id, status_text)).lastrowid
+        except sqlite3.IntegrityError:
+            return None
+
+    def delete_status(self, status_id):
+        """
+        Returns False if status_id does not exist
+        """
+        connection = self.connection
+        with connection:
+            return self._execute(connection, DELETE_STATUS, (status_id,)).rowcount == 1
@@ -0,0 +1,132 @@
+"""
+Logging configuration shared by every module of the social network.
+
+Records are put on an in-memory queue by the calling thread and written to the
+log file by a background QueueListener thread, so adds and deletes never wait
+on file I/O. The file is rotated by size (or by time, if 'when' is given).
+
+Per-operation sampling keeps bulk paths from flooding the log: an operation is
+the name of the function that logs (e.g. 'add_user'), and
+set_operation_sampling('add_user', 1000) keeps one INFO record in every 1000
+from it; warnings and errors are never sampled out. set_operation_level raises
+the minimum level of a single operation instead.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+
+LOG_FILENAME = 'log_07_20_2023.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+_handler = None
+_setup_lock = threading.Lock()
+_operation_levels = {}
+_sample_rates = {}
+_sample_counters = {}
+
+
+class OperationSampler(logging.Filter):
+    """
+    Applies the per-operation minimum levels, then keeps one in every N
+    records below WARNING from each sampled operation
+    """
+
+    def filter(self, record):
+        min_level = _operation_levels.get(record.funcName)
+        if min_level is not None and record.levelno < min_level:
+            return False
+        rate = _sample_rates.get(record.funcName)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        count = _sample_counters.get(record.funcName, 0)
+        _sample_counters[record.funcName] = count + 1
+        return count % rate == 0
+
+
+class _DeferredQueueHandler(logging.Handler):
+    """
+    Root handler installed by configure_logging. The file handler and the
+    listener thread are only created when the first record arrives, so
+    importing a module that configures logging costs next to nothing.
+    """
+
+    def __init__(self, settings):
+        super().__init__()
+        self._settings = settings
+        self._records = None
+
+    def _start(self):
+        # logging.handlers pulls in socket, pickle and friends: import it here
+        import logging.handlers  # pylint: disable=import-outside-toplevel
+        filename, max_bytes, backup_count, when = self._settings
+        if when:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                filename, when=when, backupCount=backup_count, encoding='utf-8', delay=True)
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                filename, maxBytes=max_bytes, backupCount=backup_count,
+                encoding='utf-8', delay=True)
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, file_handler)
+        listener.start()
+        atexit.register(listener.stop)
+        self._records = records
+
+    def emit(self, record):
+        # Called with the handler lock held. The queue never leaves the
+        # process, so the record is enqueued as is and its %-style message
+        # formatted later by the listener thread.
+        try:
+            if self._records is None:
+                self._start()
+            self._records.put_nowait(record)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+
+def configure_logging(filename=LOG_FILENAME, level=logging.INFO,
+                      max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT, when=None):
+    """
+    Routes the root logger through a queue to a rotating log file.
+
+    Rotation is by size (max_bytes) unless when is given (e.g. 'midnight'),
+    in which case it is by time. Only the first call has any effect, and the
+    file and listener thread are set up on the first logged record.
+    """
+    global _handler  # pylint: disable=global-statement
+    with _setup_lock:
+        if _handler is not None:
+            return
+        _handler = _DeferredQueueHandler((filename, max_bytes, backup_count, when))
+        _handler.addFilter(OperationSampler())
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level)
+
+
+def set_operation_sampling(operation, rate):
+    """
+    Keeps one in every rate INFO/DEBUG records logged by the function named
+    operation. A rate of 1 or None turns sampling off for it.
+    """
+    if rate is None or rate <= 1:
+        _sample_rates.pop(operation, None)
+    else:
+        _sample_rates[operation] = rate
+    _sample_counters.pop(operation, None)
+
+
+def set_operation_level(operation, level):
+    """
+    Drops records below level logged by the function named operation.
+    A level of None removes the override.
+    """
+    if level is None:
+        _operation_levels.pop(operation, None)
+    else:
+        _operation_levels[operation] = level
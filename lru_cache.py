@@ -0,0 +1,152 @@
+"""
+Bounded least-recently-used cache with an optional time-to-live, used by the
+collections in users.py to serve repeated lookups of hot IDs from memory.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Maps keys to values, keeping at most maxsize entries.
+
+    When full, the least recently used entry is evicted. If ttl (seconds) is
+    given, entries older than that are treated as missing. The hits, misses and
+    evictions counters are exposed through stats(). All methods are thread-safe.
+
+    Loads from the database run outside the lock, so a value loaded before a
+    concurrent write may arrive after the writer's invalidate(). Loaders take
+    an epoch with begin_load() first and cache through end_load(), which drops
+    the values of keys invalidated since that epoch.
+    """
+
+    def __init__(self, maxsize, ttl=None):
+        if maxsize <= 0:
+            raise ValueError('maxsize must be a positive number')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expiry time or None, value), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation
+        self._epoch = 0
+        # Epoch of the last invalidate_where() or clear()
+        self._cleared = 0
+        # key -> epoch of its last invalidate(), kept while loads are running
+        self._invalidated = {}
+        self._loads = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """
+        Returns (True, value) if key is cached and fresh, (False, None) otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def _put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl if self.ttl else None, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        """
+        Caches value under key, evicting the least recently used entry if full
+        """
+        with self._lock:
+            self._put(key, value)
+
+    def begin_load(self):
+        """
+        Returns the epoch to pass to end_load() once the values are loaded
+        """
+        with self._lock:
+            self._loads += 1
+            return self._epoch
+
+    def end_load(self, epoch, values=None):
+        """
+        Caches the {key: value} items of values, except those whose key was
+        invalidated since begin_load() returned epoch
+        """
+        with self._lock:
+            self._loads -= 1
+            if values and self._cleared <= epoch:
+                for key, value in values.items():
+                    if self._invalidated.get(key, epoch) <= epoch:
+                        self._put(key, value)
+            if not self._loads:
+                self._invalidated.clear()
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value of key, or calls loader() and caches its
+        result (None included, so lookups of missing IDs are cached as well)
+        """
+        found, value = self.lookup(key)
+        if not found:
+            epoch = self.begin_load()
+            try:
+                value = loader()
+            except BaseException:
+                self.end_load(epoch)
+                raise
+            self.end_load(epoch, {key: value})
+        return value
+
+    def invalidate(self, key):
+        """
+        Drops key from the cache, if present
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._epoch += 1
+            if self._loads:
+                self._invalidated[key] = self._epoch
+
+    def invalidate_where(self, predicate):
+        """
+        Drops every entry for which predicate(key, value) is true. Values being
+        loaded cannot be tested, so none of them is cached.
+        """
+        with self._lock:
+            stale = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+            for key in stale:
+                del self._entries[key]
+            self._epoch += 1
+            self._cleared = self._epoch
+
+    def clear(self):
+        """
+        Drops all entries; the counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+            self._cleared = self._epoch
+
+    def stats(self):
+        """
+        Returns the hit/miss/eviction counters and the current size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
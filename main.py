@@ -11,16 +11,47 @@ Author: Bita Massoudi
 Date: 7/25/2023
 """
 import csv
+import io
+import itertools
+import os
+from collections import deque
+import socialnetwork_model
 import users
 import user_status
 import logging
+import metrics
 
 
-def init_user_collection():
+# Modules only some entry points need (gzip, hashlib, storage and the
+# multiprocessing machinery) are imported inside the functions that use them,
+# which keeps the import of main, and the start of menu.py, short.
+
+# Number of CSV rows written per transaction by the bulk loaders
+DEFAULT_CHUNK_SIZE = 10000
+
+# Columns read from the user and status CSV files, in this order
+USER_COLUMNS = ('user_id', 'email', 'name', 'lastname')
+STATUS_COLUMNS = ('status_id', 'user_id', 'status_text')
+
+# Target size of the slices of a CSV file parsed by each parallel loader task
+PARALLEL_RANGE_SIZE = 16 * 1024 * 1024
+
+# Bytes read from each end of a file to fingerprint it for resumable imports
+FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
+
+# Write buffer of the CSV exports
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+
+def init_user_collection(profile=None):
     """
     Creates and returns a new instance of UserCollection
+
+    profile optionally selects a database performance profile
+    ('durable', 'bulk-load' or 'read-heavy') for the whole process; it must
+    be chosen before the first query (see socialnetwork_model.use_profile).
     """
-    return users.UserCollection()
+    return users.UserCollection(profile)
 
 
 
@@ -31,48 +62,321 @@ def init_status_collection():
     return user_status.UserStatusCollection()
 
 
+def init_collections(profile=None, shards=None):
+    """
+    Creates and returns a (user collection, status collection) pair on the
+    SQL database
+
+    shards is the number of database files the network is partitioned
+    into (see sharding.py); by default it is read from the
+    SOCIALNETWORK_SHARDS environment variable, falling back to 1, the
+    unsharded socialnetwork.db.
+    """
+    if shards is None:
+        shards = int(os.environ.get(socialnetwork_model.SHARDS_ENV_VAR, 1))
+    if shards == 1:
+        return users.UserCollection(profile), users.UserStatusCollection(profile)
+    import sharding  # pylint: disable=import-outside-toplevel
+    shard_set = socialnetwork_model.ShardSet(shards, profile=profile)
+    return sharding.ShardedUserCollection(shard_set), sharding.ShardedUserStatusCollection(shard_set)
+
+
+def init_storage(backend=None, **options):
+    """
+    Creates and returns a storage backend (see storage.py)
+
+    backend is 'memory', 'peewee' or 'sqlite'; by default it is read from the
+    SOCIALNETWORK_BACKEND environment variable, falling back to 'peewee'.
+    A backend has the methods of both collections, so it can be passed to
+    the functions of this module as the user and the status collection.
+    """
+    import storage  # pylint: disable=import-outside-toplevel
+    return storage.get_backend(backend, **options)
+
+
+def init_snapshot(filename=None, in_memory=True, refresh_interval=None):
+    """
+    Creates and returns a read-only Snapshot of the database (see snapshot.py),
+    usable in place of a collection by the search functions below.
+    refresh_interval, in seconds, refreshes the copy from a background thread.
+    """
+    import snapshot  # pylint: disable=import-outside-toplevel
+    return snapshot.Snapshot(filename, in_memory, refresh_interval)
+
+
+@metrics.instrument('main.load_users')
 def load_users(filename, user_collection_instance):
     """
     Opens a CSV file with user data and adds it to an existing instance of UserCollection
 
     Requirements:
+    - Column names are matched case-insensitively ('user_id' or 'USER_ID').
     - If a user_id already exists, it will ignore it and continue to the next.
     - Returns False if there are any errors (such as empty fields in the source CSV file)
     - Otherwise, it returns True.
     """
     try:
-        with open(filename, mode='r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                if not user_collection_instance.add_user\
-                            (row['user_id'], row['email'], row['name'], row['lastname']):
-                    print('Error: Invalid data in CSV file')
-                    return False
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            for chunk in _read_chunks(csv.reader(csv_file), USER_COLUMNS, DEFAULT_CHUNK_SIZE):
+                for user_id, email, name, lastname in chunk:
+                    if not all((user_id, email, name, lastname)) or \
+                            not user_collection_instance.add_user(user_id, name, lastname, email):
+                        print('Error: Invalid data in CSV file')
+                        return False
         return True
     except FileNotFoundError as error:
         print(f'Error: {error}')
         return False
-    except KeyError as error:
-        print(f'Error: {error}')
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
         return False
 
 
-def save_users(filename, user_collection_instance):
+def _read_chunks(csv_reader, columns, chunk_size):
+    """
+    Reads the header of csv_reader, then yields lists of at most chunk_size
+    tuples holding the values of columns (None where a value is missing).
+    Column names are matched case-insensitively, so both 'user_id' and
+    'USER_ID' headers are accepted.
+    """
+    header = next(csv_reader, None)
+    if header is None:
+        return
+    positions = _column_positions(header, columns)
+    while True:
+        rows = list(itertools.islice(csv_reader, chunk_size))
+        if not rows:
+            return
+        # Blank lines are skipped, as csv.DictReader does
+        yield [_pick(row, positions) for row in rows if row]
+
+
+def _column_positions(header, columns):
+    """
+    Returns the index of each of columns in the header row, or None if absent
+    """
+    names = [name.strip().lower() for name in header]
+    return [names.index(column) if column in names else None for column in columns]
+
+
+def _pick(row, positions):
+    """
+    Returns the values of row at positions as a tuple
+    """
+    return tuple(row[position] if position is not None and position < len(row) else None
+                 for position in positions)
 
+
+def _load_user_chunks(chunks, user_collection_instance, on_commit=None):
+    """
+    Validates and inserts chunks of USER_COLUMNS tuples, one transaction per chunk.
+    on_commit(rows_in_chunk), if given, runs inside each chunk's transaction.
+    Returns the inserted/skipped/rejected report.
+    """
+    report = {'inserted': 0, 'skipped': 0, 'rejected': 0}
+    for chunk in chunks:
+        valid_rows = []
+        for user_id, email, name, lastname in chunk:
+            if not all(field and field.strip() for field in (user_id, email, name, lastname)):
+                report['rejected'] += 1
+                continue
+            valid_rows.append({'user_id': user_id,
+                               'user_email': email,
+                               'user_name': name,
+                               'user_last_name': lastname})
+        with user_collection_instance.atomic():
+            inserted = user_collection_instance.add_users(valid_rows) if valid_rows else 0
+            if on_commit is not None:
+                on_commit(len(chunk))
+        report['inserted'] += inserted
+        report['skipped'] += len(valid_rows) - inserted
+    return report
+
+
+@metrics.instrument('main.bulk_load_users')
+def bulk_load_users(filename, user_collection_instance, chunk_size=DEFAULT_CHUNK_SIZE):
     """
-    Saves all users in user_collection into a CSV file
+    Streams a CSV file with user data into an existing instance of UserCollection,
+    writing chunk_size rows per transaction.
 
     Requirements:
-    - If there is an existing file, it will overwrite it.
-    - Returns False if there are any errors (such as an invalid filename).
-    - Otherwise, it returns True.
+    - If a user_id already exists, it will ignore it and continue to the next.
+    - Rows with missing or empty fields are rejected and the load continues.
+    - Returns a report dict with the number of rows 'inserted', 'skipped' and 'rejected'.
+    - Returns None if the file cannot be read.
+    """
+    try:
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            chunks = _read_chunks(csv.reader(csv_file), USER_COLUMNS, chunk_size)
+            return _load_user_chunks(chunks, user_collection_instance)
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+@metrics.instrument('main.sync_users')
+def sync_users(filename, user_collection_instance, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Applies a full CSV file of users to an existing instance of UserCollection:
+    new users are added and existing ones updated where their values differ,
+    without deleting anyone (so no status update is cascaded away).
+
+    Requirements:
+    - Rows with missing or empty fields are rejected and the sync continues.
+    - Returns a report dict with the number of rows 'inserted', 'updated',
+      'unchanged' and 'rejected'.
+    - Returns None if the file cannot be read.
     """
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0}
     try:
-        with open(filename, mode='w', newline='', encoding='utf-8') as csv_file:
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            for chunk in _read_chunks(csv.reader(csv_file), USER_COLUMNS, chunk_size):
+                valid_rows = [{'user_id': user_id,
+                               'user_email': email,
+                               'user_name': name,
+                               'user_last_name': lastname}
+                              for user_id, email, name, lastname in chunk
+                              if all(field and field.strip()
+                                     for field in (user_id, email, name, lastname))]
+                report['rejected'] += len(chunk) - len(valid_rows)
+                if valid_rows:
+                    for key, count in user_collection_instance.upsert_users(
+                            valid_rows, chunk_size).items():
+                        report[key] += count
+        return report
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+def _split_byte_ranges(filename, start, range_size):
+    """
+    Splits filename from byte offset start into (start, end) ranges of about
+    range_size bytes, each ending right after a newline
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, mode='rb') as csv_file:
+        while start < size:
+            end = start + range_size
+            if end < size:
+                csv_file.seek(end)
+                csv_file.readline()
+                end = csv_file.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _parse_byte_range(task):
+    """
+    Worker process task: parses one byte range of a CSV file into tuples
+    of the values at the given column positions
+    """
+    filename, start, end, positions = task
+    with open(filename, mode='rb') as csv_file:
+        csv_file.seek(start)
+        text = csv_file.read(end - start).decode('utf-8')
+    return [_pick(row, positions) for row in csv.reader(io.StringIO(text, newline='')) if row]
+
+
+def _parallel_read_chunks(filename, columns, chunk_size, workers):
+    """
+    Parallel counterpart of _read_chunks: the file is split into newline-aligned
+    byte ranges that a process pool parses, and the parsed tuples are yielded
+    in file order in lists of chunk_size. Only a few ranges are in flight at
+    once, so memory stays bounded on very large files.
+    """
+    with open(filename, mode='rb') as csv_file:
+        header_line = csv_file.readline()
+    if not header_line:
+        return
+    header = next(csv.reader([header_line.decode('utf-8')]))
+    positions = _column_positions(header, columns)
+    tasks = iter([(filename, start, end, positions) for start, end
+                  in _split_byte_ranges(filename, len(header_line), PARALLEL_RANGE_SIZE)])
+    workers = workers or os.cpu_count() or 1
+    # pylint: disable-next=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(pool.submit(_parse_byte_range, task)
+                        for task in itertools.islice(tasks, 2 * workers))
+        rows = []
+        while pending:
+            rows.extend(pending.popleft().result())
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.submit(_parse_byte_range, task))
+            full = len(rows) - len(rows) % chunk_size
+            for position in range(0, full, chunk_size):
+                yield rows[position:position + chunk_size]
+            rows = rows[full:]
+        if rows:
+            yield rows
+
+
+@metrics.instrument('main.parallel_load_users')
+def parallel_load_users(filename, user_collection_instance, workers=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as bulk_load_users, but the CSV file is parsed by a pool of worker
+    processes while this process does all database writes.
+
+    Requirements:
+    - workers sets the number of parser processes (default: one per CPU).
+    - Records must not contain embedded newlines, since the file is split on them.
+    - Returns the same report as bulk_load_users, or None if the file cannot be read.
+    """
+    try:
+        chunks = _parallel_read_chunks(filename, USER_COLUMNS, chunk_size, workers)
+        return _load_user_chunks(chunks, user_collection_instance)
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+def save_users(filename, user_collection_instance):
+    """
+    Saves all users in user_collection into a CSV file.
+    Kept for existing callers, same as export_users.
+    """
+    return export_users(filename, user_collection_instance)
+
+
+def _open_export(filename, compress):
+    """
+    Opens filename for a CSV export, gzip-compressed if compress is True or,
+    when compress is None, if filename ends with '.gz'
+    """
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if compress:
+        import gzip  # pylint: disable=import-outside-toplevel
+        return gzip.open(filename, mode='wt', newline='', encoding='utf-8')
+    return open(filename, mode='w', newline='', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE)
+
+
+def _export_rows(filename, header, rows, compress):
+    """
+    Streams rows into a CSV file with the given header.
+    Returns False if there are any errors, True otherwise.
+    """
+    try:
+        with _open_export(filename, compress) as csv_file:
             writer = csv.writer(csv_file)
-            writer.writerow(['user_id', 'email', 'name', 'lastname'])
-            for user in user_collection_instance.database.values():
-                writer.writerow([user.user_id, user.email, user.user_name, user.user_last_name])
+            writer.writerow(header)
+            writer.writerows(rows)
         return True
     except FileNotFoundError as error:
         print(f'Error: File not found - {error}')
@@ -83,21 +387,91 @@ def save_users(filename, user_collection_instance):
     except csv.Error as error:
         print(f'Error: CSV related error - {error}')
         return False
-    except Exception as error:
-        print(f'Error: Unexpected error - {error}')
-        return False
+
+
+def export_users(filename, user_collection_instance, user_id=None, compress=None):
+    """
+    Exports the users of the SQL database into a CSV file that bulk_load_users can read back
+
+    Requirements:
+    - Rows are streamed from the database, so memory use does not depend on the table size.
+    - If user_id is given, only that user is exported.
+    - The file is gzip-compressed if compress is True, or if it is None and
+      the filename ends with '.gz'.
+    - If there is an existing file, it will overwrite it.
+    - Returns False if there are any errors (such as an invalid filename).
+    - Otherwise, it returns True.
+    """
+    return _export_rows(filename, ['user_id', 'email', 'name', 'lastname'],
+                        user_collection_instance.iter_users(user_id), compress)
+
+
+def export_status_updates(filename, status_collection_instance, user_id=None, compress=None):
+    """
+    Exports the status updates of the SQL database into a CSV file
+
+    Requirements:
+    - Rows are streamed from the database, so memory use does not depend on the table size.
+    - If user_id is given, only the status updates of that user are exported.
+    - The file is gzip-compressed if compress is True, or if it is None and
+      the filename ends with '.gz'.
+    - If there is an existing file, it will overwrite it.
+    - Returns False if there are any errors (such as an invalid filename).
+    - Otherwise, it returns True.
+    """
+    return _export_rows(filename, ['status_id', 'user_id', 'status_text'],
+                        status_collection_instance.iter_status_updates(user_id), compress)
+
+
+def search_status_updates(status_ids, status_collection_instance):
+    """
+    Searches for many statuses at once in status_collection_instance.
+
+    Requirements:
+    - Returns a dict mapping every requested status_id to its status dict,
+      or to None if it does not exist.
+    """
+    return status_collection_instance.search_status_updates(status_ids)
+
 
 def search_status(status_id, status_collection_instance):
     """
     Searches for a status in status_collection_instance (which is an instance of UserStatusCollection).
 
     Requirements:
-    - If the status is found, returns the corresponding UserStatus instance.
+    - If the status is found, returns the corresponding UserStatus instance
+      (a status dict with the SQL collections).
     - Otherwise, it returns None.
     """
     return status_collection_instance.search_status(status_id)
 
 
+def get_user_timeline(user_id, status_collection_instance, after_status_id=None,
+                      limit=users.DEFAULT_TIMELINE_LIMIT):
+    """
+    Returns one page of the status updates of user_id.
+
+    Requirements:
+    - Returns a list of dicts with 'status_id', 'user_id' and 'status_text',
+      ordered by status_id, with at most limit entries.
+    - Pass the status_id of the last entry as after_status_id to get the next page.
+    - An empty list means there are no more status updates.
+    """
+    return status_collection_instance.get_user_timeline(user_id, after_status_id, limit)
+
+
+def search_status_text(query, status_collection_instance, limit=users.DEFAULT_SEARCH_LIMIT):
+    """
+    Searches the text of all status updates.
+
+    Requirements:
+    - Returns a list of at most limit dicts with 'status_id', 'user_id',
+      'snippet' and 'rank', best match first.
+    - Returns an empty list if nothing matches or the query is malformed.
+    """
+    return status_collection_instance.search_status_text(query, limit)
+
+
 def update_status(user_id, status_id, status_text, status_collection_instance):
     """
     Updates the values of an existing status
@@ -105,7 +479,7 @@ def update_status(user_id, status_id, status_text, status_collection_instance):
     - Returns False if there any errors.
     - Otherwise, it returns True.
     """
-    return status_collection_instance.modify_status(user_id, status_id, status_text)
+    return status_collection_instance.modify_status(status_id, user_id, status_text)
 
 
 def delete_status(status_id, status_collection_instance):
@@ -116,38 +490,31 @@ def delete_status(status_id, status_collection_instance):
     - Returns False if there are any errors (such as status_id not found)
     - Otherwise, it returns True.
     """
-    logging.info(f"Deleting status with ID '{status_id}'.")
-    if status_id not in status_collection_instance.statuses:
-        logging.error(f"An error occurred while trying to delete status with ID '{status_id}'. Status ID does not exist.")
-        return False
-
-    try:
-        del status_collection_instance.statuses[status_id]
-        logging.info(f"Status with ID '{status_id}' deleted successfully.")
-        return True
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while trying to delete status with ID '{status_id}': {e}")
-        return False
+    logging.info("Deleting status with ID '%s'.", status_id)
+    return status_collection_instance.delete_status(status_id)
 
 
 
+@metrics.instrument('main.load_status_updates')
 def load_status_updates(filename, status_collection_instance):
     """
     Opens a CSV file with status data and adds it to an existing instance of UserStatusCollection
 
     Requirements:
+    - Column names are matched case-insensitively ('status_id' or 'STATUS_ID').
     - If a status_id already exists, it will ignore it and continue to the next.
     - Returns False if there are any errors (such as empty fields in the source CSV file)
     - Otherwise, it returns True.
     """
     try:
-        with open(filename, mode='r', encoding='utf-8') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            for row in csv_reader:
-                if not status_collection_instance.add_status(row['status_id'],
-                                                             row['user_id'], row['status_text']):
-                    print('Error: Invalid data in CSV file')
-                    return False
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            for chunk in _read_chunks(csv.reader(csv_file), STATUS_COLUMNS, DEFAULT_CHUNK_SIZE):
+                for status_id, user_id, status_text in chunk:
+                    if not all((status_id, user_id, status_text)) or \
+                            not status_collection_instance.add_status(status_id, user_id,
+                                                                      status_text):
+                        print('Error: Invalid data in CSV file')
+                        return False
         return True
     except FileNotFoundError as error:
         print(f'Error: {error}')
@@ -160,34 +527,294 @@ def load_status_updates(filename, status_collection_instance):
         return False
 
 
-def save_status_updates(filename, status_collection_instance):
+def _status_row(status_id, user_id, status_text):
+    """
+    Returns the Status row of a CSV status: its status_id is kept as the
+    row's status_id if it is a number, and as its source_id in every case
     """
-    Saves all statuses in status_collection into a CSV file
+    source_id = status_id.strip() if status_id else None
+    return {'status_id': socialnetwork_model.numeric_status_id(source_id),
+            'user_id': user_id,
+            'status_text': status_text,
+            'source_id': source_id or None}
+
+
+def _load_status_chunks(chunks, status_collection_instance, rejects_filename,
+                        on_commit=None, append_rejects=False):
+    """
+    Validates chunks of STATUS_COLUMNS tuples against the known user_ids and
+    inserts the valid rows, one transaction per chunk. Rows whose status_id
+    was already loaded are skipped. Rejected rows are written to
+    rejects_filename once their chunk is committed; the file is only created
+    if there are any, or appended to if append_rejects is True.
+    on_commit(rows_in_chunk), if given, runs inside each chunk's transaction.
+    Returns the inserted/skipped/rejected report.
+    """
+    report = {'inserted': 0, 'skipped': 0, 'rejected': 0}
+    known_user_ids = status_collection_instance.known_user_ids()
+    rejects_file = None
+    rejects_writer = None
+    try:
+        for chunk in chunks:
+            valid_rows = []
+            rejected_rows = []
+            for status_id, user_id, status_text in chunk:
+                if not (user_id and status_text):
+                    rejected_rows.append([status_id, user_id, status_text, 'missing field'])
+                elif user_id not in known_user_ids:
+                    rejected_rows.append([status_id, user_id, status_text, 'unknown user_id'])
+                else:
+                    valid_rows.append(_status_row(status_id, user_id, status_text))
+            with status_collection_instance.atomic():
+                inserted = (status_collection_instance.add_status_updates(valid_rows)
+                            if valid_rows else 0)
+                if on_commit is not None:
+                    on_commit(len(chunk))
+            report['inserted'] += inserted
+            report['skipped'] += len(valid_rows) - inserted
+            if rejected_rows:
+                if rejects_writer is None:
+                    # pylint: disable=consider-using-with
+                    rejects_file = open(rejects_filename, mode='a' if append_rejects else 'w',
+                                        newline='', encoding='utf-8')
+                    rejects_writer = csv.writer(rejects_file)
+                    if rejects_file.tell() == 0:
+                        rejects_writer.writerow(['status_id', 'user_id', 'status_text', 'reason'])
+                rejects_writer.writerows(rejected_rows)
+                report['rejected'] += len(rejected_rows)
+        return report
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+
+
+@metrics.instrument('main.bulk_load_status_updates')
+def bulk_load_status_updates(filename, status_collection_instance,
+                             chunk_size=DEFAULT_CHUNK_SIZE, rejects_filename=None):
+    """
+    Streams a CSV file with status data into an existing instance of the SQL
+    UserStatusCollection, writing chunk_size rows per transaction.
 
     Requirements:
-    - If there is an existing file, it will overwrite it.
-    - Returns False if there are any errors (such as an invalid filename).
-    - Otherwise, it returns True.
+    - The set of known user_ids is read once and every row is checked against it
+      before insertion, so rows for unknown users never reach the database.
+    - A numeric status_id is kept as the status update's status_id; any other
+      one (such as 'Brittaney.Gentry86_00001') gets a new status_id.
+    - If a status_id was already loaded (or, when numeric, already exists), the
+      row is skipped, so loading the same file again adds nothing.
+    - Rejected rows (empty fields or unknown user_id) are written, with a 'reason'
+      column, to rejects_filename (default: '<filename>.rejected.csv') and the
+      load continues.
+    - Returns a report dict with the number of rows 'inserted', 'skipped' and 'rejected'.
+    - Returns None if the file cannot be read.
     """
+    if rejects_filename is None:
+        rejects_filename = f'{filename}.rejected.csv'
     try:
-        with open(filename, mode='w', newline='', encoding='utf-8') as csv_file:
-            writer = csv.writer(csv_file)
-            writer.writerow(['status_id', 'user_id', 'status_text'])
-            for status in status_collection_instance.database.values():
-                writer.writerow([status.status_id, status.user_id, status.status_text])
+        with open(filename, mode='r', encoding='utf-8', newline='') as csv_file:
+            chunks = _read_chunks(csv.reader(csv_file), STATUS_COLUMNS, chunk_size)
+            return _load_status_chunks(chunks, status_collection_instance, rejects_filename)
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+@metrics.instrument('main.parallel_load_status_updates')
+def parallel_load_status_updates(filename, status_collection_instance, workers=None,
+                                 chunk_size=DEFAULT_CHUNK_SIZE, rejects_filename=None):
+    """
+    Same as bulk_load_status_updates, but the CSV file is parsed by a pool of
+    worker processes while this process does all database writes.
+
+    Requirements:
+    - workers sets the number of parser processes (default: one per CPU).
+    - Records must not contain embedded newlines, since the file is split on them.
+    - Returns the same report as bulk_load_status_updates, or None if the file
+      cannot be read.
+    """
+    if rejects_filename is None:
+        rejects_filename = f'{filename}.rejected.csv'
+    try:
+        chunks = _parallel_read_chunks(filename, STATUS_COLUMNS, chunk_size, workers)
+        return _load_status_chunks(chunks, status_collection_instance, rejects_filename)
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+def _file_fingerprint(filename, kind):
+    """
+    Identifies an import file by its kind, size, modification time, inode and
+    first and last bytes. The modification time and inode tell apart a file
+    rewritten with the same size and ends, such as a re-export edited in the
+    middle, which the sampled bytes alone would not.
+    """
+    import hashlib  # pylint: disable=import-outside-toplevel
+    stat = os.stat(filename)
+    size = stat.st_size
+    digest = hashlib.sha256(
+        f'{kind}:{size}:{stat.st_mtime_ns}:{stat.st_dev}:{stat.st_ino}:'.encode('utf-8'))
+    with open(filename, mode='rb') as csv_file:
+        digest.update(csv_file.read(FINGERPRINT_SAMPLE_SIZE))
+        if size > FINGERPRINT_SAMPLE_SIZE:
+            csv_file.seek(max(FINGERPRINT_SAMPLE_SIZE, size - FINGERPRINT_SAMPLE_SIZE))
+            digest.update(csv_file.read())
+    return digest.hexdigest()
+
+
+class _CheckpointedReader:
+    """
+    Reads a CSV file in chunks of lines from a byte offset, keeping offset
+    just past the last chunk handed out
+    """
+
+    def __init__(self, csv_file, offset):
+        self.csv_file = csv_file
+        self.offset = offset
+
+    def chunks(self, positions, chunk_size):
+        """
+        Yields lists of tuples of the values at positions, chunk_size lines at a time
+        """
+        self.csv_file.seek(self.offset)
+        lines = iter(self.csv_file.readline, b'')
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            self.offset = self.csv_file.tell()
+            rows = csv.reader(line.decode('utf-8') for line in chunk)
+            yield [_pick(row, positions) for row in rows if row]
+
+
+def _refuse_sharded(collection_instance):
+    """
+    Returns True, after logging an error, for a sharded collection or a
+    storage backend other than the shared database: their chunks never commit
+    in the transaction of the checkpoint, so a resumed import could load a
+    chunk twice
+    """
+    if getattr(collection_instance, 'shards', None) is not None:
+        logging.error("Resumable imports are not supported on a sharded database; use the bulk loaders.")
         return True
+    if getattr(collection_instance, 'database',
+               socialnetwork_model.database) is not socialnetwork_model.database:
+        logging.error("Resumable imports are only supported on the peewee collections; use the bulk loaders.")
+        return True
+    return False
+
+
+def _resumable_load(filename, kind, columns, chunk_size, load_chunks):
+    """
+    Runs load_chunks(chunks, on_commit, resuming) over filename, starting from
+    its last checkpoint. on_commit saves the checkpoint in the transaction of
+    each committed chunk. Returns the report of load_chunks plus
+    'resumed_from_row', the number of rows committed by earlier runs.
+    """
+    Checkpoint = socialnetwork_model.ImportCheckpoint
+    fingerprint = _file_fingerprint(filename, kind)
+    checkpoint = Checkpoint.get_or_none(Checkpoint.fingerprint == fingerprint)
+    with open(filename, mode='rb') as csv_file:
+        header = next(csv.reader([csv_file.readline().decode('utf-8')]), [])
+        positions = _column_positions(header, columns)
+        if checkpoint is None:
+            reader = _CheckpointedReader(csv_file, csv_file.tell())
+            resumed_from_row = 0
+        else:
+            reader = _CheckpointedReader(csv_file, checkpoint.byte_offset)
+            resumed_from_row = checkpoint.rows_committed
+            logging.info("Resuming import of '%s' at row %s.", filename, resumed_from_row)
+        progress = {'rows': resumed_from_row}
+
+        def save_checkpoint(rows, completed=False):
+            progress['rows'] += rows
+            Checkpoint.replace(fingerprint=fingerprint, filename=filename,
+                               byte_offset=reader.offset, rows_committed=progress['rows'],
+                               completed=completed).execute()
+
+        if checkpoint is not None and checkpoint.completed:
+            chunks = iter(())
+        else:
+            chunks = reader.chunks(positions, chunk_size)
+        report = load_chunks(chunks, save_checkpoint, checkpoint is not None)
+        save_checkpoint(0, completed=True)
+    report['resumed_from_row'] = resumed_from_row
+    return report
+
+
+@metrics.instrument('main.resumable_load_users')
+def resumable_load_users(filename, user_collection_instance, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Same as bulk_load_users, but restartable: after each committed chunk, the
+    file's fingerprint, byte offset and rows committed are saved in the
+    import_checkpoint table. Running it again on the same file continues
+    right after the last committed chunk; a completed file is not loaded twice.
+
+    Requirements:
+    - Records must not contain embedded newlines, since the file is read by lines.
+    - Returns the bulk_load_users report for this run, plus 'resumed_from_row'.
+    - Returns None if the file cannot be read, or if the collection is sharded.
+    """
+    if _refuse_sharded(user_collection_instance):
+        return None
+    try:
+        return _resumable_load(
+            filename, 'users', USER_COLUMNS, chunk_size,
+            lambda chunks, on_commit, resuming: _load_user_chunks(
+                chunks, user_collection_instance, on_commit))
     except FileNotFoundError as error:
-        print(f'Error: File not found - {error}')
-        return False
-    except PermissionError as error:
-        print(f'Error: Permission denied - {error}')
-        return False
+        print(f'Error: {error}')
+        return None
     except csv.Error as error:
-        print(f'Error: CSV related error - {error}')
-        return False
-    except Exception as error:
-        print(f'Error: Unexpected error - {error}')
-        return False
+        print(f'CSV Error: {error}')
+        return None
+
+
+@metrics.instrument('main.resumable_load_status_updates')
+def resumable_load_status_updates(filename, status_collection_instance,
+                                  chunk_size=DEFAULT_CHUNK_SIZE, rejects_filename=None):
+    """
+    Same as bulk_load_status_updates, but restartable: after each committed
+    chunk, the file's fingerprint, byte offset and rows committed are saved in
+    the import_checkpoint table. Running it again on the same file continues
+    right after the last committed chunk, appending to the rejects file;
+    a completed file is not loaded twice. A copy or a touched version of the
+    file starts a new import, whose rows already loaded are skipped.
+
+    Requirements:
+    - Records must not contain embedded newlines, since the file is read by lines.
+    - Returns the bulk_load_status_updates report for this run, plus 'resumed_from_row'.
+    - Returns None if the file cannot be read, or if the collection is sharded.
+    """
+    if _refuse_sharded(status_collection_instance):
+        return None
+    if rejects_filename is None:
+        rejects_filename = f'{filename}.rejected.csv'
+    try:
+        return _resumable_load(
+            filename, 'statuses', STATUS_COLUMNS, chunk_size,
+            lambda chunks, on_commit, resuming: _load_status_chunks(
+                chunks, status_collection_instance, rejects_filename, on_commit, resuming))
+    except FileNotFoundError as error:
+        print(f'Error: {error}')
+        return None
+    except csv.Error as error:
+        print(f'CSV Error: {error}')
+        return None
+
+
+def save_status_updates(filename, status_collection_instance):
+    """
+    Saves all statuses in status_collection into a CSV file.
+    Kept for existing callers, same as export_status_updates.
+    """
+    return export_status_updates(filename, status_collection_instance)
 
 
 def add_user(user_id, email, user_first_name, user_last_name, user_collection_instance):
@@ -201,7 +828,7 @@ def add_user(user_id, email, user_first_name, user_last_name, user_collection_in
     if user_collection_instance.add_user() returns False).
     - Otherwise, it returns True.
     """
-    return user_collection_instance.add_user(user_id, email, user_first_name, user_last_name)
+    return user_collection_instance.add_user(user_id, user_first_name, user_last_name, email)
 
 
 def update_user(user_id, email, user_first_name, user_last_name, user_collection_instance):
@@ -211,7 +838,32 @@ def update_user(user_id, email, user_first_name, user_last_name, user_collection
     - Returns False if there any errors.
     - Otherwise, it returns True.
     """
-    return user_collection_instance.modify_user(user_id, email, user_first_name, user_last_name)
+    return user_collection_instance.modify_user(user_id, user_first_name, user_last_name, email)
+
+
+def upsert_users(rows, user_collection_instance):
+    """
+    Adds new users and updates the existing ones whose values changed.
+
+    Requirements:
+    - rows is a sequence of dicts keyed by 'user_id', 'user_name',
+      'user_last_name' and 'user_email'.
+    - Returns a dict with the number of rows 'inserted', 'updated' and 'unchanged'.
+    """
+    return user_collection_instance.upsert_users(rows)
+
+
+def upsert_status_updates(rows, status_collection_instance):
+    """
+    Adds new status updates and updates the existing ones whose values changed.
+
+    Requirements:
+    - rows is a sequence of dicts keyed by 'status_id', 'user_id' and 'status_text'.
+    - Rows whose user_id does not exist are rejected.
+    - Returns a dict with the number of rows 'inserted', 'updated', 'unchanged'
+      and 'rejected'.
+    """
+    return status_collection_instance.upsert_statuses(rows)
 
 
 def delete_user(user_id, user_collection_instance):
@@ -225,6 +877,17 @@ def delete_user(user_id, user_collection_instance):
     return user_collection_instance.delete_user(user_id)
 
 
+def delete_users(user_ids, user_collection_instance):
+    """
+    Deletes many users, and all their status updates, from user_collection_instance.
+
+    Requirements:
+    - user_ids that do not exist are ignored.
+    - Returns a dict with the number of 'users' and 'statuses' deleted.
+    """
+    return user_collection_instance.delete_users(user_ids)
+
+
 def search_user(user_id, user_collection_instance):
     """
     Searches for a user in user_collection_instance (which is an instance of UserCollection).
@@ -234,3 +897,92 @@ def search_user(user_id, user_collection_instance):
     - Otherwise, it returns None.
     """
     return user_collection_instance.search_user(user_id)
+
+
+def search_users(user_ids, user_collection_instance):
+    """
+    Searches for many users at once in user_collection_instance.
+
+    Requirements:
+    - Returns a dict mapping every requested user_id to its user dict,
+      or to None if it does not exist.
+    """
+    return user_collection_instance.search_users(user_ids)
+
+
+def count_users(user_collection_instance):
+    """
+    Returns the total number of users.
+
+    Requirements:
+    - Read from the counters maintained by the database triggers, not counted.
+    """
+    return user_collection_instance.count_users()
+
+
+def count_status_updates(status_collection_instance, user_id=None):
+    """
+    Returns the number of status updates of user_id, or of all users.
+
+    Requirements:
+    - Returns None if user_id does not exist.
+    """
+    return status_collection_instance.count_status_updates(user_id)
+
+
+def top_users(status_collection_instance, limit=users.DEFAULT_TOP_USERS):
+    """
+    Returns the most active users.
+
+    Requirements:
+    - Returns a list of at most limit (user_id, status_count) tuples,
+      highest status_count first.
+    """
+    return status_collection_instance.top_users(limit)
+
+
+def rebuild_stats():
+    """
+    Recomputes the maintained statistics from the Users and Status tables,
+    e.g. after editing the database file by hand.
+
+    Requirements:
+    - Returns a dict with the new 'users' and 'statuses' totals.
+    """
+    return socialnetwork_model.rebuild_stats()
+
+
+def read_changes(since_seq=0, limit=None):
+    """
+    Returns the changes made to users and status updates after since_seq.
+
+    Requirements:
+    - Returns a list of at most limit dicts with 'seq', 'entity' ('user' or
+      'status'), 'operation' ('insert', 'update' or 'delete') and 'entity_id',
+      oldest first.
+    - Pass the seq of the last change processed to get the next ones.
+    - Raises RuntimeError while a sharded database is open: shard files
+      have no change log.
+    """
+    import changefeed  # pylint: disable=import-outside-toplevel
+    return list(changefeed.read_changes(since_seq, limit or changefeed.DEFAULT_CHANGE_LIMIT))
+
+
+def acknowledge_changes(consumer, seq):
+    """
+    Records that consumer has processed every change up to seq, so that
+    compact_changes may delete them.
+    """
+    import changefeed  # pylint: disable=import-outside-toplevel
+    changefeed.acknowledge(consumer, seq)
+
+
+def compact_changes(upto_seq=None):
+    """
+    Deletes changes already processed by every consumer (or up to upto_seq).
+
+    Requirements:
+    - Returns the number of changes deleted.
+    """
+    import changefeed  # pylint: disable=import-outside-toplevel
+    return changefeed.compact_changes(upto_seq)
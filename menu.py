@@ -3,14 +3,12 @@ Provides a basic frontend
 """
 import sys
 import logging
+import log_setup
 import main
-import user_status
-from user_status import UserStatusCollection
-from users import UserCollection
 
 
 # Configure the logging module
-logging.basicConfig(filename='log_07_20_2023.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_setup.configure_logging()
 
 
 def load_users():
@@ -19,7 +17,12 @@ def load_users():
     """
     logging.info('Loading user accounts from a file')
     filename = input('Enter filename of user file: ')
-    main.load_users(filename, user_collection)
+    report = main.bulk_load_users(filename, user_collection)
+    if report is None:
+        print("An error occurred while trying to load users")
+    else:
+        print(f"Users loaded: {report['inserted']} added, {report['skipped']} already "
+              f"existed, {report['rejected']} rejected")
 
 
 def load_status_updates():
@@ -28,7 +31,12 @@ def load_status_updates():
     """
     logging.info('Loading status updates from a file')
     filename = input('Enter filename for status file: ')
-    main.load_status_updates(filename, status_collection)
+    report = main.bulk_load_status_updates(filename, status_collection)
+    if report is None:
+        print("An error occurred while trying to load status updates")
+    else:
+        print(f"Status updates loaded: {report['inserted']} added, {report['skipped']} "
+              f"already existed, {report['rejected']} rejected (see {filename}.rejected.csv)")
 
 
 def add_user():
@@ -65,20 +73,20 @@ def update_user():
         print("User was successfully updated")
 
 
-def search_user(user_collection):
+def search_user():
     """
     Searches a user in the database
     """
     logging.info('Searching for a user in a file')
     user_id = input('Enter user ID to search: ')
     result = main.search_user(user_id, user_collection)
-    if not result.user_id:
+    if result is None:
         print("ERROR: User does not exist")
     else:
-        print(f"User ID: {result.user_id}")
-        print(f"Email: {result.email}")
-        print(f"Name: {result.user_name}")
-        print(f"Last name: {result.user_last_name}")
+        print(f"User ID: {result['user_id']}")
+        print(f"Email: {result['user_email']}")
+        print(f"Name: {result['user_name']}")
+        print(f"Last name: {result['user_last_name']}")
 
 
 def delete_user():
@@ -98,8 +106,9 @@ def save_users():
     Saves user database into a file
     """
     logging.info('Saving user information to a file')
-    filename = input('Enter filename for users file: ')
-    main.save_users(filename, user_collection)
+    filename = input('Enter filename for users file (.gz to compress): ')
+    if not main.export_users(filename, user_collection):
+        print("An error occurred while trying to save users")
 
 
 def add_status():
@@ -110,10 +119,7 @@ def add_status():
     user_id = input('User ID: ')
     status_id = input('Status ID: ')
     status_text = input('Status text: ')
-    # Create an instance of UserStatusCollection
-    status_collection_instance = UserStatusCollection()
-    # Call the add_status function on the status_collection instance
-    if not status_collection.add_status(user_id, status_id, status_text):
+    if not status_collection.add_status(status_id, user_id, status_text):
         print("An error occurred while trying to add new status")
     else:
         print("New status was successfully added")
@@ -140,12 +146,32 @@ def search_status():
     logging.info('Searching a status for a user')
     status_id = input('Enter status ID to search: ')
     result = main.search_status(status_id, status_collection)
-    if not result.status_id:  # Check if status was not found
+    if result is None:  # Check if status was not found
         print("ERROR: Status does not exist")
     else:
-        print(f"User ID: {result.user_id}")
-        print(f"Status ID: {result.status_id}")
-        print(f"Status text: {result.status_text}")
+        print(f"User ID: {result['user_id']}")
+        print(f"Status ID: {result['status_id']}")
+        print(f"Status text: {result['status_text']}")
+
+
+def show_timeline():
+    """
+    Shows the status updates of a user, one page at a time
+    """
+    logging.info('Showing the timeline of a user')
+    user_id = input('User ID: ')
+    after_status_id = None
+    while True:
+        page = main.get_user_timeline(user_id, status_collection, after_status_id)
+        if not page:
+            if after_status_id is None:
+                print("No status updates for this user")
+            return
+        for status in page:
+            print(f"{status['status_id']}: {status['status_text']}")
+        if input('Show more? (Y/N): ').strip().upper() != 'Y':
+            return
+        after_status_id = page[-1]['status_id']
 
 
 def delete_status():
@@ -165,8 +191,10 @@ def save_status():
     Saves status database into a file
     """
     logging.info('Saving a user status to a file')
-    filename = input('Enter filename for status file: ')
-    main.save_status_updates(filename, status_collection)
+    filename = input('Enter filename for status file (.gz to compress): ')
+    user_id = input('Only for user ID (leave blank for all users): ').strip() or None
+    if not main.export_status_updates(filename, status_collection, user_id):
+        print("An error occurred while trying to save statuses")
 
 
 def quit_program():
@@ -178,8 +206,7 @@ def quit_program():
 
 
 if __name__ == '__main__':
-    user_collection = main.init_user_collection()
-    status_collection = main.init_status_collection()
+    user_collection, status_collection = main.init_collections()
     menu_options = {
         'A': load_users,
         'B': load_status_updates,
@@ -193,6 +220,7 @@ if __name__ == '__main__':
         'J': search_status,
         'K': delete_status,
         'L': save_status,
+        'M': show_timeline,
         'Q': quit_program
     }
     while True:
@@ -209,6 +237,7 @@ if __name__ == '__main__':
                             J: Search status
                             K: Delete status
                             L: Save status database to file
+                            M: Show user timeline
                             Q: Quit
 
                             Please enter your choice: """)
@@ -0,0 +1,262 @@
+"""
+Opt-in, in-process metrics for the collections and the main.py loaders.
+
+Every function decorated with @instrument('name') records, while metrics are
+enabled:
+- the number of calls and a latency histogram (p50/p95/p99 in snapshot())
+- the SQL statements it issued and the rows they changed, nested calls
+  included (peewee statements through SqliteDatabase.execute_sql, raw sqlite3
+  ones through count_statement)
+Caches registered with register_cache add their hit rates to the snapshot,
+summed over every live cache registered under the same name.
+
+Metrics are off by default; enable() or the SOCIALNETWORK_METRICS=1
+environment variable turns them on. When off, an instrumented call costs one
+extra function call and a flag check.
+
+snapshot() returns the current values as a dict and write_prometheus(filename)
+dumps them in the Prometheus text exposition format.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+import weakref
+from socialnetwork_model import database
+
+
+METRICS_ENV_VAR = 'SOCIALNETWORK_METRICS'
+METRIC_PREFIX = 'socialnetwork'
+
+# Upper bounds of the latency histogram buckets, in seconds: four buckets per
+# doubling from 1 microsecond to about 2 minutes, then +Inf
+BUCKET_BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(108)) + (float('inf'),)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_enabled = False
+_lock = threading.Lock()
+_operations = {}
+# name -> WeakSet of the LRUCaches registered under it
+_caches = {}
+# Running per-thread totals; an instrumented call records the difference
+# between their values at its start and at its end
+_counters = threading.local()
+_execute_sql = None
+
+
+class _Operation:
+    """
+    Accumulated measurements of one instrumented operation
+    """
+    __slots__ = ('calls', 'errors', 'seconds', 'statements', 'rows', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.buckets = [0] * len(BUCKET_BOUNDS)
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of the calls
+        rank = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+
+def count_statement(rowcount=0):
+    """
+    Counts one SQL statement, and the rows it changed, for the calling thread
+    """
+    _counters.statements = getattr(_counters, 'statements', 0) + 1
+    if rowcount > 0:
+        _counters.rows = getattr(_counters, 'rows', 0) + rowcount
+
+
+def _counting_execute_sql(sql, params=None):
+    cursor = _execute_sql(sql, params)
+    count_statement(cursor.rowcount)
+    return cursor
+
+
+def enable():
+    """
+    Starts recording metrics
+    """
+    global _enabled, _execute_sql
+    with _lock:
+        if _execute_sql is None:
+            # Shadow the bound method on the shared database instance, so
+            # every peewee query of every thread is counted
+            _execute_sql = database.execute_sql
+            database.execute_sql = _counting_execute_sql
+        _enabled = True
+
+
+def disable():
+    """
+    Stops recording metrics; the values recorded so far are kept
+    """
+    global _enabled, _execute_sql
+    with _lock:
+        _enabled = False
+        if _execute_sql is not None:
+            del database.execute_sql
+            _execute_sql = None
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Drops every recorded value
+    """
+    with _lock:
+        _operations.clear()
+
+
+def register_cache(name, cache):
+    """
+    Adds the counters of an LRUCache to the snapshots under name
+    """
+    with _lock:
+        _caches.setdefault(name, weakref.WeakSet()).add(cache)
+
+
+def _cache_stats():
+    # Sums the counters of the live caches of each name
+    with _lock:
+        caches = sorted((name, list(members)) for name, members in _caches.items())
+    totals = {}
+    for name, members in caches:
+        stats = dict.fromkeys(('hits', 'misses', 'evictions', 'size', 'maxsize'), 0)
+        for cache in members:
+            for key, value in cache.stats().items():
+                stats[key] += value
+        totals[name] = stats
+    return totals
+
+
+def _record(name, func, args, kwargs):
+    statements = getattr(_counters, 'statements', 0)
+    rows = getattr(_counters, 'rows', 0)
+    failed = True
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            operation = _operations.get(name)
+            if operation is None:
+                operation = _operations[name] = _Operation()
+            operation.calls += 1
+            operation.errors += failed
+            operation.seconds += seconds
+            operation.statements += getattr(_counters, 'statements', 0) - statements
+            operation.rows += getattr(_counters, 'rows', 0) - rows
+            operation.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+
+
+def instrument(name):
+    """
+    Decorator recording the metrics of every call of the function as name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            return _record(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Returns {'operations': {name: {...}}, 'caches': {name: {...}}} with the
+    values recorded so far
+    """
+    with _lock:
+        operations = {}
+        for name, operation in sorted(_operations.items()):
+            calls = operation.calls
+            values = {
+                'calls': calls,
+                'errors': operation.errors,
+                'seconds': operation.seconds,
+                'mean_seconds': operation.seconds / calls,
+                'statements': operation.statements,
+                'statements_per_call': operation.statements / calls,
+                'rows': operation.rows,
+            }
+            for fraction in QUANTILES:
+                values[f'p{round(fraction * 100)}_seconds'] = operation.quantile(fraction)
+            operations[name] = values
+    caches = _cache_stats()
+    for stats in caches.values():
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else None
+    return {'operations': operations, 'caches': caches}
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else f'{bound:.6g}'
+
+
+def prometheus_text():
+    """
+    Returns the recorded values in the Prometheus text exposition format
+    """
+    with _lock:
+        operations = sorted(_operations.items())
+        lines = [f'# TYPE {METRIC_PREFIX}_operation_duration_seconds histogram']
+        for name, operation in operations:
+            seen = 0
+            for bound, count in zip(BUCKET_BOUNDS, operation.buckets):
+                seen += count
+                lines.append(f'{METRIC_PREFIX}_operation_duration_seconds_bucket'
+                             f'{{operation="{name}",le="{_format_bound(bound)}"}} {seen}')
+            lines.append(f'{METRIC_PREFIX}_operation_duration_seconds_sum'
+                         f'{{operation="{name}"}} {operation.seconds!r}')
+            lines.append(f'{METRIC_PREFIX}_operation_duration_seconds_count'
+                         f'{{operation="{name}"}} {operation.calls}')
+        for metric, attribute in (('operation_errors_total', 'errors'),
+                                  ('operation_statements_total', 'statements'),
+                                  ('operation_rows_total', 'rows')):
+            lines.append(f'# TYPE {METRIC_PREFIX}_{metric} counter')
+            lines.extend(f'{METRIC_PREFIX}_{metric}{{operation="{name}"}} '
+                         f'{getattr(operation, attribute)}'
+                         for name, operation in operations)
+    caches = _cache_stats()
+    for metric, key in (('cache_hits_total', 'hits'), ('cache_misses_total', 'misses'),
+                        ('cache_evictions_total', 'evictions')):
+        lines.append(f'# TYPE {METRIC_PREFIX}_{metric} counter')
+        lines.extend(f'{METRIC_PREFIX}_{metric}{{cache="{name}"}} {stats[key]}'
+                     for name, stats in caches.items())
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filename):
+    """
+    Writes prometheus_text() to filename, replacing it atomically so a
+    scraper never reads a partial file
+    """
+    temporary = f'{filename}.tmp'
+    with open(temporary, mode='w', encoding='utf-8') as output:
+        output.write(prometheus_text())
+    os.replace(temporary, filename)
+
+
+if os.environ.get(METRICS_ENV_VAR, '') not in ('', '0'):
+    enable()
@@ -0,0 +1,616 @@
+"""
+Sharded versions of the SQL-backed UserCollection and UserStatusCollection.
+
+The network is split across the database files of a socialnetwork_model.ShardSet.
+A user and all their status updates live in the shard picked by a stable hash
+of the user_id, so every write takes the writer lock of one shard only and
+writes to different shards run concurrently. Shard i allocates status_ids
+from i << STATUS_ID_SHIFT, so a status_id alone locates its shard.
+
+The collections have the same API as the ones in users.py and can be used
+with the main.py functions (main.init_collections(shards=N) creates them).
+Single-user and single-status operations go to one shard; bulk loads, batch
+lookups, counters, full-text search and scans fan out to the shards in
+parallel and merge the results.
+
+Limitations:
+- a status update cannot be moved to a user of another shard;
+- shard files have no change log, and changefeed raises RuntimeError while a
+  ShardSet is open;
+- the resumable loaders of main.py refuse sharded collections: a chunk commits
+  shard by shard, never atomically with its import checkpoint.
+
+rebalance() copies a network to another number of shards (or from/to the
+unsharded file); status updates get new status_ids in their new shard. The
+target must be empty, so an interrupted rebalance is rerun after deleting the
+target files. The source is left untouched unless --remove-source is given:
+    python sharding.py rebalance 1 4                  # socialnetwork.db -> 4 shards
+    python sharding.py rebalance 4 2 --remove-source  # and delete the 4 shard files
+"""
+import heapq
+import itertools
+import logging
+import os
+import sys
+from contextlib import nullcontext
+from peewee import IntegrityError, OperationalError, chunked, fn
+import metrics
+import users
+from socialnetwork_model import (SQLITE_MAX_VARIABLES, NetworkStats, ShardSet, Status,
+                                 StatusIndex, Users, UserStats, changed_values, database,
+                                 numeric_status_id, shard_filename, upsert)
+
+
+def _shard_set(shards, profile):
+    return shards if isinstance(shards, ShardSet) else ShardSet(shards, profile=profile)
+
+
+def _by_shard(items, shard_of):
+    """
+    Groups items into {shard index: [items]}
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(shard_of(item), []).append(item)
+    return groups
+
+
+class ShardedUserCollection:
+    """
+    UserCollection over a ShardSet (or a number of shards)
+    """
+
+    def __init__(self, shards, profile=None):
+        self.shards = _shard_set(shards, profile)
+
+    def _shard(self, user_id):
+        return self.shards.databases[self.shards.for_user(user_id)]
+
+    def atomic(self):
+        """
+        Each shard commits its part of a chunk on its own; the main.py
+        loaders get no enclosing transaction (which is why the resumable
+        loaders refuse sharded collections)
+        """
+        return nullcontext()
+
+    @metrics.instrument('ShardedUserCollection.add_user')
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        try:
+            Users.insert(user_id=user_id, user_name=user_name, user_last_name=user_last_name,
+                         user_email=user_email).execute(self._shard(user_id))
+        except IntegrityError:
+            logging.error("An error occurred while trying to add a new user with ID '%s'. User already exists.", user_id)
+            return False
+        logging.info("New user with ID '%s' added successfully.", user_id)
+        return True
+
+    @metrics.instrument('ShardedUserCollection.add_users')
+    def add_users(self, rows):
+        """
+        Same as UserCollection.add_users, with one transaction per shard
+        """
+        def add(_, shard, shard_rows):
+            inserted = 0
+            with shard.atomic():
+                for batch in chunked(shard_rows, SQLITE_MAX_VARIABLES // 4):
+                    inserted += (Users.insert_many(batch).on_conflict_ignore()
+                                 .as_rowcount().execute(shard))
+            return inserted
+        inserted = sum(self.shards.map(
+            add, _by_shard(rows, lambda row: self.shards.for_user(row['user_id']))).values())
+        logging.info("Bulk insert of %s users: %s added.", len(rows), inserted)
+        return inserted
+
+    @metrics.instrument('ShardedUserCollection.modify_user')
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        shard = self._shard(user_id)
+        values = {'user_name': user_name, 'user_last_name': user_last_name, 'user_email': user_email}
+        updated = (Users
+                   .update(values)
+                   .where((Users.user_id == user_id) & changed_values(Users, values))
+                   .execute(shard))
+        if not updated and not Users.select().where(Users.user_id == user_id).exists(shard):
+            logging.error("An error occurred while trying to modify user with ID '%s'. User does not exist.", user_id)
+            return False
+        logging.info("User with ID '%s' modified successfully.", user_id)
+        return True
+
+    @metrics.instrument('ShardedUserCollection.upsert_users')
+    def upsert_users(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Same as UserCollection.upsert_users, on all shards in parallel
+        """
+        def upsert(_, shard, shard_rows):
+            return upsert(Users, shard_rows, ('user_name', 'user_last_name', 'user_email'),
+                                 chunk_size, shard)
+        report = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for shard_report in self.shards.map(
+                upsert, _by_shard(rows, lambda row: self.shards.for_user(row['user_id']))).values():
+            for key, count in shard_report.items():
+                report[key] += count
+        logging.info("Upsert of %s users: %s added, %s updated, %s unchanged.", len(rows),
+                     report['inserted'], report['updated'], report['unchanged'])
+        return report
+
+    @metrics.instrument('ShardedUserCollection.delete_user')
+    def delete_user(self, user_id):
+        shard = self._shard(user_id)
+        with shard.atomic():
+            Status.delete().where(Status.user_id == user_id).execute(shard)
+            deleted = Users.delete().where(Users.user_id == user_id).execute(shard) == 1
+        if not deleted:
+            logging.error("An error occurred while trying to delete user with ID '%s'. User does not exist.", user_id)
+            return False
+        logging.info("User with ID '%s' deleted successfully.", user_id)
+        return True
+
+    @metrics.instrument('ShardedUserCollection.delete_users')
+    def delete_users(self, user_ids, chunk_size=users.DEFAULT_DELETE_CHUNK_SIZE):
+        """
+        Same as UserCollection.delete_users, on all shards in parallel
+        """
+        def delete(_, shard, shard_user_ids):
+            counts = {'users': 0, 'statuses': 0}
+            for chunk in chunked(shard_user_ids, min(chunk_size, SQLITE_MAX_VARIABLES)):
+                with shard.atomic():
+                    counts['statuses'] += (Status.delete()
+                                           .where(Status.user_id.in_(chunk)).execute(shard))
+                    counts['users'] += Users.delete().where(Users.user_id.in_(chunk)).execute(shard)
+            return counts
+        report = {'users': 0, 'statuses': 0}
+        for counts in self.shards.map(
+                delete, _by_shard(dict.fromkeys(user_ids), self.shards.for_user)).values():
+            report['users'] += counts['users']
+            report['statuses'] += counts['statuses']
+        logging.info("Bulk delete of %s users: %s users and %s status updates deleted.",
+                     len(user_ids), report['users'], report['statuses'])
+        return report
+
+    @metrics.instrument('ShardedUserCollection.search_user')
+    def search_user(self, user_id):
+        return (Users
+                .select(Users.user_id, Users.user_name, Users.user_last_name, Users.user_email)
+                .where(Users.user_id == user_id)
+                .dicts()
+                .first(self._shard(user_id)))
+
+    @metrics.instrument('ShardedUserCollection.search_users')
+    def search_users(self, user_ids):
+        """
+        Same as UserCollection.search_users, on all shards in parallel
+        """
+        def search(_, shard, shard_user_ids):
+            found = {}
+            for chunk in chunked(shard_user_ids, SQLITE_MAX_VARIABLES):
+                query = (Users
+                         .select(Users.user_id, Users.user_name, Users.user_last_name,
+                                 Users.user_email)
+                         .where(Users.user_id.in_(chunk))
+                         .dicts())
+                found.update((row['user_id'], row) for row in query.execute(shard))
+            return found
+        found = {}
+        for shard_found in self.shards.map(
+                search, _by_shard(dict.fromkeys(user_ids), self.shards.for_user)).values():
+            found.update(shard_found)
+        return {user_id: found.get(user_id) for user_id in dict.fromkeys(user_ids)}
+
+    def iter_users(self, user_id=None):
+        """
+        Same as UserCollection.iter_users: the shards' sorted cursors are merged
+        """
+        if user_id is not None:
+            return iter(list(self._iter_shard_users(self._shard(user_id), user_id)))
+        return heapq.merge(*(self._iter_shard_users(shard) for shard in self.shards.databases))
+
+    @staticmethod
+    def _iter_shard_users(shard, user_id=None):
+        query = Users.select(Users.user_id, Users.user_email, Users.user_name, Users.user_last_name)
+        if user_id is not None:
+            query = query.where(Users.user_id == user_id)
+        return query.order_by(Users.user_id).tuples().iterator(shard)
+
+    @metrics.instrument('ShardedUserCollection.count_users')
+    def count_users(self):
+        """
+        Returns the number of users, summed over the shards' counters
+        """
+        return sum(self.shards.map_all(
+            lambda _, shard, __: NetworkStats.select(NetworkStats.value)
+            .where(NetworkStats.name == 'users').scalar(shard)).values())
+
+    def cache_info(self):
+        """
+        The sharded collections have no cache
+        """
+        return None
+
+
+class ShardedUserStatusCollection:
+    """
+    UserStatusCollection over a ShardSet (or a number of shards)
+    """
+
+    def __init__(self, shards, profile=None):
+        self.shards = _shard_set(shards, profile)
+
+    def _status_shard(self, status_id):
+        index = self.shards.for_status(status_id)
+        return self.shards.databases[index] if index is not None else None
+
+    def atomic(self):
+        """
+        Each shard commits its part of a chunk on its own; the main.py
+        loaders get no enclosing transaction (which is why the resumable
+        loaders refuse sharded collections)
+        """
+        return nullcontext()
+
+    def _insert_statuses(self, index, shard, rows):
+        # Inserts rows, skipping those whose status_id or source_id exists.
+        # A status_id in the range of the shard is kept, the other rows get
+        # the next status_ids of the shard; the IMMEDIATE transaction holds
+        # the shard's writer lock from the start. Returns the number inserted.
+        with shard.atomic('IMMEDIATE'):
+            kept = [int(row['status_id']) for row in rows
+                    if self.shards.for_status(row.get('status_id')) == index]
+            last = Status.select(fn.MAX(Status.status_id)).scalar(shard) or 0
+            new_ids = itertools.count(max([last, self.shards.status_id_floor(index)] + kept) + 1)
+            rows = [{'status_id': (int(row['status_id'])
+                                   if self.shards.for_status(row.get('status_id')) == index
+                                   else next(new_ids)),
+                     'user_id': row['user_id'],
+                     'status_text': row['status_text'],
+                     'source_id': row.get('source_id')}
+                    for row in rows]
+            inserted = 0
+            for batch in chunked(rows, SQLITE_MAX_VARIABLES // 4):
+                inserted += (Status.insert_many(batch).on_conflict_ignore()
+                             .as_rowcount().execute(shard))
+        return inserted
+
+    @metrics.instrument('ShardedUserStatusCollection.add_status_update')
+    def add_status_update(self, user_id, status_text):
+        index = self.shards.for_user(user_id)
+        shard = self.shards.databases[index]
+        if not Users.select().where(Users.user_id == user_id).exists(shard):
+            logging.error("An error occurred while trying to add a new status update. User with ID '%s' does not exist.", user_id)
+            return False
+        try:
+            self._insert_statuses(index, shard, [{'user_id': user_id, 'status_text': status_text}])
+        except IntegrityError:
+            # The user was deleted in the meantime
+            logging.error("An error occurred while trying to add a new status update. User with ID '%s' does not exist.", user_id)
+            return False
+        logging.info("New status update added for user with ID '%s'.", user_id)
+        return True
+
+    @metrics.instrument('ShardedUserStatusCollection.add_status')
+    def add_status(self, status_id, user_id, status_text):
+        """
+        Same as UserStatusCollection.add_status. A numeric status_id must also
+        be in the range of the user's shard (see ShardSet.status_id_floor).
+        """
+        index = self.shards.for_user(user_id)
+        if numeric_status_id(status_id) is not None:
+            if self.shards.for_status(status_id) != index:
+                logging.error("An error occurred while trying to add a new status with ID '%s'. Status ID is not in the range of the shard of user with ID '%s'.", status_id, user_id)
+                return False
+            row = {'status_id': status_id, 'user_id': user_id, 'status_text': status_text}
+        else:
+            row = {'user_id': user_id, 'status_text': status_text, 'source_id': str(status_id)}
+        try:
+            added = self._insert_statuses(index, self.shards.databases[index], [row])
+        except IntegrityError:
+            added = 0
+        if not added:
+            logging.error("An error occurred while trying to add a new status with ID '%s'. Status ID already exists or user with ID '%s' does not exist.", status_id, user_id)
+            return False
+        logging.info("New status with ID '%s' added successfully.", status_id)
+        return True
+
+    @metrics.instrument('ShardedUserStatusCollection.known_user_ids')
+    def known_user_ids(self):
+        """
+        Returns the set of every user_id of every shard
+        """
+        known = set()
+        for shard_ids in self.shards.map_all(
+                lambda _, shard, __: [user_id for (user_id,) in
+                                      Users.select(Users.user_id).tuples().iterator(shard)]
+                ).values():
+            known.update(shard_ids)
+        return known
+
+    @metrics.instrument('ShardedUserStatusCollection.add_status_updates')
+    def add_status_updates(self, rows):
+        """
+        Same as UserStatusCollection.add_status_updates, with one transaction
+        per shard, all shards in parallel. A status_id is only kept if it is in
+        the range of the user's shard (see ShardSet.status_id_floor).
+        """
+        inserted = sum(self.shards.map(
+            self._insert_statuses,
+            _by_shard(rows, lambda row: self.shards.for_user(row['user_id']))).values())
+        logging.info("Bulk insert of %s status updates: %s added.", len(rows), inserted)
+        return inserted
+
+    @metrics.instrument('ShardedUserStatusCollection.modify_status')
+    def modify_status(self, status_id, user_id, status_text):
+        index = self.shards.for_status(status_id)
+        if index is not None and index != self.shards.for_user(user_id):
+            logging.error("An error occurred while trying to modify status update with ID '%s'. User with ID '%s' is on another shard.", status_id, user_id)
+            return False
+        shard = self.shards.databases[index] if index is not None else None
+        values = {'user_id': user_id, 'status_text': status_text}
+        try:
+            updated = shard is not None and (
+                Status
+                .update(values)
+                .where((Status.status_id == status_id) & changed_values(Status, values))
+                .execute(shard))
+        except IntegrityError:
+            logging.error("An error occurred while trying to modify status update with ID '%s'. User with ID '%s' does not exist.", status_id, user_id)
+            return False
+        if not updated and (shard is None or not Status.select().where(
+                Status.status_id == status_id).exists(shard)):
+            logging.error("An error occurred while trying to modify status update with ID '%s'. Status update does not exist.", status_id)
+            return False
+        logging.info("Status update with ID '%s' modified successfully.", status_id)
+        return True
+
+    @metrics.instrument('ShardedUserStatusCollection.upsert_statuses')
+    def upsert_statuses(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Same as UserStatusCollection.upsert_statuses. Rows are also rejected if
+        their status_id is not one of their user's shard.
+        """
+        known = self.known_user_ids()
+        valid_rows = [row for row in rows if row['user_id'] in known
+                      and self.shards.for_status(row['status_id'])
+                      == self.shards.for_user(row['user_id'])]
+
+        def upsert(_, shard, shard_rows):
+            return upsert(Status, shard_rows, ('user_id', 'status_text'), chunk_size, shard)
+        report = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for shard_report in self.shards.map(
+                upsert, _by_shard(valid_rows,
+                                  lambda row: self.shards.for_user(row['user_id']))).values():
+            for key, count in shard_report.items():
+                report[key] += count
+        report['rejected'] = len(rows) - len(valid_rows)
+        logging.info("Upsert of %s status updates: %s added, %s updated, %s unchanged, %s rejected.",
+                     len(rows), report['inserted'], report['updated'], report['unchanged'],
+                     report['rejected'])
+        return report
+
+    @metrics.instrument('ShardedUserStatusCollection.delete_status_update')
+    def delete_status_update(self, status_id):
+        shard = self._status_shard(status_id)
+        if shard is None or Status.delete().where(Status.status_id == status_id).execute(shard) != 1:
+            logging.error("An error occurred while trying to delete status update with ID '%s'. Status update does not exist.", status_id)
+            return False
+        logging.info("Status update with ID '%s' deleted successfully.", status_id)
+        return True
+
+    @metrics.instrument('ShardedUserStatusCollection.search_status_update')
+    def search_status_update(self, status_id):
+        shard = self._status_shard(status_id)
+        if shard is None:
+            return None
+        return (Status
+                .select(Status.status_id, Status.user_id, Status.status_text)
+                .where(Status.status_id == status_id)
+                .dicts()
+                .first(shard))
+
+    # Names of the dict-based user_status.UserStatusCollection, used by main.py
+    delete_status = delete_status_update
+    search_status = search_status_update
+
+    @metrics.instrument('ShardedUserStatusCollection.search_status_updates')
+    def search_status_updates(self, status_ids):
+        """
+        Same as UserStatusCollection.search_status_updates, on all shards in parallel
+        """
+        def search(_, shard, shard_status_ids):
+            found = {}
+            for chunk in chunked(shard_status_ids, SQLITE_MAX_VARIABLES):
+                query = (Status
+                         .select(Status.status_id, Status.user_id, Status.status_text)
+                         .where(Status.status_id.in_(chunk))
+                         .dicts())
+                found.update((str(row['status_id']), row) for row in query.execute(shard))
+            return found
+        status_ids = list(dict.fromkeys(status_ids))
+        work = _by_shard(status_ids, self.shards.for_status)
+        work.pop(None, None)
+        found = {}
+        for shard_found in self.shards.map(search, work).values():
+            found.update(shard_found)
+        return {status_id: found.get(str(status_id)) for status_id in status_ids}
+
+    def iter_status_updates(self, user_id=None):
+        """
+        Same as UserStatusCollection.iter_status_updates: the shards' cursors,
+        sorted by status_id, are merged
+        """
+        if user_id is not None:
+            shard = self.shards.databases[self.shards.for_user(user_id)]
+            return iter(list(self._iter_shard_statuses(shard, user_id)))
+        return heapq.merge(*(self._iter_shard_statuses(shard) for shard in self.shards.databases))
+
+    @staticmethod
+    def _iter_shard_statuses(shard, user_id=None):
+        query = Status.select(Status.status_id, Status.user_id, Status.status_text)
+        if user_id is not None:
+            query = query.where(Status.user_id == user_id)
+        return query.order_by(Status.status_id).tuples().iterator(shard)
+
+    @metrics.instrument('ShardedUserStatusCollection.get_user_timeline')
+    def get_user_timeline(self, user_id, after_status_id=None, limit=users.DEFAULT_TIMELINE_LIMIT):
+        """
+        Same as UserStatusCollection.get_user_timeline, on the user's shard
+        """
+        query = (Status
+                 .select(Status.status_id, Status.user_id, Status.status_text)
+                 .where(Status.user_id == user_id))
+        if after_status_id is not None:
+            query = query.where(Status.status_id > after_status_id)
+        shard = self.shards.databases[self.shards.for_user(user_id)]
+        return list(query.order_by(Status.status_id).limit(limit).dicts().execute(shard))
+
+    @metrics.instrument('ShardedUserStatusCollection.search_status_text')
+    def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        """
+        Same as UserStatusCollection.search_status_text: every shard returns its
+        best limit matches and the best limit of those are kept. bm25 ranks use
+        each shard's own term statistics.
+        """
+        rank = StatusIndex.bm25()
+        snippet = fn.snippet(StatusIndex._meta.entity, 0, '[', ']', '...', 10)
+
+        def search(_, shard, __):
+            return list(StatusIndex
+                        .select(Status.status_id, Status.user_id,
+                                snippet.alias('snippet'), rank.alias('rank'))
+                        .join(Status, on=(Status.status_id == StatusIndex.rowid))
+                        .where(StatusIndex.match(query))
+                        .order_by(rank)
+                        .limit(limit)
+                        .dicts()
+                        .execute(shard))
+        try:
+            results = self.shards.map_all(search)
+        except OperationalError as error:
+            logging.error("Invalid status search query '%s': %s", query, error)
+            return []
+        return heapq.nsmallest(limit, (row for rows in results.values() for row in rows),
+                               key=lambda row: row['rank'])
+
+    @metrics.instrument('ShardedUserStatusCollection.count_status_updates')
+    def count_status_updates(self, user_id=None):
+        """
+        Same as UserStatusCollection.count_status_updates
+        """
+        if user_id is None:
+            return sum(self.shards.map_all(
+                lambda _, shard, __: NetworkStats.select(NetworkStats.value)
+                .where(NetworkStats.name == 'statuses').scalar(shard)).values())
+        shard = self.shards.databases[self.shards.for_user(user_id)]
+        return (UserStats
+                .select(UserStats.status_count)
+                .where(UserStats.user_id == user_id)
+                .scalar(shard))
+
+    @metrics.instrument('ShardedUserStatusCollection.top_users')
+    def top_users(self, limit=users.DEFAULT_TOP_USERS):
+        """
+        Same as UserStatusCollection.top_users: the top limit of every shard
+        are merged
+        """
+        def top(_, shard, __):
+            return list(UserStats
+                        .select(UserStats.user_id, UserStats.status_count)
+                        .order_by(UserStats.status_count.desc(), UserStats.user_id)
+                        .limit(limit)
+                        .tuples()
+                        .execute(shard))
+        rows = (row for shard_rows in self.shards.map_all(top).values() for row in shard_rows)
+        return heapq.nsmallest(limit, rows, key=lambda row: (-row[1], row[0]))
+
+    def cache_info(self):
+        """
+        The sharded collections have no cache
+        """
+        return None
+
+
+def _iter_status_sources(status_collection):
+    """
+    Yields (status_id, user_id, status_text, source_id) tuples of every status
+    update of a UserStatusCollection or ShardedUserStatusCollection
+    """
+    def iter_shard(shard):
+        return (Status
+                .select(Status.status_id, Status.user_id, Status.status_text, Status.source_id)
+                .order_by(Status.status_id)
+                .tuples()
+                .iterator(shard))
+    if isinstance(status_collection, ShardedUserStatusCollection):
+        return heapq.merge(*(iter_shard(shard) for shard in status_collection.shards.databases))
+    return iter_shard(database)
+
+
+def rebalance(source_users, source_statuses, target_users, target_statuses,
+              chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+    """
+    Copies every user and status update from the source collections to the
+    target ones, e.g. from the unsharded database to N shards or from N to M
+    shards, chunk_size rows per batch. Status updates get new status_ids.
+    The source is not modified. Returns {'users': n, 'statuses': n} copied.
+
+    The target must be empty, otherwise ValueError is raised: status updates
+    cannot be matched to copies made by an earlier, interrupted run.
+    """
+    if target_users.count_users() or target_statuses.count_status_updates():
+        raise ValueError('The target of a rebalance must be empty')
+    report = {'users': 0, 'statuses': 0}
+    rows = ({'user_id': user_id, 'user_email': email, 'user_name': name,
+             'user_last_name': last_name}
+            for user_id, email, name, last_name in source_users.iter_users())
+    for chunk in chunked(rows, chunk_size):
+        report['users'] += target_users.add_users(chunk)
+    # source_id goes along, so loading a CSV file again still skips its rows
+    rows = ({'user_id': user_id, 'status_text': status_text, 'source_id': source_id}
+            for _, user_id, status_text, source_id in _iter_status_sources(source_statuses))
+    for chunk in chunked(rows, chunk_size):
+        report['statuses'] += target_statuses.add_status_updates(chunk)
+    logging.info("Rebalanced %s users and %s status updates.", report['users'], report['statuses'])
+    return report
+
+
+def _collections(count):
+    if count == 1:
+        return users.UserCollection(), users.UserStatusCollection()
+    shards = ShardSet(count)
+    return ShardedUserCollection(shards), ShardedUserStatusCollection(shards)
+
+
+def _close(collection):
+    if isinstance(collection, ShardedUserCollection):
+        collection.shards.close()
+    else:
+        database.close()
+
+
+def _remove_database_files(count):
+    # Each shard file with its WAL and shared-memory files
+    for index in range(count):
+        filename = shard_filename(index, count)
+        for path in (filename, f'{filename}-wal', f'{filename}-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+    logging.info("Removed the %s database file(s) of the rebalance source.", count)
+
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    remove_source = '--remove-source' in arguments
+    if remove_source:
+        arguments.remove('--remove-source')
+    if len(arguments) != 3 or arguments[0] != 'rebalance':
+        sys.exit(f'Usage: python {sys.argv[0]} rebalance SOURCE_SHARDS TARGET_SHARDS [--remove-source]')
+    source_count, target_count = int(arguments[1]), int(arguments[2])
+    if source_count == target_count:
+        sys.exit('The source and target number of shards must differ')
+    source, target = _collections(source_count), _collections(target_count)
+    try:
+        print(rebalance(*source, *target))
+    except ValueError as error:
+        targets = ' '.join(shard_filename(index, target_count) for index in range(target_count))
+        sys.exit(f'{error}; delete the target files ({targets}) and run again')
+    if remove_source:
+        _close(source[0])
+        _remove_database_files(source_count)
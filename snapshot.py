@@ -0,0 +1,203 @@
+"""
+Read-only snapshot of the social network database for read-heavy processes.
+
+Snapshot copies the database file into an in-memory SQLite database with the
+sqlite3 backup API and serves the search APIs of UserCollection and
+UserStatusCollection from that copy, so lookups never touch the connection
+or the file the writers use. The copy is a single read transaction on the
+file; in WAL mode it does not block the writer.
+
+The copy is as of the last refresh(): call it on demand, or pass
+refresh_interval to refresh from a background thread. A refresh builds the
+new copy aside and swaps it in, so reads are never blocked by it either.
+
+With in_memory=False the file is opened read-only with memory-mapped I/O
+instead: no copy, no refresh needed, reads see every committed write.
+(immutable=1 is not offered: it is only safe if nothing writes to the file.)
+
+Snapshot can be passed to the main.py search functions in place of a
+collection:
+    snapshot = main.init_snapshot(refresh_interval=60)
+    user = main.search_user('dave03', snapshot)
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import metrics
+import socialnetwork_model
+from socialnetwork_model import SQLITE_MAX_VARIABLES
+from users import DEFAULT_SEARCH_LIMIT, DEFAULT_TIMELINE_LIMIT, DEFAULT_TOP_USERS
+
+
+# Page cache and memory map of the read-only connection of in_memory=False
+READ_ONLY_PRAGMAS = (('mmap_size', 256 * 1024 * 1024), ('cache_size', -64 * 1024))
+
+USER_COLUMNS = 'user_id, user_name, user_last_name, user_email'
+STATUS_COLUMNS = 'status_id, user_id, status_text'
+
+
+def _dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class Snapshot:
+    """
+    Read-only copy of a database file exposing the collections' search APIs
+    """
+
+    def __init__(self, filename=None, in_memory=True, refresh_interval=None):
+        self.filename = os.path.abspath(filename or socialnetwork_model.database.database)
+        self.in_memory = in_memory
+        self.refreshed_at = None
+        self._connection = None
+        self._refresh_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
+        socialnetwork_model.ensure_schema(self.filename)
+        self.refresh()
+        if refresh_interval and in_memory:
+            self._refresher = threading.Thread(
+                target=self._refresh_every, args=(refresh_interval,),
+                name='snapshot-refresh', daemon=True)
+            self._refresher.start()
+
+    def _open_source(self):
+        return sqlite3.connect(f'file:{self.filename}?mode=ro', uri=True,
+                               check_same_thread=False)
+
+    def refresh(self):
+        """
+        Replaces the snapshot with a fresh copy of the database file.
+        Reads running meanwhile finish on the previous copy.
+        """
+        with self._refresh_lock:
+            source = self._open_source()
+            if not self.in_memory:
+                for name, value in READ_ONLY_PRAGMAS:
+                    source.execute(f'PRAGMA {name} = {value}')
+                connection = source
+            else:
+                connection = sqlite3.connect(':memory:', check_same_thread=False)
+                try:
+                    source.backup(connection)
+                finally:
+                    source.close()
+                connection.execute('PRAGMA query_only = 1')
+            connection.row_factory = _dict_factory
+            # The previous connection is closed once the last read using it is done
+            self._connection = connection
+            self.refreshed_at = time.time()
+        logging.info("Snapshot of '%s' refreshed.", self.filename)
+
+    def _refresh_every(self, interval):
+        while not self._stopped.wait(interval):
+            try:
+                self.refresh()
+            except sqlite3.Error as error:
+                logging.error("Snapshot of '%s' could not be refreshed: %s", self.filename, error)
+
+    def close(self):
+        """
+        Stops the background refresh and drops the snapshot
+        """
+        self._stopped.set()
+        if self._refresher is not None:
+            self._refresher.join()
+        self._connection = None
+
+    def _query(self, sql, params=()):
+        return self._connection.execute(sql, params).fetchall()
+
+    def _search_many(self, table, columns, key, ids):
+        # Chunked IN (...) lookups; rows are matched to the requested IDs by
+        # their string form, like the collections' caches do
+        results = {}
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            chunk = ids[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self._query(f'SELECT {columns} FROM {table} WHERE {key} IN ({placeholders})',
+                               chunk)
+            found = {str(row[key]): row for row in rows}
+            results.update((item_id, found.get(str(item_id))) for item_id in chunk)
+        return results
+
+    @metrics.instrument('Snapshot.search_user')
+    def search_user(self, user_id):
+        rows = self._query(f'SELECT {USER_COLUMNS} FROM users WHERE user_id = ?', (user_id,))
+        return rows[0] if rows else None
+
+    @metrics.instrument('Snapshot.search_users')
+    def search_users(self, user_ids):
+        """
+        Returns {user_id: user dict or None} for every requested user_id
+        """
+        return self._search_many('users', USER_COLUMNS, 'user_id', user_ids)
+
+    @metrics.instrument('Snapshot.search_status_update')
+    def search_status_update(self, status_id):
+        rows = self._query(f'SELECT {STATUS_COLUMNS} FROM status WHERE status_id = ?',
+                           (status_id,))
+        return rows[0] if rows else None
+
+    # Name of the dict-based user_status.UserStatusCollection, used by main.search_status
+    search_status = search_status_update
+
+    @metrics.instrument('Snapshot.search_status_updates')
+    def search_status_updates(self, status_ids):
+        """
+        Returns {status_id: status dict or None} for every requested status_id
+        """
+        return self._search_many('status', STATUS_COLUMNS, 'status_id', status_ids)
+
+    @metrics.instrument('Snapshot.get_user_timeline')
+    def get_user_timeline(self, user_id, after_status_id=None, limit=DEFAULT_TIMELINE_LIMIT):
+        """
+        Same as UserStatusCollection.get_user_timeline
+        """
+        return self._query(f'SELECT {STATUS_COLUMNS} FROM status '
+                           'WHERE user_id = ? AND status_id > ? ORDER BY status_id LIMIT ?',
+                           (user_id, after_status_id if after_status_id is not None else 0,
+                            limit))
+
+    @metrics.instrument('Snapshot.search_status_text')
+    def search_status_text(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Same as UserStatusCollection.search_status_text
+        """
+        try:
+            return self._query(
+                "SELECT status.status_id, status.user_id, "
+                "snippet(status_fts, 0, '[', ']', '...', 10) AS snippet, "
+                "bm25(status_fts) AS rank "
+                "FROM status_fts JOIN status ON status.status_id = status_fts.rowid "
+                "WHERE status_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit))
+        except sqlite3.OperationalError as error:
+            logging.error("Invalid status search query '%s': %s", query, error)
+            return []
+
+    @metrics.instrument('Snapshot.count_users')
+    def count_users(self):
+        return self._query("SELECT value FROM network_stats WHERE name = 'users'")[0]['value']
+
+    @metrics.instrument('Snapshot.count_status_updates')
+    def count_status_updates(self, user_id=None):
+        """
+        Same as UserStatusCollection.count_status_updates
+        """
+        if user_id is None:
+            return self._query(
+                "SELECT value FROM network_stats WHERE name = 'statuses'")[0]['value']
+        rows = self._query('SELECT status_count FROM user_stats WHERE user_id = ?', (user_id,))
+        return rows[0]['status_count'] if rows else None
+
+    @metrics.instrument('Snapshot.top_users')
+    def top_users(self, limit=DEFAULT_TOP_USERS):
+        """
+        Same as UserStatusCollection.top_users
+        """
+        rows = self._query('SELECT user_id, status_count FROM user_stats '
+                           'ORDER BY status_count DESC, user_id LIMIT ?', (limit,))
+        return [(row['user_id'], row['status_count']) for row in rows]
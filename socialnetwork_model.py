@@ -1,10 +1,128 @@
+import operator
+import os
+import sqlite3
+import sys
+import threading
+import weakref
+from contextlib import closing
+from functools import reduce
 from peewee import *
+from playhouse.sqlite_ext import AutoIncrementField, FTS5Model, RowIDField, SearchField
 
 # Define the database file name
 DATABASE_NAME = 'socialnetwork.db'
 
-# Create a SQLite database instance
-database = SqliteDatabase(DATABASE_NAME)
+# SQLite refuses statements with more bound parameters than this (the
+# compile-time default for SQLITE_MAX_VARIABLE_NUMBER before 3.32).
+SQLITE_MAX_VARIABLES = 999
+
+# Stored in PRAGMA user_version once the tables, indexes and triggers of this
+# module exist in a database file; bump it whenever the schema changes
+SCHEMA_VERSION = 5
+
+# Environment variable holding the number of shards of main.init_collections
+SHARDS_ENV_VAR = 'SOCIALNETWORK_SHARDS'
+
+# In sharded mode, shard i allocates status_ids from i << STATUS_ID_SHIFT up,
+# so the shard of a status is found from its status_id alone
+STATUS_ID_SHIFT = 40
+
+# Environment variable used to pick a performance profile at import time
+PROFILE_ENV_VAR = 'SOCIALNETWORK_DB_PROFILE'
+DEFAULT_PROFILE = 'durable'
+
+# Pragmas applied on every new connection, per performance profile.
+# foreign_keys must stay on in all of them: SQLite only enforces the
+# ON DELETE CASCADE of Status.user_id when it is enabled.
+PROFILES = {
+    # WAL so readers do not block behind the writer, fsync on every commit
+    'durable': {
+        'journal_mode': 'wal',
+        'synchronous': 'full',
+        'cache_size': -16 * 1024,
+        'foreign_keys': 1,
+    },
+    # Large imports: no fsync, big page cache, temp b-trees in memory
+    'bulk-load': {
+        'journal_mode': 'wal',
+        'synchronous': 'off',
+        'cache_size': -256 * 1024,
+        'temp_store': 'memory',
+        'foreign_keys': 1,
+    },
+    # Lookups: memory-mapped reads and a large page cache
+    'read-heavy': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'memory',
+        'foreign_keys': 1,
+    },
+}
+
+
+def profile_name(profile=None):
+    """
+    Returns profile, falling back to the SOCIALNETWORK_DB_PROFILE environment
+    variable and then to 'durable'. Raises ValueError for an unknown profile name.
+    """
+    profile = profile or os.environ.get(PROFILE_ENV_VAR) or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile '{profile}'. "
+                         f"Choose one of: {', '.join(PROFILES)}")
+    return profile
+
+
+def profile_pragmas(profile=None):
+    """
+    Returns the pragmas of the named profile (see profile_name)
+    """
+    return list(PROFILES[profile_name(profile)].items())
+
+
+class SocialNetworkDatabase(SqliteDatabase):
+    """
+    SqliteDatabase that brings the schema of a database file up to date the
+    first time a connection is opened on it, so no table is created (and no
+    connection opened) until the first query.
+    """
+
+    # Set by the first connection; the profile cannot change from then on
+    connected = False
+
+    def _initialize_connection(self, conn):
+        super()._initialize_connection(conn)
+        self.connected = True
+        if schema_version(conn) < SCHEMA_VERSION:
+            # The connection is open
+            _create_schema(self)
+
+
+# Create a SQLite database instance; peewee connects on the first query
+database = SocialNetworkDatabase(DATABASE_NAME, pragmas=profile_pragmas())
+
+# Name of the profile of database
+active_profile = profile_name()
+
+
+def use_profile(profile):
+    """
+    Switches the database to the named profile. The profile is process-wide:
+    its pragmas apply to every connection of the shared database, whichever
+    collection asked for it. It can only be changed before the first
+    connection is opened; after that, asking for another profile than the
+    active one raises ValueError.
+    """
+    global active_profile  # pylint: disable=global-statement
+    profile = profile_name(profile)
+    if profile == active_profile:
+        return
+    if database.connected:
+        raise ValueError(f"Cannot switch to database profile '{profile}': profile "
+                         f"'{active_profile}' is already in use by this process")
+    database.init(database.database, pragmas=profile_pragmas(profile))
+    active_profile = profile
 
 # Define the base model for all tables
 class BaseModel(Model):
@@ -16,19 +134,492 @@ class Users(BaseModel):
     user_id = CharField(primary_key=True, max_length=30)
     user_name = CharField(max_length=30)
     user_last_name = CharField(max_length=100)
-    user_email = CharField()
+    user_email = CharField(index=True)
 
 # Define the Status table
 class Status(BaseModel):
     status_id = AutoField(primary_key=True)
-    user_id = ForeignKeyField(Users, backref='status_updates', on_delete='CASCADE')
+    # Indexed through the composite (user_id, status_id) index below, which
+    # serves both the FK cascade and ordered per-user timelines
+    user_id = ForeignKeyField(Users, backref='status_updates', on_delete='CASCADE', index=False)
     status_text = TextField()
+    # status_id of the CSV row the status update was loaded from, see
+    # main.bulk_load_status_updates. Unique, so loading a file again skips
+    # the rows already loaded; NULL for status updates added one at a time.
+    source_id = TextField(null=True, unique=True)
+
+    class Meta:
+        indexes = (
+            (('user_id', 'status_id'), False),
+        )
+
+# Full-text index over Status.status_text. It is an external-content FTS5
+# table: the text lives only in Status and the triggers below keep the index
+# in sync with every insert, update and delete, bulk loads included.
+class StatusIndex(FTS5Model):
+    rowid = RowIDField()
+    status_text = SearchField()
+
+    class Meta:
+        database = database
+        table_name = 'status_fts'
+        options = {
+            'content': Status,
+            'content_rowid': Status.status_id,
+            'tokenize': 'porter unicode61',
+        }
+
+
+STATUS_INDEX_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS status_fts_insert AFTER INSERT ON status BEGIN
+        INSERT INTO status_fts (rowid, status_text) VALUES (new.status_id, new.status_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS status_fts_delete AFTER DELETE ON status BEGIN
+        INSERT INTO status_fts (status_fts, rowid, status_text)
+        VALUES ('delete', old.status_id, old.status_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS status_fts_update AFTER UPDATE OF status_text ON status BEGIN
+        INSERT INTO status_fts (status_fts, rowid, status_text)
+        VALUES ('delete', old.status_id, old.status_text);
+        INSERT INTO status_fts (rowid, status_text) VALUES (new.status_id, new.status_text);
+    END""",
+)
+
+# Progress of resumable CSV imports: one row per imported file, updated in the
+# same transaction as each committed batch
+class ImportCheckpoint(BaseModel):
+    fingerprint = CharField(primary_key=True, max_length=64)
+    filename = TextField()
+    byte_offset = IntegerField()
+    rows_committed = IntegerField()
+    completed = BooleanField(default=False)
+
+    class Meta:
+        table_name = 'import_checkpoint'
+
+
+# Status counts per user, maintained by the triggers below on every insert
+# and delete (bulk loads and cascades included), so the dashboard aggregates
+# are index lookups instead of COUNT(*) ... GROUP BY over Status
+class UserStats(BaseModel):
+    user_id = CharField(primary_key=True, max_length=30)
+    status_count = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'user_stats'
+
+
+# Most active users first: top-N is a scan of the first N index entries
+UserStats.add_index(UserStats.status_count.desc(), UserStats.user_id)
+
+
+# Network-wide counters, one row per name in STATS_TOTALS
+class NetworkStats(BaseModel):
+    name = CharField(primary_key=True, max_length=30)
+    value = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'network_stats'
+
+
+STATS_TOTALS = ('users', 'statuses')
+
+STATS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS user_stats_user_insert AFTER INSERT ON users BEGIN
+        INSERT OR IGNORE INTO user_stats (user_id, status_count) VALUES (new.user_id, 0);
+        UPDATE network_stats SET value = value + 1 WHERE name = 'users';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_stats_user_delete AFTER DELETE ON users BEGIN
+        DELETE FROM user_stats WHERE user_id = old.user_id;
+        UPDATE network_stats SET value = value - 1 WHERE name = 'users';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_stats_status_insert AFTER INSERT ON status BEGIN
+        UPDATE user_stats SET status_count = status_count + 1 WHERE user_id = new.user_id;
+        UPDATE network_stats SET value = value + 1 WHERE name = 'statuses';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_stats_status_delete AFTER DELETE ON status BEGIN
+        UPDATE user_stats SET status_count = status_count - 1 WHERE user_id = old.user_id;
+        UPDATE network_stats SET value = value - 1 WHERE name = 'statuses';
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS user_stats_status_move AFTER UPDATE OF user_id ON status
+    WHEN old.user_id IS NOT new.user_id BEGIN
+        UPDATE user_stats SET status_count = status_count - 1 WHERE user_id = old.user_id;
+        UPDATE user_stats SET status_count = status_count + 1 WHERE user_id = new.user_id;
+    END""",
+)
+
+
+# Change feed: one row per inserted, updated or deleted Users/Status row,
+# appended by the triggers below (bulk loads and cascades included).
+# AUTOINCREMENT keeps seq increasing even after compaction empties the table.
+class ChangeLog(BaseModel):
+    seq = AutoIncrementField()
+    entity = CharField(max_length=6)
+    operation = CharField(max_length=6)
+    entity_id = TextField()
+
+    class Meta:
+        table_name = 'change_log'
+
+
+# Last seq acknowledged by each change feed consumer, see changefeed.py
+class ChangeConsumer(BaseModel):
+    name = CharField(primary_key=True, max_length=64)
+    seq = IntegerField()
+
+    class Meta:
+        table_name = 'change_consumer'
+
 
-# Connect to the database and create tables
-def create_tables():
+CHANGE_LOG_TRIGGERS = tuple(
+    f"""CREATE TRIGGER IF NOT EXISTS change_log_{table}_{operation} AFTER {operation.upper()} ON {table}
+    BEGIN
+        INSERT INTO change_log (entity, operation, entity_id)
+        VALUES ('{entity}', '{operation}', {row}.{key});
+    END"""
+    for table, entity, key in (('users', 'user', 'user_id'), ('status', 'status', 'status_id'))
+    for operation, row in (('insert', 'new'), ('update', 'new'), ('delete', 'old'))
+)
+CHANGE_LOG_TRIGGER_NAMES = tuple(
+    f'change_log_{table}_{operation}'
+    for table in ('users', 'status') for operation in ('insert', 'update', 'delete'))
+
+
+MODELS = [Users, Status, StatusIndex, ImportCheckpoint, UserStats, NetworkStats,
+          ChangeLog, ChangeConsumer]
+
+
+def numeric_status_id(status_id):
+    """
+    Returns status_id as an int if it is a number, or None for the other
+    status_ids of CSV files (such as 'Brittaney.Gentry86_00001'), which are
+    kept as Status.source_id
+    """
+    text = str(status_id).strip() if status_id is not None else ''
+    return int(text) if text.isascii() and text.isdigit() else None
+
+
+def _changed(model, fields):
+    # True when the row proposed by an INSERT ... ON CONFLICT differs from
+    # the stored one in any of fields
+    return reduce(operator.or_, (getattr(model, field) != getattr(EXCLUDED, field)
+                                 for field in fields))
+
+
+def changed_values(model, values):
+    """
+    Returns the condition that the stored row of model differs from values
+    (a dict keyed by field name) in any field, for the WHERE of an UPDATE
+    that leaves unchanged rows untouched
+    """
+    return reduce(operator.or_, (getattr(model, field) != value
+                                 for field, value in values.items()))
+
+
+def upsert(model, rows, fields, chunk_size, target=database):
+    """
+    Inserts rows (dicts keyed by model's primary key and fields) or updates the
+    stored rows that differ, with INSERT ... ON CONFLICT DO UPDATE ... WHERE,
+    one transaction per chunk_size rows, in the target database (a shard in
+    sharded mode). A key repeated in rows keeps its last row.
+    Returns {'inserted': n, 'updated': n, 'unchanged': n}.
+    """
+    key = model._meta.primary_key
+    rows = list({row[key.name]: row for row in rows}.values())
+    batch_size = SQLITE_MAX_VARIABLES // (len(fields) + 1)
+    update = {getattr(model, field): getattr(EXCLUDED, field) for field in fields}
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for chunk in chunked(rows, chunk_size):
+        with target.atomic():
+            existing = 0
+            for ids in chunked([row[key.name] for row in chunk], SQLITE_MAX_VARIABLES):
+                existing += model.select().where(key.in_(ids)).count(target)
+            changed = 0
+            for batch in chunked(chunk, batch_size):
+                changed += (model
+                            .insert_many(batch)
+                            .on_conflict(conflict_target=[key], update=update,
+                                         where=_changed(model, fields))
+                            .as_rowcount()
+                            .execute(target))
+        inserted = len(chunk) - existing
+        report['inserted'] += inserted
+        report['updated'] += changed - inserted
+        report['unchanged'] += existing - (changed - inserted)
+    return report
+
+
+def schema_version(conn):
+    """
+    Returns the schema version stored in an open sqlite3 connection's file
+    """
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _schema_manager(model, target):
+    # model._schema (a VirtualTableSchemaManager for StatusIndex), running
+    # its statements on target
+    schema = model._schema
+    return type(schema)(model, target, **schema.context_options)
+
+
+def _create_schema(target, change_log=True):
+    # Creates whatever is missing in target, whose connection is open, and
+    # records SCHEMA_VERSION. Every statement is run on target explicitly
+    # (_schema_manager, query.execute(target)): the models stay
+    # bound to the shared database, so other threads are not affected.
+    # Without change_log (shard files, see ShardSet), the change_log triggers
+    # are dropped instead.
+    with target.atomic():
+        new_search_index = not target.table_exists(StatusIndex._meta.table_name)
+        new_stats = not target.table_exists(UserStats._meta.table_name)
+        if target.table_exists(Status._meta.table_name) and 'source_id' not in {
+                column.name for column in target.get_columns(Status._meta.table_name)}:
+            # Added in schema version 5; before the tables, which index it
+            target.execute_sql('ALTER TABLE "status" ADD COLUMN "source_id" TEXT')
+        for model in MODELS:
+            _schema_manager(model, target).create_all(safe=True)
+        # Replaced by the composite (user_id, status_id) index
+        target.execute_sql('DROP INDEX IF EXISTS "status_user_id"')
+        for trigger in STATUS_INDEX_TRIGGERS + STATS_TRIGGERS:
+            target.execute_sql(trigger)
+        if change_log:
+            for trigger in CHANGE_LOG_TRIGGERS:
+                target.execute_sql(trigger)
+        else:
+            for name in CHANGE_LOG_TRIGGER_NAMES:
+                target.execute_sql(f'DROP TRIGGER IF EXISTS {name}')
+            ChangeLog.delete().execute(target)
+        if new_search_index:
+            # Index the statuses of a database created before the search index
+            target.execute(StatusIndex._fts_cmd_sql('rebuild'))
+        if new_stats:
+            # Count the users and statuses of a database created before the stats
+            _rebuild_stats(target)
+        target.pragma('user_version', SCHEMA_VERSION)
+
+
+# Connect to the database and create tables, in the default database file
+# or in another one (used by the storage backends that do not use peewee
+# and by the shards, which have no change_log)
+def create_tables(filename=None, change_log=True):
+    if filename is None or filename == database.database:
+        target = database
+    else:
+        target = SqliteDatabase(filename)
+    with target:
+        _create_schema(target, change_log)
+
+
+def _rebuild_stats(target=database):
+    UserStats.delete().execute(target)
+    status_count = fn.COUNT(Status.status_id)
+    UserStats.insert_from(
+        (Users
+         .select(Users.user_id, status_count)
+         .join(Status, JOIN.LEFT_OUTER, on=(Status.user_id == Users.user_id))
+         .group_by(Users.user_id)),
+        [UserStats.user_id, UserStats.status_count]).execute(target)
+    totals = {'users': Users.select().count(target), 'statuses': Status.select().count(target)}
+    (NetworkStats
+     .replace_many([{'name': name, 'value': totals[name]} for name in STATS_TOTALS])
+     .execute(target))
+
+
+def rebuild_stats():
+    """
+    Recomputes user_stats and network_stats from the Users and Status tables,
+    in one transaction. Returns the new totals.
+    """
+    with database.atomic():
+        _rebuild_stats()
+    return {row.name: row.value for row in NetworkStats.select()}
+
+
+def ensure_schema(filename=None, change_log=True):
+    """
+    Runs create_tables on a database file whose schema version is older than
+    SCHEMA_VERSION; a file that is up to date costs a single PRAGMA read
+    """
+    filename = filename or database.database
+    with closing(sqlite3.connect(filename)) as conn:
+        current = schema_version(conn)
+    if current < SCHEMA_VERSION:
+        create_tables(filename, change_log)
+
+
+def migrate_indexes():
+    """
+    Adds the secondary indexes to an existing database file and drops the
+    single-column Status.user_id index that the composite index replaces.
+    create_tables (and so the first connection to an outdated file) does this too.
+    """
     with database:
-        database.create_tables([Users, Status])
+        Users._schema.create_indexes(safe=True)
+        Status._schema.create_indexes(safe=True)
+        database.execute_sql('DROP INDEX IF EXISTS "status_user_id"')
+
+
+def hot_queries():
+    """
+    Returns the queries behind the collections' lookups, keyed by access path
+    """
+    return {
+        'user_by_id': Users.select().where(Users.user_id == ''),
+        'user_by_email': Users.select().where(Users.user_email == ''),
+        'status_by_id': Status.select().where(Status.status_id == 0),
+        'statuses_by_user': Status.select().where(Status.user_id == ''),
+        'user_timeline': (Status.select()
+                          .where((Status.user_id == '') & (Status.status_id > 0))
+                          .order_by(Status.status_id)),
+    }
+
+
+def explain_query_plan(query):
+    """
+    Returns the detail lines of SQLite's EXPLAIN QUERY PLAN for a peewee query
+    """
+    sql, params = query.sql()
+    cursor = database.execute_sql(f'EXPLAIN QUERY PLAN {sql}', params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def full_table_scans():
+    """
+    Returns {name: plan} for every hot query whose plan scans a whole table
+    instead of searching an index. An empty dict means all access paths are indexed.
+    """
+    scans = {}
+    for name, query in hot_queries().items():
+        plan = explain_query_plan(query)
+        if any(line.startswith('SCAN') and 'USING' not in line for line in plan):
+            scans[name] = plan
+    return scans
+
+def shard_filename(index, count, filename=DATABASE_NAME):
+    """
+    Returns the database file of shard index out of count. A single shard is
+    the unsharded database file itself.
+    """
+    if count == 1:
+        return filename
+    stem, extension = os.path.splitext(filename)
+    return f'{stem}.shard{index}of{count}{extension}'
+
+
+def shard_for_user(user_id, count):
+    """
+    Returns the shard of user_id: a hash that is stable across processes and
+    Python versions (unlike hash()), modulo count
+    """
+    import zlib  # pylint: disable=import-outside-toplevel
+    return zlib.crc32(str(user_id).encode('utf-8')) % count
+
+
+# ShardSets of more than one file open in this process
+_shard_sets = weakref.WeakSet()
+
+
+def sharded():
+    """
+    Returns True while a ShardSet of more than one file is open in this process
+    """
+    return len(_shard_sets) > 0
+
+
+class ShardSet:
+    """
+    The count database files of a sharded network. Each user, and all their
+    status updates, live in the shard chosen by shard_for_user.
+
+    Every shard is a separate SqliteDatabase (and so a separate writer lock);
+    the models are not bound to them, queries are run against a shard with
+    query.execute(shard), query.first(shard), etc. map() runs a function on
+    several shards in parallel.
+
+    Shard files have no change_log triggers: the change feed only follows the
+    unsharded database file and is unavailable while a ShardSet is open.
+    """
+
+    def __init__(self, count, filename=DATABASE_NAME, profile=None):
+        if count < 1:
+            raise ValueError('A sharded database needs at least one shard')
+        self.count = count
+        self.filenames = [shard_filename(index, count, filename) for index in range(count)]
+        for shard_file in self.filenames:
+            ensure_schema(shard_file, change_log=count == 1)
+        # The process-wide profile of the shared database unless one is given
+        pragmas = profile_pragmas(profile or active_profile)
+        self.databases = [SqliteDatabase(shard_file, pragmas=pragmas)
+                          for shard_file in self.filenames]
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        if count > 1:
+            _shard_sets.add(self)
+
+    def for_user(self, user_id):
+        """
+        Returns the index of the shard holding user_id
+        """
+        return shard_for_user(user_id, self.count)
+
+    def for_status(self, status_id):
+        """
+        Returns the index of the shard holding status_id, or None if
+        status_id cannot belong to any shard
+        """
+        try:
+            index = int(status_id) >> STATUS_ID_SHIFT
+        except (TypeError, ValueError):
+            return None
+        return index if 0 <= index < self.count else None
+
+    def status_id_floor(self, index):
+        """
+        Returns the status_id below the first one shard index allocates
+        """
+        return index << STATUS_ID_SHIFT
+
+    def map(self, func, work):
+        """
+        Calls func(index, database, argument) for every (index, argument) of
+        the work dict, on all those shards at once. Returns {index: result}.
+        """
+        if len(work) <= 1:
+            return {index: func(index, self.databases[index], argument)
+                    for index, argument in work.items()}
+        with self._pool_lock:
+            if self._pool is None:
+                # Deferred like the other imports only some entry points need
+                from concurrent.futures import ThreadPoolExecutor  # pylint: disable=import-outside-toplevel
+                self._pool = ThreadPoolExecutor(max_workers=self.count,
+                                                thread_name_prefix='shard')
+        futures = {index: self._pool.submit(func, index, self.databases[index], argument)
+                   for index, argument in work.items()}
+        return {index: future.result() for index, future in futures.items()}
+
+    def map_all(self, func, argument=None):
+        """
+        map() over every shard with the same argument
+        """
+        return self.map(func, dict.fromkeys(range(self.count), argument))
+
+    def close(self):
+        """
+        Stops the fan-out threads and closes the calling thread's connections
+        """
+        _shard_sets.discard(self)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for shard in self.databases:
+            shard.close()
+
 
-# Run this function to create the tables when the script is executed
+# Run this function to create the tables when the script is executed;
+# 'python socialnetwork_model.py rebuild-stats' also recomputes the statistics
 if __name__ == '__main__':
     create_tables()
+    migrate_indexes()
+    if 'rebuild-stats' in sys.argv[1:]:
+        print(rebuild_stats())
@@ -0,0 +1,830 @@
+"""
+Storage backends for users and status updates.
+
+Every backend implements the StorageBackend interface, which is the API of
+users.UserCollection and users.UserStatusCollection in one object: the same
+method names, arguments and return values. A backend can therefore be
+passed to every main.py function in place of either collection, and the
+backends can be swapped through configuration and benchmarked against each
+other on the same data:
+    backend = main.init_storage('sqlite')
+    main.bulk_load_users('accounts.csv', backend)
+    user = main.search_user('dave03', backend)
+
+Available backends:
+- 'memory':  plain Python dicts, nothing is persisted
+- 'peewee':  the SQL collections of users.py, on the socialnetwork_model database
+- 'sqlite':  the same SQLite schema through the raw sqlite3 module, no ORM
+
+get_backend() picks one by name, or from the SOCIALNETWORK_BACKEND
+environment variable, defaulting to 'peewee'.
+
+The resumable loaders of main.py only accept the 'peewee' backend: they
+commit their checkpoint in the transaction of the shared database.
+"""
+import abc
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager, nullcontext
+from peewee import chunked
+import fastpath
+import socialnetwork_model
+import users
+from socialnetwork_model import SQLITE_MAX_VARIABLES, numeric_status_id
+from user_status import CompactUserStatusCollection
+
+
+BACKEND_ENV_VAR = 'SOCIALNETWORK_BACKEND'
+DEFAULT_BACKEND = 'peewee'
+
+# Rows fetched per round trip while iterating
+ITERATION_BATCH_SIZE = 1000
+
+USER_FIELDS = ('user_id', 'user_name', 'user_last_name', 'user_email')
+STATUS_FIELDS = ('status_id', 'user_id', 'status_text')
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface shared by all storage backends: the methods of UserCollection
+    and UserStatusCollection (see users.py for their full description)
+    """
+
+    # The peewee database whose transactions atomic() returns, None if it is
+    # not the shared socialnetwork_model.database
+    database = None
+
+    @abc.abstractmethod
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        """
+        Adds a user. Returns False if user_id already exists.
+        """
+
+    @abc.abstractmethod
+    def add_users(self, rows):
+        """
+        Adds a sequence of user dicts, skipping existing user_ids.
+        Returns the number of users added.
+        """
+
+    @abc.abstractmethod
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        """
+        Replaces the fields of a user. Returns False if user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def upsert_users(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Adds new users and updates the existing ones that differ.
+        Returns {'inserted': n, 'updated': n, 'unchanged': n}.
+        """
+
+    @abc.abstractmethod
+    def delete_user(self, user_id):
+        """
+        Deletes a user and their statuses. Returns False if user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def delete_users(self, user_ids, chunk_size=users.DEFAULT_DELETE_CHUNK_SIZE):
+        """
+        Deletes many users and their statuses.
+        Returns {'users': n, 'statuses': n} deleted.
+        """
+
+    @abc.abstractmethod
+    def search_user(self, user_id):
+        """
+        Returns the user dict, or None if user_id does not exist
+        """
+
+    @abc.abstractmethod
+    def search_users(self, user_ids):
+        """
+        Returns {user_id: user dict or None} for every requested user_id
+        """
+
+    @abc.abstractmethod
+    def iter_users(self, user_id=None):
+        """
+        Yields (user_id, user_email, user_name, user_last_name) tuples of every
+        user, or only of user_id, ordered by user_id
+        """
+
+    @abc.abstractmethod
+    def count_users(self):
+        """
+        Returns the number of users
+        """
+
+    @abc.abstractmethod
+    def add_status_update(self, user_id, status_text):
+        """
+        Adds a status update with a new status_id.
+        Returns False if user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def add_status(self, status_id, user_id, status_text):
+        """
+        Adds a status update with the given status_id (kept as source_id if it
+        is not a number). Returns False if status_id already exists or
+        user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def known_user_ids(self):
+        """
+        Returns the set of every user_id
+        """
+
+    @abc.abstractmethod
+    def add_status_updates(self, rows):
+        """
+        Adds a sequence of dicts with 'user_id', 'status_text' and optionally
+        'status_id' and 'source_id', skipping rows of unknown users and rows
+        whose status_id or source_id exists. Returns the number added.
+        """
+
+    @abc.abstractmethod
+    def modify_status(self, status_id, user_id, status_text):
+        """
+        Replaces the fields of a status. Returns False if status_id or
+        user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def upsert_statuses(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Adds new status updates and updates the existing ones that differ,
+        rejecting rows of unknown users.
+        Returns {'inserted': n, 'updated': n, 'unchanged': n, 'rejected': n}.
+        """
+
+    @abc.abstractmethod
+    def delete_status_update(self, status_id):
+        """
+        Deletes a status update. Returns False if status_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def search_status_update(self, status_id):
+        """
+        Returns the status dict, or None if status_id does not exist
+        """
+
+    @abc.abstractmethod
+    def search_status_updates(self, status_ids):
+        """
+        Returns {status_id: status dict or None} for every requested status_id
+        """
+
+    @abc.abstractmethod
+    def iter_status_updates(self, user_id=None):
+        """
+        Yields (status_id, user_id, status_text) tuples of every status
+        update, or only of user_id, ordered by status_id
+        """
+
+    @abc.abstractmethod
+    def get_user_timeline(self, user_id, after_status_id=None,
+                          limit=users.DEFAULT_TIMELINE_LIMIT):
+        """
+        Returns up to limit status dicts of user_id after after_status_id,
+        ordered by status_id
+        """
+
+    @abc.abstractmethod
+    def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        """
+        Returns up to limit dicts with 'status_id', 'user_id', 'snippet' and
+        'rank' of the status updates matching query, best match first
+        """
+
+    @abc.abstractmethod
+    def count_status_updates(self, user_id=None):
+        """
+        Returns the number of status updates, of every user or only of
+        user_id. Returns None if user_id does not exist.
+        """
+
+    @abc.abstractmethod
+    def top_users(self, limit=users.DEFAULT_TOP_USERS):
+        """
+        Returns up to limit (user_id, status_count) tuples, most active first
+        """
+
+    @abc.abstractmethod
+    def atomic(self):
+        """
+        Returns a transaction context, used by the main.py loaders to commit
+        a chunk at a time
+        """
+
+    # Names of the dict-based user_status.UserStatusCollection, used by main.py
+    def delete_status(self, status_id):
+        """
+        Same as delete_status_update
+        """
+        return self.delete_status_update(status_id)
+
+    def search_status(self, status_id):
+        """
+        Same as search_status_update
+        """
+        return self.search_status_update(status_id)
+
+    def cache_info(self):
+        """
+        Returns the cache counters of the backend, or None without a cache
+        """
+        return None
+
+    def close(self):
+        """
+        Releases the resources held by the backend
+        """
+
+
+def _upsert_report(rows, key, existing, changed):
+    # Splits the rows of an upsert into inserted, updated and unchanged from
+    # the number of their keys that existed and of rows written
+    inserted = len({row[key] for row in rows}) - existing
+    return {'inserted': inserted, 'updated': changed - inserted,
+            'unchanged': existing - (changed - inserted)}
+
+
+def _add_reports(report, other):
+    for name, count in other.items():
+        report[name] += count
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Keeps users in a dict and statuses in a CompactUserStatusCollection,
+    whose user_id index makes cascading deletes and timelines cheap.
+    search_status_text matches status updates containing every word of the
+    query (no FTS5 syntax), oldest first, with a rank of 0.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.statuses = CompactUserStatusCollection()
+        # status_id <-> source_id of the statuses that have one
+        self.sources = {}
+        self.source_ids = {}
+        self._last_status_id = 0
+
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        if user_id in self.users:
+            return False
+        self.users[user_id] = dict(zip(USER_FIELDS, (user_id, user_name, user_last_name, user_email)))
+        return True
+
+    def add_users(self, rows):
+        added = 0
+        for row in rows:
+            added += self.add_user(*(row[field] for field in USER_FIELDS))
+        return added
+
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        if user_id not in self.users:
+            return False
+        self.users[user_id] = dict(zip(USER_FIELDS, (user_id, user_name, user_last_name, user_email)))
+        return True
+
+    def upsert_users(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        rows = {row['user_id']: row for row in rows}
+        existing = sum(user_id in self.users for user_id in rows)
+        changed = 0
+        for user_id, row in rows.items():
+            user = {field: row[field] for field in USER_FIELDS}
+            if self.users.get(user_id) != user:
+                self.users[user_id] = user
+                changed += 1
+        return _upsert_report(rows.values(), 'user_id', existing, changed)
+
+    def delete_user(self, user_id):
+        if self.users.pop(user_id, None) is None:
+            return False
+        for status_id in self.statuses.user_status_ids(user_id):
+            self._delete_status(status_id)
+        return True
+
+    def delete_users(self, user_ids, chunk_size=users.DEFAULT_DELETE_CHUNK_SIZE):
+        report = {'users': 0, 'statuses': 0}
+        for user_id in dict.fromkeys(user_ids):
+            statuses = len(self.statuses.user_status_ids(user_id))
+            if self.delete_user(user_id):
+                report['users'] += 1
+                report['statuses'] += statuses
+        return report
+
+    def search_user(self, user_id):
+        user = self.users.get(user_id)
+        return dict(user) if user is not None else None
+
+    def search_users(self, user_ids):
+        return {user_id: self.search_user(user_id) for user_id in user_ids}
+
+    def iter_users(self, user_id=None):
+        user_ids = sorted(self.users) if user_id is None else [user_id] * (user_id in self.users)
+        for key in user_ids:
+            user = self.users[key]
+            yield user['user_id'], user['user_email'], user['user_name'], user['user_last_name']
+
+    def count_users(self):
+        return len(self.users)
+
+    def _insert_status(self, status_id, user_id, status_text, source_id=None):
+        # Returns False if the user is unknown or status_id/source_id exists
+        if user_id not in self.users or status_id in self.statuses.database \
+                or source_id in self.source_ids:
+            return False
+        if status_id is None:
+            status_id = self._last_status_id + 1
+        self._last_status_id = max(self._last_status_id, status_id)
+        self.statuses.add_status(status_id, user_id, status_text)
+        if source_id is not None:
+            self.sources[status_id] = source_id
+            self.source_ids[source_id] = status_id
+        return True
+
+    def _delete_status(self, status_id):
+        if not self.statuses.delete_status(status_id):
+            return False
+        source_id = self.sources.pop(status_id, None)
+        if source_id is not None:
+            del self.source_ids[source_id]
+        return True
+
+    def add_status_update(self, user_id, status_text):
+        return self._insert_status(None, user_id, status_text)
+
+    def add_status(self, status_id, user_id, status_text):
+        numeric_id = numeric_status_id(status_id)
+        if numeric_id is not None:
+            return self._insert_status(numeric_id, user_id, status_text)
+        return self._insert_status(None, user_id, status_text, str(status_id))
+
+    def known_user_ids(self):
+        return set(self.users)
+
+    def add_status_updates(self, rows):
+        added = 0
+        for row in rows:
+            added += self._insert_status(row.get('status_id'), row['user_id'],
+                                         row['status_text'], row.get('source_id'))
+        return added
+
+    def modify_status(self, status_id, user_id, status_text):
+        if user_id not in self.users:
+            return False
+        return self.statuses.modify_status(numeric_status_id(status_id), user_id, status_text)
+
+    def upsert_statuses(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        valid_rows = {int(row['status_id']): row for row in rows if row['user_id'] in self.users}
+        existing = sum(status_id in self.statuses.database for status_id in valid_rows)
+        changed = 0
+        for status_id, row in valid_rows.items():
+            if self.search_status_update(status_id) == {
+                    'status_id': status_id, 'user_id': row['user_id'],
+                    'status_text': row['status_text']}:
+                continue
+            if status_id in self.statuses.database:
+                self.statuses.modify_status(status_id, row['user_id'], row['status_text'])
+            else:
+                self._insert_status(status_id, row['user_id'], row['status_text'])
+            changed += 1
+        report = _upsert_report([{'status_id': status_id} for status_id in valid_rows],
+                                'status_id', existing, changed)
+        report['rejected'] = len(rows) - sum(row['user_id'] in self.users for row in rows)
+        return report
+
+    def delete_status_update(self, status_id):
+        return self._delete_status(numeric_status_id(status_id))
+
+    def search_status_update(self, status_id):
+        status = self.statuses.database.get(numeric_status_id(status_id))
+        if status is None:
+            return None
+        return dict(zip(STATUS_FIELDS, (status.status_id, status.user_id, status.status_text)))
+
+    def search_status_updates(self, status_ids):
+        return {status_id: self.search_status_update(status_id) for status_id in status_ids}
+
+    def iter_status_updates(self, user_id=None):
+        if user_id is None:
+            status_ids = sorted(self.statuses.database)
+        else:
+            status_ids = sorted(self.statuses.user_status_ids(user_id))
+        for status_id in status_ids:
+            status = self.statuses.database[status_id]
+            yield status.status_id, status.user_id, status.status_text
+
+    def get_user_timeline(self, user_id, after_status_id=None,
+                          limit=users.DEFAULT_TIMELINE_LIMIT):
+        if after_status_id is not None:
+            after_status_id = int(after_status_id)
+        return self.statuses.get_user_timeline(user_id, after_status_id, limit)
+
+    def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        words = query.lower().split()
+        matches = (status for _, status in sorted(self.statuses.database.items())
+                   if all(word in status.status_text.lower() for word in words))
+        return [{'status_id': status.status_id, 'user_id': status.user_id,
+                 'snippet': status.status_text, 'rank': 0.0}
+                for status in itertools.islice(matches, limit)]
+
+    def count_status_updates(self, user_id=None):
+        if user_id is None:
+            return len(self.statuses.database)
+        if user_id not in self.users:
+            return None
+        return len(self.statuses.user_index.get(user_id, ()))
+
+    def top_users(self, limit=users.DEFAULT_TOP_USERS):
+        counts = ((user_id, len(self.statuses.user_index.get(user_id, ())))
+                  for user_id in self.users)
+        return heapq.nsmallest(limit, counts, key=lambda row: (-row[1], row[0]))
+
+    def atomic(self):
+        return nullcontext()
+
+
+class PeeweeBackend(StorageBackend):
+    """
+    The users.UserCollection and users.UserStatusCollection of the
+    socialnetwork_model database behind a single object. options (profile,
+    cache_size, cache_ttl, fast_path) are passed to both collections.
+    """
+
+    def __init__(self, **options):
+        self.users = users.UserCollection(**options)
+        self.statuses = users.UserStatusCollection(**options)
+        self.database = socialnetwork_model.database
+
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        return self.users.add_user(user_id, user_name, user_last_name, user_email)
+
+    def add_users(self, rows):
+        return self.users.add_users(rows)
+
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        return self.users.modify_user(user_id, user_name, user_last_name, user_email)
+
+    def upsert_users(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        return self.users.upsert_users(rows, chunk_size)
+
+    def delete_user(self, user_id):
+        return self.users.delete_user(user_id)
+
+    def delete_users(self, user_ids, chunk_size=users.DEFAULT_DELETE_CHUNK_SIZE):
+        return self.users.delete_users(user_ids, chunk_size)
+
+    def search_user(self, user_id):
+        return self.users.search_user(user_id)
+
+    def search_users(self, user_ids):
+        return self.users.search_users(user_ids)
+
+    def iter_users(self, user_id=None):
+        return self.users.iter_users(user_id)
+
+    def count_users(self):
+        return self.users.count_users()
+
+    def add_status_update(self, user_id, status_text):
+        return self.statuses.add_status_update(user_id, status_text)
+
+    def add_status(self, status_id, user_id, status_text):
+        return self.statuses.add_status(status_id, user_id, status_text)
+
+    def known_user_ids(self):
+        return self.statuses.known_user_ids()
+
+    def add_status_updates(self, rows):
+        # The collection expects rows of known users only
+        rows = list(rows)
+        known = {user_id for user_id, user in
+                 self.users.search_users({row['user_id'] for row in rows}).items() if user}
+        return self.statuses.add_status_updates([row for row in rows if row['user_id'] in known])
+
+    def modify_status(self, status_id, user_id, status_text):
+        return self.statuses.modify_status(status_id, user_id, status_text)
+
+    def upsert_statuses(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        return self.statuses.upsert_statuses(rows, chunk_size)
+
+    def delete_status_update(self, status_id):
+        return self.statuses.delete_status_update(status_id)
+
+    def search_status_update(self, status_id):
+        return self.statuses.search_status_update(status_id)
+
+    def search_status_updates(self, status_ids):
+        return self.statuses.search_status_updates(status_ids)
+
+    def iter_status_updates(self, user_id=None):
+        return self.statuses.iter_status_updates(user_id)
+
+    def get_user_timeline(self, user_id, after_status_id=None,
+                          limit=users.DEFAULT_TIMELINE_LIMIT):
+        return self.statuses.get_user_timeline(user_id, after_status_id, limit)
+
+    def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        return self.statuses.search_status_text(query, limit)
+
+    def count_status_updates(self, user_id=None):
+        return self.statuses.count_status_updates(user_id)
+
+    def top_users(self, limit=users.DEFAULT_TOP_USERS):
+        return self.statuses.top_users(limit)
+
+    def atomic(self):
+        return self.database.atomic()
+
+    def cache_info(self):
+        if self.users.cache is None:
+            return None
+        return {'users': self.users.cache_info(), 'status': self.statuses.cache_info()}
+
+    def close(self):
+        for fast_path in (self.users.fast_path, self.statuses.fast_path):
+            if fast_path is not None:
+                fast_path.close()
+        self.database.close()
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Stores users and statuses in the socialnetwork_model schema using the
+    sqlite3 module directly, skipping query building and model instances.
+    The connection and the single-row statements are those of fastpath.
+    """
+
+    def __init__(self, filename=None, profile=None):
+        self.filename = filename or socialnetwork_model.database.database
+        self.connection = fastpath.connect(self.filename, profile, check_same_thread=False)
+        self._depth = 0
+
+    @contextmanager
+    def atomic(self):
+        # The outermost block is a transaction, nested blocks join it
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        self._depth = 1
+        try:
+            self.connection.execute('BEGIN')
+            with self.connection:
+                yield
+        finally:
+            self._depth = 0
+
+    def _row(self, fields, row):
+        return dict(zip(fields, row)) if row is not None else None
+
+    def _select_in(self, sql, ids):
+        # sql has a single {} placeholder for the IN (...) parameter list
+        for chunk in chunked(list(dict.fromkeys(ids)), SQLITE_MAX_VARIABLES):
+            yield from self.connection.execute(
+                sql.format(', '.join('?' * len(chunk))), chunk)
+
+    def _iterate(self, sql, params=()):
+        cursor = self.connection.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(ITERATION_BATCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def _upsert(self, table, fields, rows, chunk_size):
+        # Same as socialnetwork_model.upsert: INSERT ... ON CONFLICT DO UPDATE ... WHERE,
+        # one transaction per chunk_size rows, the last row of a key wins
+        key = fields[0]
+        rows = list({row[key]: row for row in rows}.values())
+        sql = (f"INSERT INTO {table} ({', '.join(fields)}) "
+               f"VALUES ({', '.join('?' * len(fields))}) "
+               f"ON CONFLICT ({key}) DO UPDATE SET "
+               f"{', '.join(f'{field} = excluded.{field}' for field in fields[1:])} "
+               f"WHERE {' OR '.join(f'{field} IS NOT excluded.{field}' for field in fields[1:])}")
+        report = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        for chunk in chunked(rows, chunk_size):
+            with self.atomic():
+                existing = sum(1 for _ in self._select_in(
+                    f'SELECT {key} FROM {table} WHERE {key} IN ({{}})',
+                    [row[key] for row in chunk]))
+                changed = self.connection.executemany(
+                    sql, ([row[field] for field in fields] for row in chunk)).rowcount
+            _add_reports(report, _upsert_report(chunk, key, existing, changed))
+        return report
+
+    def add_user(self, user_id, user_name, user_last_name, user_email):
+        try:
+            with self.atomic():
+                self.connection.execute(fastpath.INSERT_USER,
+                                        (user_id, user_name, user_last_name, user_email))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def add_users(self, rows):
+        with self.atomic():
+            cursor = self.connection.executemany(
+                'INSERT OR IGNORE INTO users (user_id, user_name, user_last_name, user_email) '
+                'VALUES (?, ?, ?, ?)',
+                ((row['user_id'], row['user_name'], row['user_last_name'], row['user_email'])
+                 for row in rows))
+        return cursor.rowcount
+
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        with self.atomic():
+            cursor = self.connection.execute(
+                'UPDATE users SET user_name = ?, user_last_name = ?, user_email = ? '
+                'WHERE user_id = ?', (user_name, user_last_name, user_email, user_id))
+        return cursor.rowcount == 1
+
+    def upsert_users(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        return self._upsert('users', USER_FIELDS, rows, chunk_size)
+
+    def delete_user(self, user_id):
+        # Statuses are deleted explicitly, as UserCollection does
+        with self.atomic():
+            self.connection.execute(fastpath.DELETE_USER_STATUSES, (user_id,))
+            cursor = self.connection.execute(fastpath.DELETE_USER, (user_id,))
+        return cursor.rowcount == 1
+
+    def delete_users(self, user_ids, chunk_size=users.DEFAULT_DELETE_CHUNK_SIZE):
+        report = {'users': 0, 'statuses': 0}
+        for chunk in chunked(list(dict.fromkeys(user_ids)), min(chunk_size, SQLITE_MAX_VARIABLES)):
+            placeholders = ', '.join('?' * len(chunk))
+            with self.atomic():
+                report['statuses'] += self.connection.execute(
+                    f'DELETE FROM status WHERE user_id IN ({placeholders})', chunk).rowcount
+                report['users'] += self.connection.execute(
+                    f'DELETE FROM users WHERE user_id IN ({placeholders})', chunk).rowcount
+        return report
+
+    def search_user(self, user_id):
+        row = self.connection.execute(fastpath.SELECT_USER, (user_id,)).fetchone()
+        return self._row(USER_FIELDS, row)
+
+    def search_users(self, user_ids):
+        found = {row[0]: self._row(USER_FIELDS, row) for row in self._select_in(
+            'SELECT user_id, user_name, user_last_name, user_email FROM users '
+            'WHERE user_id IN ({})', user_ids)}
+        return {user_id: found.get(user_id) for user_id in user_ids}
+
+    def iter_users(self, user_id=None):
+        if user_id is None:
+            return self._iterate('SELECT user_id, user_email, user_name, user_last_name '
+                                 'FROM users ORDER BY user_id')
+        return self._iterate('SELECT user_id, user_email, user_name, user_last_name '
+                             'FROM users WHERE user_id = ?', (user_id,))
+
+    def count_users(self):
+        return self.connection.execute(
+            "SELECT value FROM network_stats WHERE name = 'users'").fetchone()[0]
+
+    def add_status_update(self, user_id, status_text):
+        try:
+            with self.atomic():
+                self.connection.execute(fastpath.INSERT_STATUS, (user_id, status_text))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def add_status(self, status_id, user_id, status_text):
+        numeric_id = numeric_status_id(status_id)
+        try:
+            with self.atomic():
+                self.connection.execute(
+                    'INSERT INTO status (status_id, user_id, status_text, source_id) '
+                    'VALUES (?, ?, ?, ?)',
+                    (numeric_id, user_id, status_text,
+                     None if numeric_id is not None else str(status_id)))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def known_user_ids(self):
+        return {user_id for (user_id,) in self._iterate('SELECT user_id FROM users')}
+
+    def add_status_updates(self, rows):
+        # Rows of unknown users are filtered in SQL instead of failing the batch
+        with self.atomic():
+            cursor = self.connection.executemany(
+                'INSERT OR IGNORE INTO status (status_id, user_id, status_text, source_id) '
+                'SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)',
+                ((row.get('status_id'), row['user_id'], row['status_text'],
+                  row.get('source_id'), row['user_id']) for row in rows))
+        return cursor.rowcount
+
+    def modify_status(self, status_id, user_id, status_text):
+        try:
+            with self.atomic():
+                cursor = self.connection.execute(
+                    'UPDATE status SET user_id = ?, status_text = ? WHERE status_id = ?',
+                    (user_id, status_text, status_id))
+            return cursor.rowcount == 1
+        except sqlite3.IntegrityError:
+            return False
+
+    def upsert_statuses(self, rows, chunk_size=users.DEFAULT_UPSERT_CHUNK_SIZE):
+        known = {row[0] for row in self._select_in(
+            'SELECT user_id FROM users WHERE user_id IN ({})', [row['user_id'] for row in rows])}
+        valid_rows = [row for row in rows if row['user_id'] in known]
+        report = self._upsert('status', STATUS_FIELDS, valid_rows, chunk_size)
+        report['rejected'] = len(rows) - len(valid_rows)
+        return report
+
+    def delete_status_update(self, status_id):
+        with self.atomic():
+            cursor = self.connection.execute(fastpath.DELETE_STATUS, (status_id,))
+        return cursor.rowcount == 1
+
+    def search_status_update(self, status_id):
+        row = self.connection.execute(fastpath.SELECT_STATUS, (status_id,)).fetchone()
+        return self._row(STATUS_FIELDS, row)
+
+    def search_status_updates(self, status_ids):
+        found = {str(row[0]): self._row(STATUS_FIELDS, row) for row in self._select_in(
+            'SELECT status_id, user_id, status_text FROM status WHERE status_id IN ({})',
+            status_ids)}
+        return {status_id: found.get(str(status_id)) for status_id in status_ids}
+
+    def iter_status_updates(self, user_id=None):
+        if user_id is None:
+            return self._iterate('SELECT status_id, user_id, status_text FROM status '
+                                 'ORDER BY status_id')
+        return self._iterate('SELECT status_id, user_id, status_text FROM status '
+                             'WHERE user_id = ? ORDER BY status_id', (user_id,))
+
+    def get_user_timeline(self, user_id, after_status_id=None,
+                          limit=users.DEFAULT_TIMELINE_LIMIT):
+        cursor = self.connection.execute(
+            'SELECT status_id, user_id, status_text FROM status '
+            'WHERE user_id = ? AND status_id > ? ORDER BY status_id LIMIT ?',
+            (user_id, after_status_id if after_status_id is not None else -1, limit))
+        return [self._row(STATUS_FIELDS, row) for row in cursor]
+
+    def search_status_text(self, query, limit=users.DEFAULT_SEARCH_LIMIT):
+        try:
+            cursor = self.connection.execute(
+                "SELECT status.status_id, status.user_id, "
+                "snippet(status_fts, 0, '[', ']', '...', 10), bm25(status_fts) AS rank "
+                "FROM status_fts JOIN status ON status.status_id = status_fts.rowid "
+                "WHERE status_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit))
+            return [self._row(('status_id', 'user_id', 'snippet', 'rank'), row)
+                    for row in cursor]
+        except sqlite3.OperationalError as error:
+            logging.error("Invalid status search query '%s': %s", query, error)
+            return []
+
+    def count_status_updates(self, user_id=None):
+        if user_id is None:
+            row = self.connection.execute(
+                "SELECT value FROM network_stats WHERE name = 'statuses'").fetchone()
+        else:
+            row = self.connection.execute(
+                'SELECT status_count FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def top_users(self, limit=users.DEFAULT_TOP_USERS):
+        return self.connection.execute(
+            'SELECT user_id, status_count FROM user_stats '
+            'ORDER BY status_count DESC, user_id LIMIT ?', (limit,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'peewee': PeeweeBackend,
+    'sqlite': SqliteBackend,
+}
+
+
+def get_backend(name=None, **options):
+    """
+    Creates the named storage backend, falling back to the
+    SOCIALNETWORK_BACKEND environment variable and then to 'peewee'.
+    options are passed to the backend constructor (e.g. profile='bulk-load').
+    Raises ValueError for an unknown backend name.
+    """
+    name = name or os.environ.get(BACKEND_ENV_VAR) or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}'. "
+                         f"Choose one of: {', '.join(BACKENDS)}")
+    logging.info("Using the '%s' storage backend.", name)
+    return BACKENDS[name](**options)
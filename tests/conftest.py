@@ -0,0 +1,28 @@
+"""
+Shared fixtures. Every test runs in its own temporary directory with the
+shared database pointed at a fresh file there, so no test touches the
+socialnetwork.db of the working directory.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socialnetwork_model  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    The shared database, on a new file in a temporary working directory
+    """
+    monkeypatch.chdir(tmp_path)
+    previous = socialnetwork_model.database.database
+    socialnetwork_model.database.init(str(tmp_path / socialnetwork_model.DATABASE_NAME),
+                                      pragmas=socialnetwork_model.profile_pragmas(
+                                          socialnetwork_model.active_profile))
+    yield socialnetwork_model.database
+    socialnetwork_model.database.close()
+    socialnetwork_model.database.init(previous, pragmas=socialnetwork_model.profile_pragmas(
+        socialnetwork_model.active_profile))
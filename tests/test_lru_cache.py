@@ -0,0 +1,46 @@
+"""
+Tests of the LRU cache of the collections
+"""
+import pytest
+from lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.lookup('a')
+    cache.put('c', 3)
+    assert cache.lookup('b') == (False, None)
+    assert cache.lookup('a') == (True, 1)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = LRUCache(10)
+
+    def loader():
+        # A writer updates the row and invalidates it while the old row is read
+        cache.invalidate('a')
+        return 'old'
+    assert cache.get_or_load('a', loader) == 'old'
+    assert cache.lookup('a') == (False, None)
+    assert cache.get_or_load('a', lambda: 'new') == 'new'
+    assert cache.lookup('a') == (True, 'new')
+
+
+def test_clear_during_load_drops_loaded_values():
+    cache = LRUCache(10)
+    epoch = cache.begin_load()
+    cache.clear()
+    cache.end_load(epoch, {'a': 1})
+    assert cache.lookup('a') == (False, None)
+
+
+def test_failed_load_is_not_cached():
+    cache = LRUCache(10)
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('a', lambda: (_ for _ in ()).throw(RuntimeError))
+    cache.invalidate('b')
+    assert cache.get_or_load('b', lambda: 2) == 2
+    assert cache.lookup('b') == (True, 2)
@@ -0,0 +1,165 @@
+"""
+Tests of the main.py functions on the SQL collections
+"""
+import os
+import main
+
+
+def test_status_functions_work_on_the_sql_collection(database):
+    user_collection, status_collection = main.init_collections(shards=1)
+    assert main.add_user('a', 'a@example.com', 'Ann', 'Lee', user_collection)
+    assert status_collection.add_status(5, 'a', 'hello')
+    assert main.search_status(5, status_collection) == \
+        {'status_id': 5, 'user_id': 'a', 'status_text': 'hello'}
+    assert main.update_status('a', 5, 'changed', status_collection)
+    assert main.delete_status(5, status_collection)
+    assert main.search_status(5, status_collection) is None
+    assert not main.delete_status(5, status_collection)
+
+
+def test_add_status_rejects_duplicates_and_unknown_users(database):
+    user_collection, status_collection = main.init_collections(shards=1)
+    user_collection.add_user('a', 'Ann', 'Lee', 'a@example.com')
+    assert status_collection.add_status('1', 'a', 'first')
+    assert not status_collection.add_status(1, 'a', 'again')
+    assert not status_collection.add_status(2, 'nobody', 'text')
+    # The status_id of the CSV files is kept as source_id, under a new status_id
+    assert status_collection.add_status('a_00001', 'a', 'not a number')
+    assert not status_collection.add_status('a_00001', 'a', 'again')
+    assert status_collection.count_status_updates('a') == 2
+
+
+def test_save_functions_export_the_sql_tables(database, tmp_path):
+    user_collection, status_collection = main.init_collections(shards=1)
+    user_collection.add_user('a', 'Ann', 'Lee', 'a@example.com')
+    status_collection.add_status(1, 'a', 'hello')
+    assert main.save_users(str(tmp_path / 'users.csv'), user_collection)
+    assert main.save_status_updates(str(tmp_path / 'statuses.csv'), status_collection)
+    assert (tmp_path / 'users.csv').read_text().splitlines() == \
+        ['user_id,email,name,lastname', 'a,a@example.com,Ann,Lee']
+    assert (tmp_path / 'statuses.csv').read_text().splitlines() == \
+        ['status_id,user_id,status_text', '1,a,hello']
+
+
+def test_resumable_load_reloads_a_file_rewritten_with_the_same_size(database, tmp_path):
+    user_collection, _ = main.init_collections(shards=1)
+    filename = tmp_path / 'users.csv'
+    filename.write_text('user_id,email,name,lastname\n'
+                        'a,a@example.com,Ann,Lee\nb,b@example.com,Bob,Ray\n')
+    assert main.resumable_load_users(str(filename), user_collection)['inserted'] == 2
+    assert main.resumable_load_users(str(filename), user_collection)['inserted'] == 0
+    # Same size, same first and last bytes, new row in the middle
+    filename.write_text('user_id,email,name,lastname\n'
+                        'c,a@example.com,Ann,Lee\nb,b@example.com,Bob,Ray\n')
+    assert main.resumable_load_users(str(filename), user_collection)['inserted'] == 1
+    assert user_collection.search_user('c')['user_name'] == 'Ann'
+
+
+def test_add_and_update_user_store_each_field_in_its_column(database, tmp_path):
+    user_collection, _ = main.init_collections(shards=1)
+    assert main.add_user('a', 'a@example.com', 'Ann', 'Lee', user_collection)
+    expected = {'user_id': 'a', 'user_name': 'Ann', 'user_last_name': 'Lee',
+                'user_email': 'a@example.com'}
+    assert main.search_user('a', user_collection) == expected
+    assert main.update_user('a', 'new@example.com', 'Ann', 'Lee', user_collection)
+    assert main.search_user('a', user_collection)['user_email'] == 'new@example.com'
+    filename = tmp_path / 'users.csv'
+    filename.write_text('user_id,email,name,lastname\nb,b@example.com,Bob,Ray\n')
+    assert main.load_users(str(filename), user_collection)
+    assert main.search_user('b', user_collection) == {
+        'user_id': 'b', 'user_name': 'Bob', 'user_last_name': 'Ray',
+        'user_email': 'b@example.com'}
+
+
+def test_loading_a_status_file_again_skips_the_rows_already_loaded(database, tmp_path):
+    user_collection, status_collection = main.init_collections(shards=1)
+    user_collection.add_user('a', 'Ann', 'Lee', 'a@example.com')
+    filename = tmp_path / 'statuses.csv'
+    filename.write_text('status_id,user_id,status_text\n'
+                        '100,a,numbered\na_00001,a,legacy\n')
+    assert main.bulk_load_status_updates(str(filename), status_collection) == \
+        {'inserted': 2, 'skipped': 0, 'rejected': 0}
+    assert main.bulk_load_status_updates(str(filename), status_collection) == \
+        {'inserted': 0, 'skipped': 2, 'rejected': 0}
+    assert main.search_status(100, status_collection)['status_text'] == 'numbered'
+    assert status_collection.count_status_updates() == 2
+    # A touched file is a new resumable import, its rows are still skipped
+    os.utime(filename, ns=(0, 0))
+    report = main.resumable_load_status_updates(str(filename), status_collection)
+    assert (report['inserted'], report['skipped']) == (0, 2)
+
+
+def test_load_functions_read_upper_case_headers_and_legacy_status_ids(database, tmp_path):
+    user_collection, status_collection = main.init_collections(shards=1)
+    users_file = tmp_path / 'accounts.csv'
+    users_file.write_text('USER_ID,NAME,LASTNAME,EMAIL\n'
+                          'Brittaney.Gentry86,Brittaney,Gentry,Brittaney.Gentry86@goodmail.com\n')
+    statuses_file = tmp_path / 'status_updates.csv'
+    statuses_file.write_text('STATUS_ID,USER_ID,STATUS_TEXT\n'
+                             'Brittaney.Gentry86_00001,Brittaney.Gentry86,sunny day\n')
+    assert main.load_users(str(users_file), user_collection)
+    assert main.load_status_updates(str(statuses_file), status_collection)
+    assert user_collection.search_user('Brittaney.Gentry86')['user_name'] == 'Brittaney'
+    assert status_collection.count_status_updates('Brittaney.Gentry86') == 1
+    assert main.bulk_load_status_updates(str(statuses_file), status_collection)['skipped'] == 1
+
+
+def test_parallel_loaders_match_the_serial_ones_across_byte_ranges(database, tmp_path,
+                                                                   monkeypatch):
+    import socialnetwork_model  # pylint: disable=import-outside-toplevel
+    users_file, statuses_file = tmp_path / 'users.csv', tmp_path / 'statuses.csv'
+    users_file.write_text('USER_ID,EMAIL,NAME,LASTNAME\n' + ''.join(
+        f'u{number},u{number}@example.com,Name{number},Last{number}\n' for number in range(30)))
+    statuses_file.write_text('STATUS_ID,USER_ID,STATUS_TEXT\n' + ''.join(
+        f'u{number % 40}_{number:05d},u{number % 40},text number {number}\n'
+        for number in range(200)) + 'u1_99999,u1,\n')
+    # Small ranges, so each file is parsed by several workers
+    monkeypatch.setattr(main, 'PARALLEL_RANGE_SIZE', 256)
+    assert len(main._split_byte_ranges(str(statuses_file), 0, main.PARALLEL_RANGE_SIZE)) > 5
+
+    def load(loader, **options):
+        socialnetwork_model.database.close()
+        socialnetwork_model.database.init(str(tmp_path / f'{loader}.db'))
+        user_collection, status_collection = main.init_collections(shards=1)
+        rejects = tmp_path / f'{loader}.rejected.csv'
+        reports = (getattr(main, f'{loader}_load_users')(str(users_file), user_collection,
+                                                         chunk_size=7, **options),
+                   getattr(main, f'{loader}_load_status_updates')(
+                       str(statuses_file), status_collection, chunk_size=7,
+                       rejects_filename=str(rejects), **options))
+        return (reports, list(user_collection.iter_users()),
+                list(status_collection.iter_status_updates()), rejects.read_text())
+
+    serial, parallel = load('bulk'), load('parallel', workers=3)
+    assert serial[0][1] == {'inserted': 150, 'skipped': 0, 'rejected': 51}
+    assert parallel == serial
+
+
+def test_stats_follow_bulk_loads_deletes_and_rebuilds(database, tmp_path):
+    import socialnetwork_model  # pylint: disable=import-outside-toplevel
+    user_collection, status_collection = main.init_collections(shards=1)
+    (tmp_path / 'users.csv').write_text('USER_ID,EMAIL,NAME,LASTNAME\n' + ''.join(
+        f'u{number},u{number}@example.com,Ann,Lee\n' for number in range(4)))
+    (tmp_path / 'statuses.csv').write_text('STATUS_ID,USER_ID,STATUS_TEXT\n' + ''.join(
+        f'u{number % 3}_{number:05d},u{number % 3},text\n' for number in range(10)))
+    main.bulk_load_users(str(tmp_path / 'users.csv'), user_collection)
+    main.bulk_load_status_updates(str(tmp_path / 'statuses.csv'), status_collection)
+    assert main.count_users(user_collection) == 4
+    assert main.count_status_updates(status_collection) == 10
+    assert main.count_status_updates(status_collection, 'u0') == 4
+    assert main.count_status_updates(status_collection, 'u3') == 0
+    assert main.count_status_updates(status_collection, 'nobody') is None
+    assert main.top_users(status_collection, 2) == [('u0', 4), ('u1', 3)]
+
+    assert main.delete_users(['u0', 'u3'], user_collection) == {'users': 2, 'statuses': 4}
+    assert main.count_users(user_collection) == 2
+    assert main.count_status_updates(status_collection) == 6
+    assert main.count_status_updates(status_collection, 'u0') is None
+    assert main.top_users(status_collection) == [('u1', 3), ('u2', 3)]
+
+    # Counters edited out of band are recomputed from the tables
+    socialnetwork_model.UserStats.update(status_count=99).execute()
+    socialnetwork_model.NetworkStats.update(value=0).execute()
+    assert main.rebuild_stats() == {'users': 2, 'statuses': 6}
+    assert main.count_users(user_collection) == 2
+    assert main.top_users(status_collection) == [('u1', 3), ('u2', 3)]
@@ -0,0 +1,81 @@
+"""
+Tests of the sharded collections of sharding.py
+"""
+import sqlite3
+import pytest
+import changefeed
+import main
+import sharding
+import socialnetwork_model
+
+
+@pytest.fixture
+def sharded(database):
+    user_collection, status_collection = main.init_collections(shards=3)
+    yield user_collection, status_collection
+    user_collection.shards.close()
+
+
+def test_users_and_statuses_live_in_the_user_shard(sharded):
+    user_collection, status_collection = sharded
+    for index in range(30):
+        assert user_collection.add_user(f'u{index}', 'Name', 'Last', 'e@example.com')
+        assert status_collection.add_status_update(f'u{index}', f'text {index}')
+    assert user_collection.count_users() == 30
+    assert status_collection.count_status_updates() == 30
+    shards = user_collection.shards
+    for index in range(30):
+        status = status_collection.get_user_timeline(f'u{index}')[0]
+        assert shards.for_status(status['status_id']) == shards.for_user(f'u{index}')
+        assert status_collection.search_status_update(status['status_id']) == status
+
+
+def test_shards_have_no_change_log_and_the_feed_is_refused(sharded):
+    user_collection, _ = sharded
+    user_collection.add_user('a', 'Name', 'Last', 'e@example.com')
+    for filename in user_collection.shards.filenames:
+        connection = sqlite3.connect(filename)
+        assert connection.execute('SELECT COUNT(*) FROM change_log').fetchone() == (0,)
+        assert not connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                                      "AND name LIKE 'change_log_%'").fetchall()
+        connection.close()
+    with pytest.raises(RuntimeError):
+        main.read_changes(0)
+    with pytest.raises(RuntimeError):
+        changefeed.compact_changes()
+
+
+def test_resumable_loads_refuse_sharded_collections(sharded, tmp_path):
+    user_collection, status_collection = sharded
+    filename = tmp_path / 'users.csv'
+    filename.write_text('user_id,email,name,lastname\na,a@example.com,Ann,Lee\n')
+    assert main.resumable_load_users(str(filename), user_collection) is None
+    assert main.resumable_load_status_updates(str(filename), status_collection) is None
+    assert user_collection.count_users() == 0
+
+
+def test_rebalance_refuses_a_target_that_is_not_empty(sharded):
+    source = main.init_collections(shards=1)
+    source[0].add_user('a', 'Name', 'Last', 'e@example.com')
+    source[1].add_status_update('a', 'hello')
+    assert sharding.rebalance(*source, *sharded) == {'users': 1, 'statuses': 1}
+    with pytest.raises(ValueError):
+        sharding.rebalance(*source, *sharded)
+    assert sharded[1].count_status_updates() == 1
+    assert socialnetwork_model.sharded()
+
+
+def test_loading_a_status_file_again_skips_the_rows_already_loaded(sharded, tmp_path):
+    user_collection, status_collection = sharded
+    for index in range(5):
+        user_collection.add_user(f'u{index}', 'Name', 'Last', 'e@example.com')
+    filename = tmp_path / 'statuses.csv'
+    filename.write_text('status_id,user_id,status_text\n' + ''.join(
+        f'u{index}_0000{index},u{index},text\n{index + 1},u{index},numbered\n'
+        for index in range(5)))
+    assert main.bulk_load_status_updates(str(filename), status_collection)['inserted'] == 10
+    assert main.bulk_load_status_updates(str(filename), status_collection) == \
+        {'inserted': 0, 'skipped': 10, 'rejected': 0}
+    target = main.init_collections(shards=1)
+    sharding.rebalance(user_collection, status_collection, *target)
+    assert main.bulk_load_status_updates(str(filename), target[1])['skipped'] == 10
@@ -0,0 +1,37 @@
+"""
+Tests of the schema and the query plans of socialnetwork_model
+"""
+import socialnetwork_model
+
+
+def test_fresh_database_has_current_schema(database):
+    database.connect()
+    assert socialnetwork_model.schema_version(database.connection()) == \
+        socialnetwork_model.SCHEMA_VERSION
+
+
+def test_hot_queries_use_indexes(database):
+    assert socialnetwork_model.full_table_scans() == {}
+
+
+def test_fast_path_and_shards_default_to_the_active_profile(database, monkeypatch):
+    import fastpath  # pylint: disable=import-outside-toplevel
+    monkeypatch.setattr(socialnetwork_model, 'active_profile', 'bulk-load')
+    fast_path = fastpath.FastPath()
+    assert fast_path.profile == 'bulk-load'
+    # synchronous = off
+    assert fast_path.connection.execute('PRAGMA synchronous').fetchone()[0] == 0
+    fast_path.close()
+    shards = socialnetwork_model.ShardSet(2)
+    assert all(dict(shard._pragmas) == dict(socialnetwork_model.profile_pragmas('bulk-load'))
+               for shard in shards.databases)
+    shards.close()
+
+
+def test_create_tables_on_another_file_leaves_the_models_bound(database, tmp_path):
+    other = str(tmp_path / 'other.db')
+    socialnetwork_model.create_tables(other)
+    assert all(model._meta.database is database for model in socialnetwork_model.MODELS)
+    assert socialnetwork_model.Users.select().count() == 0
+    with socialnetwork_model.SqliteDatabase(other) as target:
+        assert set(target.get_tables()) >= {'users', 'status', 'status_fts', 'user_stats'}
@@ -0,0 +1,59 @@
+"""
+Tests of the main.py functions on every storage backend
+"""
+import pytest
+import main
+import storage
+
+
+@pytest.fixture(params=sorted(storage.BACKENDS))
+def backend(request, database):
+    backend = main.init_storage(request.param)
+    yield backend
+    backend.close()
+
+
+def test_main_functions_work_on_every_backend(backend, tmp_path):
+    assert main.add_user('a', 'a@example.com', 'Ann', 'Lee', backend)
+    assert not main.add_user('a', 'a@example.com', 'Ann', 'Lee', backend)
+    assert main.update_user('a', 'ann@example.com', 'Ann', 'Lee', backend)
+    assert main.search_user('a', backend) == {'user_id': 'a', 'user_name': 'Ann',
+                                              'user_last_name': 'Lee',
+                                              'user_email': 'ann@example.com'}
+    assert backend.add_status(5, 'a', 'hello world')
+    assert not backend.add_status(5, 'a', 'again')
+    assert not backend.add_status(6, 'nobody', 'text')
+    assert main.search_status(5, backend) == \
+        {'status_id': 5, 'user_id': 'a', 'status_text': 'hello world'}
+    assert main.update_status('a', 5, 'hello there', backend)
+    assert main.get_user_timeline('a', backend) == \
+        [{'status_id': 5, 'user_id': 'a', 'status_text': 'hello there'}]
+    assert [row['status_id'] for row in main.search_status_text('there', backend)] == [5]
+    assert main.count_status_updates(backend, 'a') == 1
+    assert main.top_users(backend) == [('a', 1)]
+    assert main.export_status_updates(str(tmp_path / 'statuses.csv'), backend)
+    assert main.delete_status(5, backend)
+    assert main.search_status(5, backend) is None
+    assert main.delete_user('a', backend)
+    assert main.search_user('a', backend) is None
+    assert main.count_users(backend) == 0
+
+
+def test_bulk_loaders_work_on_every_backend(backend, tmp_path):
+    (tmp_path / 'users.csv').write_text('USER_ID,EMAIL,NAME,LASTNAME\n'
+                                        'a,a@example.com,Ann,Lee\nb,b@example.com,Bob,Ray\n')
+    (tmp_path / 'statuses.csv').write_text('STATUS_ID,USER_ID,STATUS_TEXT\n'
+                                           'a_00001,a,first\na_00002,a,second\n'
+                                           'c_00001,c,unknown user\n')
+    assert main.bulk_load_users(str(tmp_path / 'users.csv'), backend)['inserted'] == 2
+    report = main.bulk_load_status_updates(str(tmp_path / 'statuses.csv'), backend)
+    assert (report['inserted'], report['rejected']) == (2, 1)
+    report = main.bulk_load_status_updates(str(tmp_path / 'statuses.csv'), backend)
+    assert (report['inserted'], report['skipped']) == (0, 2)
+    assert main.delete_users(['a', 'b', 'z'], backend) == {'users': 2, 'statuses': 2}
+
+
+def test_resumable_loaders_refuse_backends_without_the_shared_database(backend, tmp_path):
+    (tmp_path / 'users.csv').write_text('user_id,email,name,lastname\na,a@example.com,Ann,Lee\n')
+    report = main.resumable_load_users(str(tmp_path / 'users.csv'), backend)
+    assert (report is not None) == isinstance(backend, storage.PeeweeBackend)
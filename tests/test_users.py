@@ -0,0 +1,90 @@
+"""
+Tests of the SQL collections of users.py
+"""
+import users
+
+
+def test_cached_search_racing_a_modify_sees_the_new_row(database):
+    collection = users.UserCollection(cache_size=10)
+    collection.add_user('a', 'Old', 'Name', 'a@example.com')
+    load_user = collection._load_user
+
+    def racing_load(user_id):
+        # The row is read, then a writer modifies it before it is cached
+        row = load_user(user_id)
+        collection.modify_user('a', 'New', 'Name', 'a@example.com')
+        return row
+    collection._load_user = racing_load
+    assert collection.search_user('a')['user_name'] == 'Old'
+    collection._load_user = load_user
+    assert collection.search_user('a')['user_name'] == 'New'
+
+
+def test_writes_invalidate_the_caches_of_every_collection(database):
+    reader, writer = users.UserCollection(cache_size=10), users.UserCollection(cache_size=10)
+    statuses, status_writer = (users.UserStatusCollection(cache_size=10),
+                               users.UserStatusCollection(cache_size=10))
+    writer.add_user('a', 'Old', 'Name', 'a@example.com')
+    assert reader.search_user('b') is None
+    writer.add_users([{'user_id': 'b', 'user_name': 'Bob', 'user_last_name': 'Ray',
+                       'user_email': 'b@example.com'}])
+    assert reader.search_user('b')['user_name'] == 'Bob'
+    assert reader.search_user('a')['user_name'] == 'Old'
+    writer.modify_user('a', 'New', 'Name', 'a@example.com')
+    assert reader.search_user('a')['user_name'] == 'New'
+    writer.upsert_users([{'user_id': 'a', 'user_name': 'Newer', 'user_last_name': 'Name',
+                          'user_email': 'a@example.com'}])
+    assert reader.search_user('a')['user_name'] == 'Newer'
+
+    assert statuses.search_status_update(1) is None
+    status_writer.add_status(1, 'a', 'hello')
+    assert statuses.search_status_update(1)['status_text'] == 'hello'
+    status_writer.modify_status(1, 'a', 'changed')
+    assert statuses.search_status_update(1)['status_text'] == 'changed'
+    status_writer.delete_status_update(1)
+    assert statuses.search_status_update(1) is None
+
+    status_writer.add_status(2, 'a', 'again')
+    assert statuses.search_status_update(2) is not None
+    writer.delete_user('a')
+    assert reader.search_user('a') is None
+    assert statuses.search_status_update(2) is None
+
+
+def _user(user_id, name):
+    return {'user_id': user_id, 'user_name': name, 'user_last_name': 'Lee',
+            'user_email': f'{user_id}@example.com'}
+
+
+def test_upsert_users_reports_inserted_updated_and_unchanged(database):
+    collection = users.UserCollection()
+    # A repeated user_id keeps its last row and counts once
+    assert collection.upsert_users([_user('a', 'Ann'), _user('b', 'Bob'), _user('a', 'Anna')]) == \
+        {'inserted': 2, 'updated': 0, 'unchanged': 0}
+    assert collection.search_user('a')['user_name'] == 'Anna'
+    assert collection.upsert_users([_user('a', 'Anna'), _user('b', 'Rob'), _user('b', 'Robert'),
+                                    _user('c', 'Cy')], chunk_size=2) == \
+        {'inserted': 1, 'updated': 1, 'unchanged': 1}
+    assert collection.search_user('b')['user_name'] == 'Robert'
+    assert collection.count_users() == 3
+
+
+def test_upsert_statuses_reports_inserted_updated_unchanged_and_rejected(database):
+    users.UserCollection().upsert_users([_user('a', 'Ann'), _user('b', 'Bob')])
+    collection = users.UserStatusCollection()
+    rows = [{'status_id': 1, 'user_id': 'a', 'status_text': 'one'},
+            {'status_id': 2, 'user_id': 'a', 'status_text': 'two'},
+            {'status_id': 1, 'user_id': 'a', 'status_text': 'one again'},
+            {'status_id': 3, 'user_id': 'nobody', 'status_text': 'rejected'}]
+    assert collection.upsert_statuses(rows) == \
+        {'inserted': 2, 'updated': 0, 'unchanged': 0, 'rejected': 1}
+    assert collection.search_status_update(1)['status_text'] == 'one again'
+    rows = [{'status_id': 1, 'user_id': 'a', 'status_text': 'one again'},
+            {'status_id': 2, 'user_id': 'b', 'status_text': 'two'},
+            {'status_id': 2, 'user_id': 'b', 'status_text': 'moved'},
+            {'status_id': 4, 'user_id': 'b', 'status_text': 'four'}]
+    assert collection.upsert_statuses(rows, chunk_size=2) == \
+        {'inserted': 1, 'updated': 1, 'unchanged': 1, 'rejected': 0}
+    assert collection.search_status_update(2) == \
+        {'status_id': 2, 'user_id': 'b', 'status_text': 'moved'}
+    assert collection.count_status_updates('b') == 2
@@ -1,6 +1,8 @@
 import logging
+import sys
+import log_setup
 
-logging.basicConfig(filename='log_07_20_2023.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_setup.configure_logging()
 
 class UserStatus:
     """
@@ -24,13 +26,12 @@ class UserStatusCollection:
         add a new status message to the collection
         """
         if status_id in self.database:
-            logging.error(
-                f"An error occurred while trying to add a new status with ID '{status_id}'. Status ID already exists.")
+            logging.error("An error occurred while trying to add a new status with ID '%s'. Status ID already exists.", status_id)
             # Rejects new status if status_id already exists
             return False
         new_status = UserStatus(status_id, user_id, status_text)
         self.database[status_id] = new_status
-        logging.info(f"New status with ID '{status_id}' added successfully.")
+        logging.info("New status with ID '%s' added successfully.", status_id)
         return True
 
     def modify_status(self, status_id, user_id, status_text):
@@ -41,13 +42,12 @@ class UserStatusCollection:
         """
         if status_id not in self.database:
             # Rejects update if the status_id does not exist
-            logging.error(
-                f"An error occurred while trying to modify status with ID '{status_id}'. Status ID does not exist.")
+            logging.error("An error occurred while trying to modify status with ID '%s'. Status ID does not exist.", status_id)
             return False
 
         self.database[status_id].user_id = user_id
         self.database[status_id].status_text = status_text
-        logging.info(f"Status with ID '{status_id}' modified successfully.")
+        logging.info("Status with ID '%s' modified successfully.", status_id)
         return True
 
     def delete_status(self, status_id):
@@ -56,11 +56,10 @@ class UserStatusCollection:
         """
         if status_id not in self.database:
             # Fails if status does not exist
-            logging.error(
-                f"An error occurred while trying to delete status with ID '{status_id}'. Status ID does not exist.")
+            logging.error("An error occurred while trying to delete status with ID '%s'. Status ID does not exist.", status_id)
             return False
         del self.database[status_id]
-        logging.info(f"Status with ID '{status_id}' deleted successfully.")
+        logging.info("Status with ID '%s' deleted successfully.", status_id)
         return True
 
     def search_status(self, status_id):
@@ -70,9 +69,159 @@ class UserStatusCollection:
         Returns an empty UserStatus object if status_id does not exist
         """
         if status_id not in self.database:
-            logging.error(f"Status with ID '{status_id}' not found during the search.")
+            logging.error("Status with ID '%s' not found during the search.", status_id)
             return UserStatus(None, None, None)
 
-        logging.info(f"Status with ID '{status_id}' found during the search.")
+        logging.info("Status with ID '%s' found during the search.", status_id)
         return self.database[status_id]
 
+    def get_user_timeline(self, user_id, after_status_id=None, limit=20):
+        """
+        Returns up to limit status messages of user_id ordered by status_id,
+        starting after after_status_id when it is given
+        """
+        rows = sorted(
+            (status for status in self.database.values()
+             if status.user_id == user_id
+             and (after_status_id is None or status.status_id > after_status_id)),
+            key=lambda status: status.status_id)
+        return [{'status_id': status.status_id,
+                 'user_id': status.user_id,
+                 'status_text': status.status_text} for status in rows[:limit]]
+
+    def iter_status_updates(self, user_id=None):
+        """
+        Yields (status_id, user_id, status_text) tuples of every status message,
+        or only of user_id
+        """
+        for status in self.database.values():
+            if user_id is None or status.user_id == user_id:
+                yield status.status_id, status.user_id, status.status_text
+
+
+class CompactUserStatus:
+    """
+    Memory-compact status message record: same attributes as UserStatus,
+    but with __slots__ instead of a per-instance __dict__
+    """
+    __slots__ = ('status_id', 'user_id', 'status_text')
+
+    def __init__(self, status_id, user_id, status_text):
+        self.status_id = status_id
+        self.user_id = user_id
+        self.status_text = status_text
+
+
+def _intern(value):
+    # Many statuses share a user_id: store a single copy of each string
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class CompactUserStatusCollection:
+    """
+    Collection of status messages with the same API as UserStatusCollection,
+    built for large in-memory loads.
+
+    Statuses are stored as CompactUserStatus records with interned user_ids,
+    and a secondary index maps each user_id to its status_ids so per-user
+    queries do not scan the whole collection.
+    """
+
+    def __init__(self):
+        self.database = {}
+        # user_id -> {status_id: None}, a dict used as an insertion-ordered set
+        self.user_index = {}
+
+    def _index(self, user_id, status_id):
+        self.user_index.setdefault(user_id, {})[status_id] = None
+
+    def _unindex(self, user_id, status_id):
+        status_ids = self.user_index[user_id]
+        del status_ids[status_id]
+        if not status_ids:
+            del self.user_index[user_id]
+
+    def add_status(self, status_id, user_id, status_text):
+        """
+        add a new status message to the collection
+        """
+        if status_id in self.database:
+            logging.error("An error occurred while trying to add a new status with ID '%s'. Status ID already exists.", status_id)
+            return False
+        user_id = _intern(user_id)
+        self.database[status_id] = CompactUserStatus(status_id, user_id, status_text)
+        self._index(user_id, status_id)
+        logging.info("New status with ID '%s' added successfully.", status_id)
+        return True
+
+    def modify_status(self, status_id, user_id, status_text):
+        """
+        Modifies a status message
+
+        The new user_id and status_text are assigned to the existing message
+        """
+        status = self.database.get(status_id)
+        if status is None:
+            logging.error("An error occurred while trying to modify status with ID '%s'. Status ID does not exist.", status_id)
+            return False
+        user_id = _intern(user_id)
+        if status.user_id != user_id:
+            self._unindex(status.user_id, status_id)
+            self._index(user_id, status_id)
+            status.user_id = user_id
+        status.status_text = status_text
+        logging.info("Status with ID '%s' modified successfully.", status_id)
+        return True
+
+    def delete_status(self, status_id):
+        """
+        deletes the status message with id, status_id
+        """
+        status = self.database.pop(status_id, None)
+        if status is None:
+            logging.error("An error occurred while trying to delete status with ID '%s'. Status ID does not exist.", status_id)
+            return False
+        self._unindex(status.user_id, status_id)
+        logging.info("Status with ID '%s' deleted successfully.", status_id)
+        return True
+
+    def search_status(self, status_id):
+        """
+        Find and return a status message by its status_id
+
+        Returns an empty CompactUserStatus object if status_id does not exist
+        """
+        status = self.database.get(status_id)
+        if status is None:
+            logging.error("Status with ID '%s' not found during the search.", status_id)
+            return CompactUserStatus(None, None, None)
+        logging.info("Status with ID '%s' found during the search.", status_id)
+        return status
+
+    def user_status_ids(self, user_id):
+        """
+        Returns the status_ids of user_id, in insertion order
+        """
+        return list(self.user_index.get(user_id, ()))
+
+    def get_user_timeline(self, user_id, after_status_id=None, limit=20):
+        """
+        Returns up to limit status messages of user_id ordered by status_id,
+        starting after after_status_id when it is given
+        """
+        status_ids = sorted(status_id for status_id in self.user_index.get(user_id, ())
+                            if after_status_id is None or status_id > after_status_id)
+        return [{'status_id': status_id,
+                 'user_id': user_id,
+                 'status_text': self.database[status_id].status_text}
+                for status_id in status_ids[:limit]]
+
+    def iter_status_updates(self, user_id=None):
+        """
+        Yields (status_id, user_id, status_text) tuples of every status message,
+        or only of user_id
+        """
+        status_ids = self.database if user_id is None else self.user_index.get(user_id, ())
+        for status_id in status_ids:
+            status = self.database[status_id]
+            yield status.status_id, status.user_id, status.status_text
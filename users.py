@@ -1,15 +1,136 @@
 import logging
+import log_setup
+import metrics
+import weakref
 from peewee import *
+from fastpath import FastPath
+from lru_cache import LRUCache
 from socialnetwork_model import Users
 from socialnetwork_model import Status
+from socialnetwork_model import StatusIndex
+from socialnetwork_model import UserStats
+from socialnetwork_model import NetworkStats
+from socialnetwork_model import database
+from socialnetwork_model import use_profile
+from socialnetwork_model import SQLITE_MAX_VARIABLES
+from socialnetwork_model import numeric_status_id
+from socialnetwork_model import changed_values
+from socialnetwork_model import upsert
 
 
+# Default page size of get_user_timeline
+DEFAULT_TIMELINE_LIMIT = 20
+
+# Default number of results of search_status_text
+DEFAULT_SEARCH_LIMIT = 20
+
+# Default number of users returned by top_users
+DEFAULT_TOP_USERS = 10
+
+# Rows written per transaction by upsert_users and upsert_statuses
+DEFAULT_UPSERT_CHUNK_SIZE = 5000
+
+# Users removed per transaction by delete_users
+DEFAULT_DELETE_CHUNK_SIZE = 500
+
 # Configure the logging module
-logging.basicConfig(filename='log_07_20_2023.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+log_setup.configure_logging()
+
+# Caches of every live UserCollection and UserStatusCollection: a write
+# through any collection invalidates the rows it changed in all of them,
+# since they all read the same database
+_user_caches = weakref.WeakSet()
+_status_caches = weakref.WeakSet()
+
+
+def _invalidate_users(user_ids):
+    for cache in _user_caches:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+def _invalidate_statuses(status_ids):
+    for cache in _status_caches:
+        for status_id in status_ids:
+            cache.invalidate(str(status_id))
+
+
+def _invalidate_deleted(user_ids):
+    # Also drops the cached statuses of the users, removed with them
+    _invalidate_users(user_ids)
+    for cache in _status_caches:
+        cache.invalidate_where(
+            lambda _, status: status is not None and status['user_id'] in user_ids)
+
+
+def _copy(row):
+    # Cached rows are shared, hand callers their own copy
+    return dict(row) if row is not None else None
+
+
+def _search_many(ids, cache, cache_key, load_chunk):
+    """
+    Resolves a list of IDs with as few queries as possible.
+
+    IDs found in cache (if any) are served from it; the rest are passed to
+    load_chunk in chunks that fit in SQLite's bound-variable limit.
+    load_chunk(chunk) returns {cache_key(id): row} for the rows it found.
+    Returns {id: row or None} for every requested ID.
+    """
+    results = {}
+    pending = []
+    for item_id in dict.fromkeys(ids):
+        if cache is not None:
+            found, row = cache.lookup(cache_key(item_id))
+            if found:
+                results[item_id] = _copy(row)
+                continue
+        pending.append(item_id)
+    for chunk in chunked(pending, SQLITE_MAX_VARIABLES):
+        if cache is None:
+            rows = load_chunk(chunk)
+        else:
+            # Rows of IDs invalidated by a concurrent write are not cached
+            epoch = cache.begin_load()
+            try:
+                rows = load_chunk(chunk)
+            except BaseException:
+                cache.end_load(epoch)
+                raise
+            cache.end_load(epoch, {cache_key(item_id): rows.get(cache_key(item_id))
+                                   for item_id in chunk})
+        for item_id in chunk:
+            results[item_id] = _copy(rows.get(cache_key(item_id)))
+    return results
 
 
 class UserCollection:
+    def __init__(self, profile=None, cache_size=None, cache_ttl=None, fast_path=False):
+        # Optional process-wide database profile, see socialnetwork_model.use_profile
+        if profile is not None:
+            use_profile(profile)
+        # Optional read-through cache for search_user
+        self.cache = LRUCache(cache_size, cache_ttl) if cache_size else None
+        if self.cache is not None:
+            _user_caches.add(self.cache)
+            metrics.register_cache('users', self.cache)
+        # Optional raw sqlite3 access for add_user, delete_user and search_user
+        self.fast_path = FastPath(profile=profile) if fast_path else None
+
+    @metrics.instrument('UserCollection.add_user')
     def add_user(self, user_id, user_name, user_last_name, user_email):
+        if self.fast_path is not None:
+            added = self.fast_path.add_user(user_id, user_name, user_last_name, user_email)
+        else:
+            added = self._create_user(user_id, user_name, user_last_name, user_email)
+        if not added:
+            logging.error("An error occurred while trying to add a new user with ID '%s'. User already exists.", user_id)
+            return False
+        _invalidate_users([user_id])
+        logging.info("New user with ID '%s' added successfully.", user_id)
+        return True
+
+    def _create_user(self, user_id, user_name, user_last_name, user_email):
         try:
             Users.create(
                 user_id=user_id,
@@ -17,23 +138,108 @@ class UserCollection:
                 user_last_name=user_last_name,
                 user_email=user_email
             )
-            logging.info(f"New user with ID '{user_id}' added successfully.")
             return True
         except IntegrityError:
-            logging.error(f"An error occurred while trying to add a new user with ID '{user_id}'. User already exists.")
             return False
 
+    @metrics.instrument('UserCollection.add_users')
+    def add_users(self, rows):
+        """
+        Inserts a batch of users inside a single transaction.
+
+        rows is a sequence of dicts keyed by the Users field names. Rows whose
+        user_id already exists are skipped. Returns the number of rows inserted.
+        """
+        batch_size = SQLITE_MAX_VARIABLES // len(Users._meta.sorted_fields)
+        inserted = 0
+        with database.atomic():
+            for batch in chunked(rows, batch_size):
+                inserted += Users.insert_many(batch).on_conflict_ignore().as_rowcount().execute()
+        _invalidate_users([row['user_id'] for row in rows])
+        logging.info("Bulk insert of %s users: %s added.", len(rows), inserted)
+        return inserted
+
+    @metrics.instrument('UserCollection.modify_user')
+    def modify_user(self, user_id, user_name, user_last_name, user_email):
+        values = {'user_name': user_name, 'user_last_name': user_last_name, 'user_email': user_email}
+        # The WHERE on the values leaves an unchanged row, and its page, untouched
+        updated = (Users
+                   .update(values)
+                   .where((Users.user_id == user_id) & changed_values(Users, values))
+                   .execute())
+        if not updated and not Users.select().where(Users.user_id == user_id).exists():
+            logging.error("An error occurred while trying to modify user with ID '%s'. User does not exist.", user_id)
+            return False
+        _invalidate_users([user_id])
+        logging.info("User with ID '%s' modified successfully.", user_id)
+        return True
+
+    @metrics.instrument('UserCollection.upsert_users')
+    def upsert_users(self, rows, chunk_size=DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Adds new users and updates existing ones whose values differ, e.g. to
+        apply a full account file again. Existing users are never deleted, so
+        their status updates are kept.
+
+        rows is a sequence of dicts keyed by the Users field names.
+        Returns {'inserted': n, 'updated': n, 'unchanged': n}.
+        """
+        report = upsert(Users, rows, ('user_name', 'user_last_name', 'user_email'), chunk_size)
+        _invalidate_users([row['user_id'] for row in rows])
+        logging.info("Upsert of %s users: %s added, %s updated, %s unchanged.", len(rows),
+                     report['inserted'], report['updated'], report['unchanged'])
+        return report
+
+    @metrics.instrument('UserCollection.delete_user')
     def delete_user(self, user_id):
-        try:
-            user = Users.get(Users.user_id == user_id)
-            user.delete_instance()
-            logging.info(f"User with ID '{user_id}' deleted successfully.")
-            return True
-        except DoesNotExist:
-            logging.error(f"An error occurred while trying to delete user with ID '{user_id}'. User does not exist.")
+        if self.fast_path is not None:
+            deleted = self.fast_path.delete_user(user_id)
+        else:
+            deleted = self._delete_user(user_id)
+        if not deleted:
+            logging.error("An error occurred while trying to delete user with ID '%s'. User does not exist.", user_id)
             return False
+        _invalidate_deleted({user_id})
+        logging.info("User with ID '%s' deleted successfully.", user_id)
+        return True
 
+    def _delete_user(self, user_id):
+        # Statuses are deleted explicitly, through the (user_id, status_id)
+        # index, so this does not depend on the foreign_keys pragma
+        with database.atomic():
+            Status.delete().where(Status.user_id == user_id).execute()
+            return Users.delete().where(Users.user_id == user_id).execute() == 1
+
+    @metrics.instrument('UserCollection.delete_users')
+    def delete_users(self, user_ids, chunk_size=DEFAULT_DELETE_CHUNK_SIZE):
+        """
+        Deletes many users and all their status updates.
+
+        Each chunk of chunk_size users is removed with two set-based DELETE
+        statements in its own transaction, so the write lock is released
+        between chunks. Returns {'users': n, 'statuses': n} deleted.
+        """
+        report = {'users': 0, 'statuses': 0}
+        chunk_size = min(chunk_size, SQLITE_MAX_VARIABLES)
+        for chunk in chunked(list(dict.fromkeys(user_ids)), chunk_size):
+            with database.atomic():
+                report['statuses'] += Status.delete().where(Status.user_id.in_(chunk)).execute()
+                report['users'] += Users.delete().where(Users.user_id.in_(chunk)).execute()
+            _invalidate_deleted(set(chunk))
+        logging.info("Bulk delete of %s users: %s users and %s status updates deleted.",
+                     len(user_ids), report['users'], report['statuses'])
+        return report
+
+    @metrics.instrument('UserCollection.search_user')
     def search_user(self, user_id):
+        if self.cache is not None:
+            return _copy(self.cache.get_or_load(user_id, lambda: self._load_user(user_id)))
+        return self._load_user(user_id)
+
+    def _load_user(self, user_id):
+        if self.fast_path is not None:
+            user = self.fast_path.get_user(user_id)
+            return user._asdict() if user is not None else None
         try:
             user = Users.get(Users.user_id == user_id)
             return {
@@ -45,34 +251,326 @@ class UserCollection:
         except DoesNotExist:
             return None
 
+    @metrics.instrument('UserCollection.search_users')
+    def search_users(self, user_ids):
+        """
+        Looks up many users at once with chunked IN (...) queries.
+
+        Returns {user_id: user dict or None} for every requested user_id.
+        """
+        def load_chunk(chunk):
+            query = (Users
+                     .select(Users.user_id, Users.user_name, Users.user_last_name, Users.user_email)
+                     .where(Users.user_id.in_(chunk))
+                     .dicts())
+            return {row['user_id']: row for row in query}
+        return _search_many(user_ids, self.cache, lambda user_id: user_id, load_chunk)
+
+    def iter_users(self, user_id=None):
+        """
+        Yields (user_id, user_email, user_name, user_last_name) tuples of every
+        user, or only of user_id, streaming them from the database cursor.
+        """
+        query = Users.select(Users.user_id, Users.user_email, Users.user_name, Users.user_last_name)
+        if user_id is not None:
+            query = query.where(Users.user_id == user_id)
+        return query.order_by(Users.user_id).tuples().iterator()
+
+    @metrics.instrument('UserCollection.count_users')
+    def count_users(self):
+        """
+        Returns the number of users, read from the maintained network_stats counter
+        """
+        return NetworkStats.get_by_id('users').value
+
+    def atomic(self):
+        """
+        Returns a transaction (or savepoint) context on the collection's
+        database, used by the main.py loaders to commit a chunk at a time
+        """
+        return database.atomic()
+
+    def cache_info(self):
+        """
+        Returns the cache hit/miss/eviction counters, or None without a cache
+        """
+        return self.cache.stats() if self.cache is not None else None
+
 class UserStatusCollection:
+    def __init__(self, profile=None, cache_size=None, cache_ttl=None, fast_path=False):
+        # Optional process-wide database profile, see socialnetwork_model.use_profile
+        if profile is not None:
+            use_profile(profile)
+        # Optional read-through cache for search_status_update, keyed by str(status_id)
+        self.cache = LRUCache(cache_size, cache_ttl) if cache_size else None
+        if self.cache is not None:
+            _status_caches.add(self.cache)
+            metrics.register_cache('status', self.cache)
+        # Optional raw sqlite3 access for add, delete and search of single statuses
+        self.fast_path = FastPath(profile=profile) if fast_path else None
+
+    @metrics.instrument('UserStatusCollection.add_status_update')
     def add_status_update(self, user_id, status_text):
+        if self.fast_path is not None:
+            status_id = self.fast_path.add_status(user_id, status_text)
+        else:
+            status_id = self._create_status(user_id, status_text)
+        if status_id is None:
+            logging.error("An error occurred while trying to add a new status update. User with ID '%s' does not exist.", user_id)
+            return False
+        _invalidate_statuses([status_id])
+        logging.info("New status update added for user with ID '%s'.", user_id)
+        return True
+
+    @metrics.instrument('UserStatusCollection.add_status')
+    def add_status(self, status_id, user_id, status_text):
+        """
+        Adds a status update with the given status_id, like the dict-based
+        user_status.UserStatusCollection does, so that main.py works with
+        either. A status_id that is not a number (such as the
+        'Brittaney.Gentry86_00001' of the CSV files) is kept as the source_id
+        of a status update with a new status_id, as the bulk loaders do.
+        Returns False if status_id already exists or the user does not exist.
+        """
+        numeric_id = numeric_status_id(status_id)
+        try:
+            new_id = Status.insert(status_id=numeric_id, user_id=user_id, status_text=status_text,
+                                   source_id=None if numeric_id is not None else str(status_id)).execute()
+        except IntegrityError:
+            logging.error("An error occurred while trying to add a new status with ID '%s'. Status ID already exists or user with ID '%s' does not exist.", status_id, user_id)
+            return False
+        _invalidate_statuses([new_id])
+        logging.info("New status with ID '%s' added successfully.", status_id)
+        return True
+
+    def _create_status(self, user_id, status_text):
         try:
             user = Users.get(Users.user_id == user_id)
-            Status.create(user_id=user, status_text=status_text)
-            logging.info(f"New status update added for user with ID '{user_id}'.")
-            return True
+            return Status.create(user_id=user, status_text=status_text).status_id
         except DoesNotExist:
-            logging.error(f"An error occurred while trying to add a new status update. User with ID '{user_id}' does not exist.")
+            return None
+
+    @metrics.instrument('UserStatusCollection.known_user_ids')
+    def known_user_ids(self):
+        """
+        Returns the set of every user_id in the Users table, for validating
+        foreign keys of a bulk load in memory.
+        """
+        return {user_id for (user_id,) in Users.select(Users.user_id).tuples().iterator()}
+
+    @metrics.instrument('UserStatusCollection.add_status_updates')
+    def add_status_updates(self, rows):
+        """
+        Inserts a batch of status updates inside a single transaction.
+
+        rows is a sequence of dicts with 'user_id' (already validated) and
+        'status_text', and optionally 'status_id' and 'source_id'. A row
+        without a status_id gets a new one. Rows whose status_id or source_id
+        already exists are skipped. Returns the number of rows inserted.
+        """
+        rows = [{'status_id': row.get('status_id'), 'user_id': row['user_id'],
+                 'status_text': row['status_text'], 'source_id': row.get('source_id')}
+                for row in rows]
+        batch_size = SQLITE_MAX_VARIABLES // len(Status._meta.sorted_fields)
+        inserted = 0
+        with database.atomic():
+            for batch in chunked(rows, batch_size):
+                inserted += Status.insert_many(batch).on_conflict_ignore().as_rowcount().execute()
+        # The new status_ids are not known here, drop the cached misses
+        for cache in _status_caches:
+            cache.invalidate_where(lambda _, status: status is None)
+        logging.info("Bulk insert of %s status updates: %s added.", len(rows), inserted)
+        return inserted
+
+    @metrics.instrument('UserStatusCollection.modify_status')
+    def modify_status(self, status_id, user_id, status_text):
+        values = {'user_id': user_id, 'status_text': status_text}
+        try:
+            updated = (Status
+                       .update(values)
+                       .where((Status.status_id == status_id) & changed_values(Status, values))
+                       .execute())
+        except IntegrityError:
+            logging.error("An error occurred while trying to modify status update with ID '%s'. User with ID '%s' does not exist.", status_id, user_id)
+            return False
+        if not updated and not Status.select().where(Status.status_id == status_id).exists():
+            logging.error("An error occurred while trying to modify status update with ID '%s'. Status update does not exist.", status_id)
             return False
+        _invalidate_statuses([status_id])
+        logging.info("Status update with ID '%s' modified successfully.", status_id)
+        return True
+
+    @metrics.instrument('UserStatusCollection.upsert_statuses')
+    def upsert_statuses(self, rows, chunk_size=DEFAULT_UPSERT_CHUNK_SIZE):
+        """
+        Adds new status updates and updates existing ones whose values differ.
+
+        rows is a sequence of dicts with 'status_id', 'user_id' and 'status_text'.
+        Rows of a user_id that does not exist are rejected.
+        Returns {'inserted': n, 'updated': n, 'unchanged': n, 'rejected': n}.
+        """
+        known = set()
+        for chunk in chunked(list({row['user_id'] for row in rows}), SQLITE_MAX_VARIABLES):
+            known.update(user_id for (user_id,) in
+                         Users.select(Users.user_id).where(Users.user_id.in_(chunk)).tuples())
+        valid_rows = [row for row in rows if row['user_id'] in known]
+        report = upsert(Status, valid_rows, ('user_id', 'status_text'), chunk_size)
+        report['rejected'] = len(rows) - len(valid_rows)
+        _invalidate_statuses([row['status_id'] for row in valid_rows])
+        logging.info("Upsert of %s status updates: %s added, %s updated, %s unchanged, %s rejected.",
+                     len(rows), report['inserted'], report['updated'], report['unchanged'],
+                     report['rejected'])
+        return report
 
+    @metrics.instrument('UserStatusCollection.delete_status_update')
     def delete_status_update(self, status_id):
+        if self.fast_path is not None:
+            deleted = self.fast_path.delete_status(status_id)
+        else:
+            deleted = self._delete_status(status_id)
+        if not deleted:
+            logging.error("An error occurred while trying to delete status update with ID '%s'. Status update does not exist.", status_id)
+            return False
+        _invalidate_statuses([status_id])
+        logging.info("Status update with ID '%s' deleted successfully.", status_id)
+        return True
+
+    def _delete_status(self, status_id):
         try:
             status = Status.get(Status.status_id == status_id)
             status.delete_instance()
-            logging.info(f"Status update with ID '{status_id}' deleted successfully.")
             return True
         except DoesNotExist:
-            logging.error(f"An error occurred while trying to delete status update with ID '{status_id}'. Status update does not exist.")
             return False
 
+    @metrics.instrument('UserStatusCollection.search_status_update')
     def search_status_update(self, status_id):
+        if self.cache is not None:
+            return _copy(self.cache.get_or_load(
+                str(status_id), lambda: self._load_status_update(status_id)))
+        return self._load_status_update(status_id)
+
+    def _load_status_update(self, status_id):
+        if self.fast_path is not None:
+            status = self.fast_path.get_status(status_id)
+            return status._asdict() if status is not None else None
         try:
-            status = Status.get(Status.status_id == status_id)
-            return {
-                'status_id': status.status_id,
-                'user_id': status.user_id.user_id,
-                'status_text': status.status_text
-            }
+            # Selecting the raw user_id column avoids loading the Users row
+            return (Status
+                    .select(Status.status_id, Status.user_id, Status.status_text)
+                    .where(Status.status_id == status_id)
+                    .dicts()
+                    .get())
         except DoesNotExist:
             return None
+
+    # Names of the dict-based user_status.UserStatusCollection, used by main.py
+    delete_status = delete_status_update
+    search_status = search_status_update
+
+    @metrics.instrument('UserStatusCollection.search_status_updates')
+    def search_status_updates(self, status_ids):
+        """
+        Looks up many status updates at once with chunked IN (...) queries.
+
+        Returns {status_id: status dict or None} for every requested status_id.
+        """
+        def load_chunk(chunk):
+            query = (Status
+                     .select(Status.status_id, Status.user_id, Status.status_text)
+                     .where(Status.status_id.in_(chunk))
+                     .dicts())
+            return {str(row['status_id']): row for row in query}
+        return _search_many(status_ids, self.cache, str, load_chunk)
+
+    def iter_status_updates(self, user_id=None):
+        """
+        Yields (status_id, user_id, status_text) tuples of every status update,
+        or only of user_id, streaming them from the database cursor.
+        """
+        query = Status.select(Status.status_id, Status.user_id, Status.status_text)
+        if user_id is not None:
+            query = query.where(Status.user_id == user_id)
+        return query.order_by(Status.status_id).tuples().iterator()
+
+    def atomic(self):
+        """
+        Returns a transaction (or savepoint) context on the collection's
+        database, used by the main.py loaders to commit a chunk at a time
+        """
+        return database.atomic()
+
+    def cache_info(self):
+        """
+        Returns the cache hit/miss/eviction counters, or None without a cache
+        """
+        return self.cache.stats() if self.cache is not None else None
+
+    @metrics.instrument('UserStatusCollection.count_status_updates')
+    def count_status_updates(self, user_id=None):
+        """
+        Returns the number of status updates, of every user or only of user_id,
+        from the maintained user_stats/network_stats counters.
+        Returns None if user_id does not exist.
+        """
+        if user_id is None:
+            return NetworkStats.get_by_id('statuses').value
+        row = (UserStats
+               .select(UserStats.status_count)
+               .where(UserStats.user_id == user_id)
+               .tuples()
+               .first())
+        return row[0] if row is not None else None
+
+    @metrics.instrument('UserStatusCollection.top_users')
+    def top_users(self, limit=DEFAULT_TOP_USERS):
+        """
+        Returns up to limit (user_id, status_count) tuples of the users with the
+        most status updates, most active first. Ties are ordered by user_id.
+        """
+        return list(UserStats
+                    .select(UserStats.user_id, UserStats.status_count)
+                    .order_by(UserStats.status_count.desc(), UserStats.user_id)
+                    .limit(limit)
+                    .tuples())
+
+    @metrics.instrument('UserStatusCollection.get_user_timeline')
+    def get_user_timeline(self, user_id, after_status_id=None, limit=DEFAULT_TIMELINE_LIMIT):
+        """
+        Returns up to limit status updates of user_id, ordered by status_id, as
+        plain dicts with 'status_id', 'user_id' and 'status_text'.
+
+        Pages with a keyset cursor: pass the status_id of the last row of a page
+        as after_status_id to get the next one. Each page is a single range seek
+        on the (user_id, status_id) index, so deep pages cost the same as the first.
+        """
+        query = (Status
+                 .select(Status.status_id, Status.user_id, Status.status_text)
+                 .where(Status.user_id == user_id))
+        if after_status_id is not None:
+            query = query.where(Status.status_id > after_status_id)
+        return list(query.order_by(Status.status_id).limit(limit).dicts())
+
+    @metrics.instrument('UserStatusCollection.search_status_text')
+    def search_status_text(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Full-text search over status_text using the FTS5 index.
+
+        query uses the FTS5 query syntax (words, "phrases", OR, NOT, prefix*).
+        Returns up to limit dicts with 'status_id', 'user_id', 'snippet' and
+        'rank', best bm25 match first. Returns an empty list for a malformed query.
+        """
+        rank = StatusIndex.bm25()
+        snippet = fn.snippet(StatusIndex._meta.entity, 0, '[', ']', '...', 10)
+        try:
+            return list(StatusIndex
+                        .select(Status.status_id, Status.user_id,
+                                snippet.alias('snippet'), rank.alias('rank'))
+                        .join(Status, on=(Status.status_id == StatusIndex.rowid))
+                        .where(StatusIndex.match(query))
+                        .order_by(rank)
+                        .limit(limit)
+                        .dicts())
+        except OperationalError as error:
+            logging.error("Invalid status search query '%s': %s", query, error)
+            return []